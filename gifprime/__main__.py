@@ -3,17 +3,19 @@
 from PIL import Image as PILImage
 from argparse import ArgumentParser
 from contextlib import contextmanager
-import itertools
 import logging
+import multiprocessing
 import os
-import praw
 import random
-import requests
+import sys
 import time
 
+from gifprime import batch, raw, reddit, transcode
 from gifprime.core import GIF, Image
+from gifprime.quantize import QUANTIZERS, QuantizationCache
 from gifprime.util import readable_size
 from gifprime.viewer import GIFViewer
+import gifprime.stats
 
 LOG_LEVELS = {
     'info': logging.INFO,
@@ -37,11 +39,28 @@ def measure_time(label):
                  label, elapsed_sec, elapsed_clock)
 
 
+def crop_rectangle(value):
+    """Parse a crop rectangle given as LEFT,TOP,WIDTH,HEIGHT."""
+    rectangle = tuple(int(n) for n in value.split(','))
+    if len(rectangle) != 4:
+        raise ValueError('Expected LEFT,TOP,WIDTH,HEIGHT: {}'.format(value))
+    return rectangle
+
+
 def parse_args():
     """Parse arguments and start the program."""
     parser = ArgumentParser('gifprime')
     parser.add_argument('--log-level', default='none', choices=LOG_LEVELS,
                         help='logging level')
+    parser.add_argument('--frame-cache-mb', default=256, type=int,
+                        help='memory budget for the frames kept by the '
+                             'viewer')
+    parser.add_argument('--stats', action='store_true',
+                        help='print the time spent in each stage of decoding '
+                             'and encoding, or add it to batch results')
+    parser.add_argument('--memory', action='store_true',
+                        help='also measure the memory used by each stage and '
+                             'frame (implies --stats)')
     subparser = parser.add_subparsers()
 
     # Encoder
@@ -52,6 +71,20 @@ def parse_args():
                          help='frame delay in ms')
     encoder.add_argument('--loop-count', '-l', default=0, type=int,
                          help='0 for infinite (default)')
+    encoder.add_argument('--quantizer', '-q', default='octree',
+                         choices=sorted(QUANTIZERS),
+                         help='colour quantizer to use')
+    encoder.add_argument('--jobs', '-j', default=1, type=int,
+                         help='number of processes used to load frames and '
+                              'count colours (0 for one per CPU)')
+    encoder.add_argument('--sample-tolerance', type=float,
+                         help='build the palette from a growing sample of '
+                              'pixels until it changes by at most this much')
+    encoder.add_argument('--sample-time', type=float,
+                         help='seconds to spend growing the sample of pixels '
+                              'to build the palette from')
+    encoder.add_argument('--cache-dir',
+                         help='directory to cache quantization results in')
     encoder.set_defaults(command='encode')
 
     # Decoder
@@ -61,16 +94,98 @@ def parse_args():
                          choices=['auto', 'on', 'off'], default='auto')
     decoder.set_defaults(command='decode')
 
+    # Raw frame export
+    raw_decoder = subparser.add_parser(
+        'decode-to-raw', help='decode every frame of a gif into a raw frame '
+                              'stack file')
+    raw_decoder.add_argument('filename')
+    raw_decoder.add_argument('output', help='raw frame stack file to write')
+    raw_decoder.add_argument('--deinterlace', '-d',
+                             help='force deinterlacing',
+                             choices=['auto', 'on', 'off'], default='auto')
+    raw_decoder.set_defaults(command='decode-to-raw')
+
+    # Transcoder
+    transcoder = subparser.add_parser(
+        'transcode', help='re-encode a gif one frame at a time')
+    transcoder.add_argument('filename')
+    transcoder.add_argument('output', help='gif to write')
+    transcoder.add_argument('--colours', '-c', default=256, type=int,
+                            help='maximum number of colours in each frame')
+    transcoder.add_argument('--quantizer', '-q', default='octree',
+                            choices=sorted(QUANTIZERS),
+                            help='colour quantizer to use')
+    transcoder.add_argument('--delay-scale', default=1.0, type=float,
+                            help='multiply frame delays by this')
+    transcoder.add_argument('--frame-step', default=1, type=int,
+                            help='keep only every nth frame')
+    transcoder.add_argument('--crop', type=crop_rectangle,
+                            help='crop to LEFT,TOP,WIDTH,HEIGHT')
+    transcoder.add_argument('--serial', action='store_true',
+                            help='run every stage in one process')
+    transcoder.set_defaults(command='transcode')
+
     # Reddit Decoder
-    reddit = subparser.add_parser('reddit', help='get a gif from reddit')
-    reddit.add_argument('--subreddit', '-s', default='gifs')
-    reddit.add_argument('--retries', '-r', type=int, default=10,
-                        help='number of reddit submissions to try')
-    reddit.set_defaults(command='reddit')
+    redditor = subparser.add_parser('reddit', help='get a gif from reddit')
+    redditor.add_argument('--subreddit', '-s', default='gifs')
+    redditor.add_argument('--retries', '-r', type=int, default=10,
+                          help='number of reddit submissions to try')
+    redditor.add_argument('--connections', '-c', type=int, default=8,
+                          help='number of submissions to try at once')
+    redditor.add_argument('--timeout', type=float, default=reddit.TIMEOUT,
+                          help='seconds to wait for a server to respond')
+    redditor.add_argument('--reddit-url', default=reddit.REDDIT_URL,
+                          help='base URL of reddit')
+    redditor.set_defaults(command='reddit')
+
+    # Batch processing
+    batcher = subparser.add_parser(
+        'batch', help='decode, re-encode or validate many gifs without '
+                      'the viewer')
+    batcher.add_argument('paths', nargs='+',
+                         help='gifs, directories of gifs or glob patterns')
+    batcher.add_argument('--job', default='decode', choices=batch.JOBS,
+                         help='what to do with each gif')
+    batcher.add_argument('--jobs', '-j', default=1, type=int,
+                         help='number of processes (0 for one per CPU)')
+    batcher.add_argument('--quantizer', '-q', default='octree',
+                         choices=sorted(QUANTIZERS),
+                         help='colour quantizer to re-encode with')
+    batcher.add_argument('--output-dir',
+                         help='directory to write re-encoded gifs to')
+    batcher.add_argument('--output', '-o',
+                         help='file to write JSON lines to (default: stdout)')
+    batcher.set_defaults(command='batch')
 
     return parser.parse_args()
 
 
+def load_frame(filepath):
+    """Load an image as a string of RGBA bytes and its size."""
+    image = PILImage.open(filepath).convert('RGBA')
+    return image.tobytes(), image.size
+
+
+def load_frames(filepaths, processes=1):
+    """Yield the RGBA bytes and size of each image, in order.
+
+    Images are loaded in a pool of processes, or one per CPU if processes is
+    None.
+    """
+    if processes == 1:
+        for filepath in filepaths:
+            yield load_frame(filepath)
+        return
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        for frame in pool.imap(load_frame, filepaths):
+            yield frame
+    finally:
+        pool.close()
+        pool.join()
+
+
 def run_encoder(args):
     """Encode new GIF and open it in the viewer."""
     if args.output is None:
@@ -78,18 +193,26 @@ def run_encoder(args):
 
     gif = GIF()
 
-    for filepath in args.images:
-        image = PILImage.open(filepath).convert('RGBA')
-        rgba = image.tobytes()
-        rgba_data = zip(*[(ord(c) for c in rgba)] * 4)
-        gif.images.append(Image(rgba_data, image.size, args.delay))
+    with measure_time('load frames'):
+        for rgba, size in load_frames(args.images, args.jobs or None):
+            gif.images.append(Image.from_rgba_bytes(rgba, size, args.delay))
 
-    gif.size = image.size
+    gif.size = size
     gif.loop_count = args.loop_count
 
+    cache = (QuantizationCache(directory=args.cache_dir) if args.cache_dir
+             else None)
+
     with open(args.output, 'wb') as file_:
         with measure_time('encode'):
-            gif.save(file_)
+            gif.save(file_, quantizer=args.quantizer,
+                     processes=args.jobs or None,
+                     sample_tolerance=args.sample_tolerance,
+                     sample_time=args.sample_time,
+                     cache=cache)
+
+    if cache is not None:
+        logger.info('Quantization cache: %s', cache.stats)
 
     return decode(args.output)
 
@@ -101,42 +224,102 @@ def run_decoder(args):
     return decode(args.filename, force_deinterlace=force_deinterlace)
 
 
+def run_decode_to_raw(args):
+    """Decode GIF into a raw frame stack file, without the viewer."""
+    force_deinterlace = (None if args.deinterlace == 'auto'
+                         else args.deinterlace == 'on')
+    with measure_time('decode to raw'):
+        header = raw.decode_to_raw(args.filename, args.output,
+                                   force_deinterlace=force_deinterlace)
+    logger.info('Wrote %d frames of %dx%d to %s (data offset %d)',
+                header.num_frames, header.width, header.height, args.output,
+                header.data_offset)
+
+
+def run_transcode(args):
+    """Transcode GIF into a new GIF, without the viewer."""
+    if not 2 <= args.colours <= 256:
+        raise ValueError('Number of colours must be from 2 to 256')
+    with measure_time('transcode'):
+        num_frames = transcode.transcode(
+            args.filename, args.output, max_colours=args.colours,
+            quantizer=args.quantizer, delay_scale=args.delay_scale,
+            frame_step=args.frame_step, crop=args.crop,
+            parallel=not args.serial)
+    logger.info('Wrote %d frames to %s', num_frames, args.output)
+
+
 def run_reddit(args):
     """Grab a random GIF from reddit."""
-    client = praw.Reddit(user_agent='gifprime')
-    subreddit = client.get_subreddit(args.subreddit)
-
-    posts = list(itertools.islice(subreddit.search('url:.gif$'), args.retries))
+    session = reddit.make_session(args.connections)
+    posts = reddit.search_gifs(session, args.subreddit, args.retries,
+                               args.reddit_url, args.timeout)
     random.shuffle(posts)
 
-    for post in posts:
-        try:
-            response = requests.head(post.url)
-        except requests.ConnectionError:
-            continue
-
-        if (response.status_code == 200
-                and response.headers['content-type'] == 'image/gif'):
-            num_bytes = int(response.headers['content-length'])
-            logger.info('Found GIF: "%s" - %s - %s',
-                        post.title,
-                        readable_size(num_bytes),
-                        post.url)
-            return decode(post.url)
-    raise ValueError('Unable to find GIF on reddit')
-
-
-def decode(uri, benchmark=False, force_deinterlace=None):
-    """Given a URI, return a GIF."""
+    post, response = reddit.find_gif(session, posts, args.connections,
+                                     args.timeout)
+    if post is None:
+        raise ValueError('Unable to find GIF on reddit')
+
+    num_bytes = response.headers.get('content-length')
+    logger.info('Found GIF: "%s" - %s - %s',
+                post['title'],
+                readable_size(int(num_bytes)) if num_bytes else 'unknown size',
+                post['url'])
+    # download with the session, reusing the connection used to find the GIF
+    with measure_time('decode'):
+        return GIF.from_url(post['url'], session=session, progressive=True)
+
+
+def run_batch(args):
+    """Process many GIFs, writing the result for each as a JSON line.
+
+    Returns the number of files that failed.
+    """
+    filenames = batch.find_files(args.paths)
+    if args.output_dir is not None and not os.path.isdir(args.output_dir):
+        os.makedirs(args.output_dir)
+
+    results = batch.process_files(filenames, args.job,
+                                  processes=args.jobs or None,
+                                  quantizer=args.quantizer,
+                                  output_dir=args.output_dir)
+    with measure_time('batch'):
+        if args.output is None:
+            counts = batch.write_results(results, sys.stdout)
+        else:
+            with open(args.output, 'w') as file_:
+                counts = batch.write_results(results, file_)
+
+    logger.info('Processed %d files, %d failed (%d errors, %d invalid)',
+                counts['files'], counts['failed'], counts['errors'],
+                counts['invalid'])
+    return counts['failed']
+
+
+def decode(uri, benchmark=False, force_deinterlace=None, progressive=True):
+    """Given a URI, return a GIF.
+
+    By default the GIF is returned as soon as its header is parsed, and its
+    frames are decoded in the background.
+    """
     with measure_time('decode'):
         if uri.startswith('http'):
-            return GIF.from_url(uri, force_deinterlace=force_deinterlace)
+            return GIF.from_url(uri, force_deinterlace=force_deinterlace,
+                                progressive=progressive)
         elif os.path.isfile(uri):
-            return GIF.from_file(uri, force_deinterlace=force_deinterlace)
+            return GIF.from_file(uri, force_deinterlace=force_deinterlace,
+                                 progressive=progressive)
         else:
             raise ValueError('{} is not a filename or URL'.format(uri))
 
 
+def print_stats(gif, operation, stats):
+    """Print the stats of a finished decode or encode to stderr."""
+    sys.stderr.write('GIF<{}>: {} stats\n{}\n'.format(
+        gif.filename, operation, stats.format()))
+
+
 def print_exceptions(func):
     """Wrapper for function to print any tracebacks.
 
@@ -162,6 +345,19 @@ def main():
                         level=LOG_LEVELS[args.log_level])
     logging.getLogger('requests').propagate = False
 
+    if args.stats or args.memory:
+        gifprime.stats.enable(memory=args.memory)
+        # batch results include the stats instead
+        if args.command != 'batch':
+            gifprime.stats.add_hook(print_stats)
+
+    if args.command == 'batch':
+        sys.exit(1 if run_batch(args) else 0)
+    elif args.command == 'decode-to-raw':
+        return run_decode_to_raw(args)
+    elif args.command == 'transcode':
+        return run_transcode(args)
+
     # get a function that returns a gif
     if args.command == 'encode':
         load_gif_f = lambda: run_encoder(args)
@@ -171,7 +367,8 @@ def main():
         load_gif_f = lambda: run_reddit(args)
 
     # give the function to the gui, which will run it asynchronously
-    viewer = GIFViewer(print_exceptions(load_gif_f))
+    viewer = GIFViewer(print_exceptions(load_gif_f),
+                       cache_bytes=args.frame_cache_mb * 1024 * 1024)
     viewer.show()
 
 
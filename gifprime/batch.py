@@ -0,0 +1,230 @@
+"""Decode, re-encode or validate many GIFs without the viewer.
+
+Each file is processed independently, so files can be spread over a pool of
+processes. The result for each file is a dict that can be written as a JSON
+line.
+"""
+
+from StringIO import StringIO
+import glob
+import itertools
+import json
+import multiprocessing
+import os
+import time
+
+from gifprime.core import GIF
+from gifprime import lzw
+import gifprime.parser
+
+JOBS = ('decode', 'encode', 'validate')
+
+
+def find_files(paths):
+    """Return the GIFs given by a list of files, directories and globs."""
+    filenames = []
+    for path in paths:
+        if os.path.isdir(path):
+            filenames += sorted(glob.glob(os.path.join(path, '*.gif')))
+        elif os.path.isfile(path):
+            filenames.append(path)
+        else:
+            filenames += sorted(glob.glob(path))
+    return filenames
+
+
+def validate(filename):
+    """Return a list of problems with the frames of a GIF file, as stored.
+
+    The decoder composites every frame onto the whole screen and tolerates
+    some broken frames, so the blocks are checked before decoding: each
+    frame must lie inside the logical screen, have a colour table, and
+    decompress to one index per pixel that is in its colour table. The file
+    must have at least one frame and end with the trailer.
+    """
+    with open(filename, 'rb') as file_:
+        data = file_.read()
+    stream = StringIO(data)
+    try:
+        header = gifprime.parser.header.parse_stream(stream)
+    except Exception as e:
+        return ['could not parse header: {}'.format(e)]
+
+    problems = []
+    num_frames = 0
+    while True:
+        if stream.tell() >= len(data):
+            problems.append('no trailer')
+            break
+        position = stream.tell()
+        try:
+            block = gifprime.parser.block.parse_stream(stream)
+        except Exception as e:
+            problems.append('could not parse block at byte {}: {}'.format(
+                position, e))
+            break
+        if block.block_start == 0x3B:
+            break
+        if block.get('block_type') == 'image':
+            problems += _validate_frame(num_frames, block, header)
+            num_frames += 1
+
+    if not num_frames:
+        problems.append('no frames')
+    return problems
+
+
+def _validate_frame(i, block, header):
+    """Return a list of problems with the image block of frame i."""
+    problems = []
+    lsd = header.logical_screen_descriptor
+    descriptor = block.image_descriptor
+    if (descriptor.left + descriptor.width > lsd.logical_width or
+            descriptor.top + descriptor.height > lsd.logical_height):
+        problems.append(
+            'frame {} at ({}, {}) of {}x{} is outside the {}x{} screen'
+            .format(i, descriptor.left, descriptor.top, descriptor.width,
+                    descriptor.height, lsd.logical_width,
+                    lsd.logical_height))
+
+    try:
+        indices = ''.join(lzw.decompress(block.compressed_indices,
+                                         block.lzw_min))
+    except Exception as e:
+        problems.append('frame {} could not be decompressed: {}'.format(
+            i, e))
+        return problems
+    num_pixels = descriptor.width * descriptor.height
+    if len(indices) != num_pixels:
+        problems.append('frame {} has {} colour indices, expected {}'.format(
+            i, len(indices), num_pixels))
+
+    colour_table = block.lct if descriptor.lct_flag else header.gct
+    if colour_table is None:
+        problems.append('frame {} has no colour table'.format(i))
+    elif indices:
+        max_index = max(bytearray(indices))
+        if max_index >= len(colour_table):
+            problems.append(
+                'frame {} uses colour index {}, but its colour table has {} '
+                'colours'.format(i, max_index, len(colour_table)))
+    return problems
+
+
+def process_file(filename, job, quantizer='octree', output_dir=None):
+    """Run a job on a GIF and return a dict describing the result.
+
+    Every job parses the file and decodes each frame. The validate job first
+    checks the stored frames, see validate, and the encode job then
+    re-encodes the GIF, into output_dir if it is given. Seconds spent in each stage are given under
+    'timings', and any error stops the job and is given under 'error'.
+    If stats are being recorded, they are given under 'stats', and the
+    memory of the frames of each operation under 'frame_memory' if memory
+    is being measured. See gifprime.stats.
+    """
+    result = {
+        'filename': filename,
+        'job': job,
+        'timings': {},
+        'error': None,
+    }
+    stage = None
+    try:
+        if job == 'validate':
+            # before parsing, so problems are found even if decoding fails
+            stage = 'validate'
+            start = time.time()
+            result['problems'] = validate(filename)
+            result['timings']['validate'] = time.time() - start
+            result['valid'] = not result['problems']
+
+        stage = 'parse'
+        start = time.time()
+        result['input_bytes'] = os.path.getsize(filename)
+        gif = GIF.from_file(filename)
+        result['timings']['parse'] = time.time() - start
+
+        stage = 'decode'
+        start = time.time()
+        images = list(gif.images)
+        result['timings']['decode'] = time.time() - start
+        result['size'] = list(gif.size)
+        result['frames'] = len(images)
+        result['uncompressed_bytes'] = gif.uncompressed_size
+
+        _add_stats(result, gif)
+
+        if job == 'encode':
+            stage = 'encode'
+            start = time.time()
+            stream = StringIO()
+            gif.save(stream, quantizer=quantizer)
+            result['timings']['encode'] = time.time() - start
+            result['output_bytes'] = stream.tell()
+            _add_stats(result, gif)
+            if output_dir is not None:
+                stage = 'write'
+                start = time.time()
+                output = os.path.join(output_dir, os.path.basename(filename))
+                with open(output, 'wb') as file_:
+                    file_.write(stream.getvalue())
+                result['timings']['write'] = time.time() - start
+                result['output'] = output
+    except Exception as e:
+        result['error'] = '{}: {}'.format(type(e).__name__, e)
+        result['failed_stage'] = stage
+        if job == 'validate':
+            result['valid'] = False
+    return result
+
+
+def _add_stats(result, gif):
+    if gif.stats is not None:
+        result['stats'] = gif.stats.as_dict()
+        if gif.stats.memory is not None:
+            result['frame_memory'] = gif.stats.frame_summary()
+
+
+def _process_file(args):
+    filename, job, kwargs = args
+    return process_file(filename, job, **kwargs)
+
+
+def process_files(filenames, job, processes=1, **kwargs):
+    """Yield the result of running a job on each file, in completion order.
+
+    Files are processed in a pool of processes, or one per CPU if processes
+    is None. Other arguments are passed to process_file.
+    """
+    tasks = ((filename, job, kwargs) for filename in filenames)
+    if processes == 1:
+        for result in itertools.imap(_process_file, tasks):
+            yield result
+        return
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        for result in pool.imap_unordered(_process_file, tasks):
+            yield result
+    finally:
+        pool.close()
+        pool.join()
+
+
+def write_results(results, stream):
+    """Write results to stream as JSON lines, and return the counts.
+
+    Files fail if they have an error or are found to be invalid.
+    """
+    counts = {'files': 0, 'errors': 0, 'invalid': 0, 'failed': 0}
+    for result in results:
+        stream.write(json.dumps(result, sort_keys=True) + '\n')
+        stream.flush()
+        counts['files'] += 1
+        if result['error'] is not None:
+            counts['errors'] += 1
+        if result.get('valid') is False:
+            counts['invalid'] += 1
+        if result['error'] is not None or result.get('valid') is False:
+            counts['failed'] += 1
+    return counts
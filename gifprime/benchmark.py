@@ -0,0 +1,589 @@
+"""Benchmarks for gifprime.
+
+Usage information:
+    python -m gifprime.benchmark -h
+"""
+
+from PIL import Image as PILImage
+from StringIO import StringIO
+from argparse import ArgumentParser
+import gc
+import glob
+import json
+import math
+import os
+import random
+import sys
+import time
+
+from gifprime.core import GIF, Image, blit_rgba
+from gifprime.quantize import QUANTIZERS, quantize
+from gifprime.stats import RSSMemory, Stats, measure_memory
+from gifprime.util import readable_size
+from gifprime import corpus, lzw
+import gifprime.parser
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'test', 'data')
+
+# fraction by which throughput can fall below the baseline before a
+# benchmark counts as a regression
+DEFAULT_THRESHOLD = 0.2
+
+
+def load_rgb(filename):
+    """Load an image as a list of RGB tuples and its size."""
+    image = PILImage.open(filename).convert('RGB')
+    data = bytearray(image.tobytes())
+    return zip(data[0::3], data[1::3], data[2::3]), image.size
+
+
+def mean_squared_error(rgb_tuples, colour_list, colour_map):
+    """Return the mean squared error per component of quantized colours."""
+    total = 0
+    for r, g, b in rgb_tuples:
+        qr, qg, qb = colour_list[colour_map[(r, g, b)]]
+        total += (r - qr) ** 2 + (g - qg) ** 2 + (b - qb) ** 2
+    return float(total) / (3 * max(1, len(rgb_tuples)))
+
+
+def compare_quantizers(filenames, max_colours=256, quantizers=None):
+    """Time each quantizer on each image and measure its error.
+
+    Returns a list of dicts, one for each image and quantizer.
+    """
+    results = []
+    for filename in filenames:
+        rgb_tuples, size = load_rgb(filename)
+        megapixels = size[0] * size[1] / 1e6
+        for name in quantizers or sorted(QUANTIZERS):
+            start = time.time()
+            colour_list, colour_map = quantize(rgb_tuples, max_colours, name)
+            elapsed = time.time() - start
+            results.append({
+                'image': os.path.basename(filename),
+                'quantizer': name,
+                'colours': len(colour_list),
+                'seconds_per_megapixel': elapsed / megapixels,
+                'mse': mean_squared_error(rgb_tuples, colour_list,
+                                          colour_map),
+            })
+    return results
+
+
+def run_quantize(args):
+    """Print a comparison of the quantizers against the octree."""
+    filenames = args.images or sorted(
+        glob.glob(os.path.join(DATA_DIR, 'quantize_*.png')))
+    results = compare_quantizers(filenames, args.colours, args.quantizers)
+    octree = {r['image']: r for r in results if r['quantizer'] == 'octree'}
+
+    print '{:<30} {:<12} {:>7} {:>10} {:>9} {:>9}'.format(
+        'image', 'quantizer', 'colours', 's/MP', 'mse', 'vs octree')
+    for result in results:
+        reference = octree.get(result['image'])
+        print '{:<30} {:<12} {:>7} {:>10.3f} {:>9.2f} {:>9}'.format(
+            result['image'], result['quantizer'], result['colours'],
+            result['seconds_per_megapixel'], result['mse'],
+            '{:+.2f}'.format(result['mse'] - reference['mse'])
+            if reference else '-')
+
+
+def _timed(f, timings):
+    """Wrap f to append the ms taken by each call to timings."""
+    def _wrapper(*args, **kwargs):
+        start = time.time()
+        try:
+            return f(*args, **kwargs)
+        finally:
+            timings.append((time.time() - start) * 1000)
+    return _wrapper
+
+
+def _summary(values):
+    """Return the mean and maximum of values."""
+    if not values:
+        return 0.0, 0.0
+    return sum(values) / len(values), max(values)
+
+
+def benchmark_viewer(filename, num_frames=None, fps=60, scaled=False,
+                     window_size=None, show_info=False):
+    """Play a GIF in the viewer without a display, against a simulated clock.
+
+    Time advances by the real time taken to update and draw, plus whatever
+    the viewer waits for the next frame, so slow frames make later ones
+    late. Plays num_frames frame changes (default: one loop) and returns a
+    dict of statistics.
+    """
+    # must be set before the viewer initialises pygame
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    from gifprime.viewer import GIFViewer
+
+    viewer = GIFViewer(lambda: GIF.from_file(filename), fps=fps)
+    while viewer.is_loading:
+        viewer.check_loading()
+        time.sleep(0.001)
+    viewer.is_scaled = scaled
+    viewer.is_showing_info = show_info
+    if window_size:
+        viewer.size = window_size
+        viewer.set_screen()
+    if num_frames is None:
+        num_frames = len(viewer.gif.images)
+
+    surface_ms = []
+    draw_ms = []
+    viewer.frames.get_surface = _timed(viewer.frames.get_surface, surface_ms)
+    draw = _timed(viewer.draw, draw_ms)
+
+    # simulated time in ms
+    now = 0.0
+    last_update = 0.0
+    shown_at = None
+    shown_delay = None
+    shown_count = -1
+    # ms each frame was shown after it was due
+    lateness = []
+    while len(lateness) < num_frames:
+        loop_start = now
+        start = time.time()
+        viewer.update(now - last_update)
+        last_update = now
+        draw()
+        now += (time.time() - start) * 1000
+
+        if viewer.frames.shown_count != shown_count:
+            if shown_at is not None:
+                lateness.append(now - (shown_at + shown_delay))
+            shown_at = now
+            shown_delay = viewer.frame_delay
+            shown_count = viewer.frames.shown_count
+
+        wait = viewer.time_until_next_frame()
+        if wait is None:
+            break  # playback has finished
+        # the viewer's loop runs at most fps times a second
+        now = max(now + wait, loop_start + 1000.0 / fps)
+
+    mean_lateness, max_lateness = _summary(lateness)
+    jitter = math.sqrt(_summary([(l - mean_lateness) ** 2
+                                 for l in lateness])[0])
+    mean_surface_ms, max_surface_ms = _summary(surface_ms)
+    mean_draw_ms, max_draw_ms = _summary(draw_ms)
+    return {
+        'image': os.path.basename(filename),
+        'frames': len(lateness),
+        # a frame is missed if it is shown more than a refresh after its
+        # deadline
+        'deadline_misses': sum(1 for l in lateness if l > 1000.0 / fps),
+        'mean_lateness_ms': mean_lateness,
+        'max_lateness_ms': max_lateness,
+        'jitter_ms': jitter,
+        'mean_get_surface_ms': mean_surface_ms,
+        'max_get_surface_ms': max_surface_ms,
+        'mean_draw_ms': mean_draw_ms,
+        'max_draw_ms': max_draw_ms,
+        'peak_memory_bytes': RSSMemory().process_peak(),
+    }
+
+
+def run_viewer(args):
+    """Print playback statistics for the viewer."""
+    result = benchmark_viewer(args.image, args.frames, args.fps, args.scale,
+                              args.window_size, args.info)
+    print '{} frames of {}'.format(result['frames'], result['image'])
+    print 'deadline misses: {}'.format(result['deadline_misses'])
+    print 'lateness: {:.2f} ms mean, {:.2f} ms max, {:.2f} ms jitter'.format(
+        result['mean_lateness_ms'], result['max_lateness_ms'],
+        result['jitter_ms'])
+    print 'get_surface: {:.2f} ms mean, {:.2f} ms max'.format(
+        result['mean_get_surface_ms'], result['max_get_surface_ms'])
+    print 'draw: {:.2f} ms mean, {:.2f} ms max'.format(
+        result['mean_draw_ms'], result['max_draw_ms'])
+    print 'peak memory: {}'.format(
+        readable_size(result['peak_memory_bytes']))
+
+
+def window_size(value):
+    """Parse a window size given as WIDTHxHEIGHT."""
+    width, height = value.lower().split('x')
+    return int(width), int(height)
+
+
+class BenchmarkInput(object):
+    """A GIF to run the benchmark suite on.
+
+    The decoded forms of the GIF are built on first use, outside the timed
+    code.
+    """
+
+    def __init__(self, name, data):
+        self.name = name
+        # the encoded GIF
+        self.data = data
+        self._gif = None
+        self._image_blocks = None
+
+    @classmethod
+    def from_file(cls, filename):
+        with open(filename, 'rb') as file_:
+            return cls(os.path.basename(filename), file_.read())
+
+    @property
+    def gif(self):
+        """The decoded GIF, with every frame decoded."""
+        if self._gif is None:
+            self._gif = GIF(StringIO(self.data))
+            list(self._gif.images)
+        return self._gif
+
+    @property
+    def image_blocks(self):
+        """The parsed image blocks."""
+        if self._image_blocks is None:
+            parsed = gifprime.parser.gif.parse(self.data)
+            self._image_blocks = [block for block in parsed.body
+                                  if getattr(block, 'block_type', None)
+                                  == 'image']
+        return self._image_blocks
+
+    @property
+    def num_pixels(self):
+        """The number of pixels in every composited frame."""
+        return len(self.gif.images) * self.gif.size[0] * self.gif.size[1]
+
+
+def synthetic_input(size, num_frames=2, seed=0):
+    """Return a BenchmarkInput for a GIF with more than 256 colours.
+
+    Each frame is a gradient with noise, so it has to be quantized.
+    """
+    rng = random.Random(seed)
+    gif = GIF()
+    gif.size = (size, size)
+    for frame in xrange(num_frames):
+        rgba = bytearray(size * size * 4)
+        for y in xrange(size):
+            for x in xrange(size):
+                i = (y * size + x) * 4
+                rgba[i] = x * 255 // size
+                rgba[i + 1] = y * 255 // size
+                rgba[i + 2] = (rng.randrange(64) + frame * 32) % 256
+                rgba[i + 3] = 255
+        gif.images.append(Image.from_rgba_bytes(rgba, gif.size, 100))
+    stream = StringIO()
+    gif.save(stream)
+    return BenchmarkInput('synthetic-{}x{}'.format(size, size),
+                          stream.getvalue())
+
+
+def corpus_inputs(size, seed=0):
+    """Return a BenchmarkInput for every profile in gifprime.corpus."""
+    cases = []
+    for name in sorted(corpus.PROFILES):
+        stream = StringIO()
+        corpus.generate(stream, name, size, seed)
+        cases.append(BenchmarkInput(corpus.filename(name, size, seed),
+                                    stream.getvalue()))
+    return cases
+
+
+def bench_parse(case):
+    """Parse the whole file with parser.gif."""
+    gifprime.parser.gif.parse(case.data)
+    return len(case.data), case.num_pixels
+
+
+def bench_lzw_decompress(case):
+    """Decompress the colour indices of every frame."""
+    num_bytes = 0
+    for block in case.image_blocks:
+        num_bytes += len(''.join(lzw.decompress(block.compressed_indices,
+                                                block.lzw_min)))
+    return num_bytes, num_bytes
+
+
+def bench_lzw_compress(case):
+    """Compress the colour indices of every frame."""
+    # decompressing is not timed
+    indices = [(''.join(lzw.decompress(block.compressed_indices,
+                                       block.lzw_min)), block.lzw_min)
+               for block in case.image_blocks]
+    start = time.time()
+    for data, lzw_min in indices:
+        lzw.compress(data, lzw_min)
+    return len(''.join(data for data, _ in indices)), None, start
+
+
+def bench_decode(case):
+    """Decode and composite every frame."""
+    gif = GIF(StringIO(case.data))
+    list(gif.images)
+    return len(case.data), case.num_pixels
+
+
+def bench_blit_rgba(case):
+    """Blit every frame onto the previous one."""
+    gif = case.gif
+    prev = gif.images[0].rgba_data
+    for image in gif.images:
+        prev = blit_rgba(image.rgba_data, gif.size, (0, 0), prev, gif.size)
+    return case.num_pixels * 4, case.num_pixels
+
+
+def bench_quantize(case):
+    """Quantize the colours of every frame to 256."""
+    for image in case.gif.images:
+        quantize([pixel[:3] for pixel in image.rgba_data], 256)
+    return case.num_pixels * 3, case.num_pixels
+
+
+def bench_save(case):
+    """Encode the decoded GIF with GIF.save."""
+    stream = StringIO()
+    case.gif.save(stream)
+    return case.num_pixels * 4, case.num_pixels
+
+
+def bench_get_surface(case):
+    """Build a viewer surface for every frame."""
+    # the viewer initialises pygame's display, which must not need a window
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    from gifprime.viewer import LazyFrames
+    for image in case.gif.images:
+        image.release_rgba_bytes()
+    start = time.time()
+    frames = LazyFrames(case.gif, prefetch_count=0)
+    for i in xrange(len(case.gif.images)):
+        frames.get_surface(i)
+    return case.num_pixels * 4, case.num_pixels, start
+
+
+# name -> function that runs the benchmark on a BenchmarkInput. Each returns
+# the number of bytes and pixels processed, and optionally the time at which
+# timing should start, if it had to do some setup first.
+BENCHMARKS = {
+    'parse': bench_parse,
+    'lzw-decompress': bench_lzw_decompress,
+    'lzw-compress': bench_lzw_compress,
+    'decode': bench_decode,
+    'blit-rgba': bench_blit_rgba,
+    'quantize': bench_quantize,
+    'save': bench_save,
+    'get-surface': bench_get_surface,
+}
+
+
+def run_benchmark(benchmark, case, repeat=3):
+    """Run a benchmark on an input, and return the fastest of repeat runs.
+
+    Returns a dict with the seconds taken and throughput in MB/s and
+    megapixels/s.
+    """
+    best = None
+    for _ in xrange(repeat):
+        start = time.time()
+        result = benchmark(case)
+        elapsed = time.time() - (result[2] if len(result) > 2 else start)
+        if best is None or elapsed < best:
+            best = elapsed
+    num_bytes, num_pixels = result[:2]
+    # avoid dividing by zero for very fast runs
+    seconds = max(best, 1e-6)
+    return {
+        'seconds': best,
+        'mb_per_s': num_bytes / 1e6 / seconds,
+        'mp_per_s': num_pixels / 1e6 / seconds if num_pixels else None,
+    }
+
+
+def measure_benchmark_memory(benchmark, case):
+    """Run a benchmark on an input once, and return the memory it used.
+
+    Returns the most bytes in use above the start of the run, and the bytes
+    still in use after it. Run the benchmark first, so that memory for the
+    decoded forms of the input is not counted.
+    """
+    memory = measure_memory()
+    gc.collect()
+    start = memory.current()
+    memory.reset_peak()
+    benchmark(case)
+    peak = memory.peak() - start
+    gc.collect()
+    return peak, memory.current() - start
+
+
+def profile_memory(case):
+    """Decode and encode an input, and return the stats of each stage,
+    including memory.
+    """
+    stats = Stats(memory=True)
+    gif = GIF(StringIO(case.data), stats=stats)
+    list(gif.images)
+    gif.save(StringIO())
+    return stats
+
+
+def run_suite(cases, benchmarks=None, repeat=3, memory=False):
+    """Run benchmarks on every input.
+
+    Returns a dict of results keyed by 'benchmark:input'. If memory is True,
+    each benchmark is then run again to add its peak_bytes and
+    retained_bytes.
+    """
+    results = {}
+    names = benchmarks or sorted(BENCHMARKS)
+    for name in names:
+        for case in cases:
+            results['{}:{}'.format(name, case.name)] = run_benchmark(
+                BENCHMARKS[name], case, repeat)
+
+    # measured after every timing, as tracemalloc slows everything down
+    if memory:
+        for name in names:
+            for case in cases:
+                result = results['{}:{}'.format(name, case.name)]
+                result['peak_bytes'], result['retained_bytes'] = (
+                    measure_benchmark_memory(BENCHMARKS[name], case))
+    return results
+
+
+def find_regressions(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """Return results whose throughput is below the baseline's by more than
+    threshold, as (key, baseline MB/s, MB/s) tuples.
+
+    Results that are not in the baseline are ignored.
+    """
+    regressions = []
+    for key, result in sorted(results.iteritems()):
+        if key not in baseline:
+            continue
+        expected = baseline[key]['mb_per_s']
+        if result['mb_per_s'] < expected * (1 - threshold):
+            regressions.append((key, expected, result['mb_per_s']))
+    return regressions
+
+
+def run_benchmark_suite(args):
+    """Run the benchmark suite and compare it against a baseline."""
+    if args.images:
+        cases = [BenchmarkInput.from_file(filename)
+                 for filename in args.images]
+    else:
+        cases = [BenchmarkInput.from_file(filename) for filename in
+                 sorted(glob.glob(os.path.join(DATA_DIR, '*.gif')))]
+    if args.synthetic_size:
+        cases.append(synthetic_input(args.synthetic_size))
+    if args.corpus:
+        cases += corpus_inputs(args.corpus)
+
+    results = run_suite(cases, args.benchmarks, args.repeat, args.memory)
+
+    line_format = '{:<50} {:>10} {:>10} {:>10}'
+    headings = ['benchmark', 's', 'MB/s', 'MP/s']
+    if args.memory:
+        line_format += ' {:>12} {:>12}'
+        headings += ['peak bytes', 'kept bytes']
+    print line_format.format(*headings)
+    for key, result in sorted(results.iteritems()):
+        values = [key, '{:.4f}'.format(result['seconds']),
+                  '{:.3f}'.format(result['mb_per_s']),
+                  '{:.3f}'.format(result['mp_per_s'])
+                  if result['mp_per_s'] is not None else '-']
+        if args.memory:
+            values += [result['peak_bytes'], result['retained_bytes']]
+        print line_format.format(*values)
+
+    if args.memory:
+        for case in cases:
+            print
+            print '{} stages:'.format(case.name)
+            print profile_memory(case).format()
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as file_:
+            json.dump(results, file_, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as file_:
+            baseline = json.load(file_)
+        regressions = find_regressions(results, baseline, args.threshold)
+        for key, expected, actual in regressions:
+            print 'REGRESSION {}: {:.3f} MB/s, baseline {:.3f} MB/s'.format(
+                key, actual, expected)
+        if regressions:
+            sys.exit(1)
+
+
+def parse_args():
+    """Parse arguments."""
+    parser = ArgumentParser('gifprime.benchmark')
+    subparser = parser.add_subparsers()
+
+    quantizer = subparser.add_parser(
+        'quantize', help='compare quantizers on time and error')
+    quantizer.add_argument('images', nargs='*',
+                           help='images to quantize (default: quantize_*.png '
+                                'test images)')
+    quantizer.add_argument('--colours', '-c', default=256, type=int,
+                           help='maximum number of colours')
+    quantizer.add_argument('--quantizers', nargs='+', choices=QUANTIZERS,
+                           help='quantizers to compare (default: all)')
+    quantizer.set_defaults(func=run_quantize)
+
+    viewer = subparser.add_parser(
+        'viewer', help='play a GIF in the viewer without a display')
+    viewer.add_argument('image', help='GIF to play')
+    viewer.add_argument('--frames', '-n', type=int,
+                        help='number of frame changes to play (default: one '
+                             'loop)')
+    viewer.add_argument('--fps', default=60, type=int,
+                        help='maximum frame rate of the viewer')
+    viewer.add_argument('--scale', '-s', action='store_true',
+                        help='scale the GIF to fit the window')
+    viewer.add_argument('--window-size', type=window_size,
+                        help='window size as WIDTHxHEIGHT')
+    viewer.add_argument('--info', '-i', action='store_true',
+                        help='show the info overlay')
+    viewer.set_defaults(func=run_viewer)
+
+    suite = subparser.add_parser(
+        'suite', help='time every hot path and compare against a baseline')
+    suite.add_argument('images', nargs='*',
+                       help='GIFs to run on (default: the test GIFs)')
+    suite.add_argument('--benchmarks', nargs='+', choices=sorted(BENCHMARKS),
+                       help='benchmarks to run (default: all)')
+    suite.add_argument('--synthetic-size', default=512, type=int,
+                       help='size of the synthetic GIF to add to the images, '
+                            'or 0 for none')
+    suite.add_argument('--corpus', choices=sorted(corpus.SIZES),
+                       help='also run on every gifprime.corpus profile at '
+                            'this size')
+    suite.add_argument('--memory', '-m', action='store_true',
+                       help='also measure the memory used by each benchmark, '
+                            'and by each stage of decoding and encoding')
+    suite.add_argument('--repeat', '-r', default=3, type=int,
+                       help='number of times to run each benchmark, keeping '
+                            'the fastest')
+    suite.add_argument('--baseline', '-b',
+                       help='JSON results to compare against')
+    suite.add_argument('--threshold', '-t', default=DEFAULT_THRESHOLD,
+                       type=float,
+                       help='fraction by which throughput can fall below '
+                            'the baseline before failing')
+    suite.add_argument('--save-baseline', '-s',
+                       help='file to save the results to as JSON')
+    suite.set_defaults(func=run_benchmark_suite)
+
+    return parser.parse_args()
+
+
+def main():
+    """Main entry point."""
+    args = parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
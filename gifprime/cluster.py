@@ -0,0 +1,152 @@
+"""Colour quantizers that cluster colours using NumPy.
+
+Both quantizers take an (N, 3) array of colours, optionally with an (N,)
+array of weights so that a colour histogram can be used in place of every
+pixel. They return an (M, 3) palette of at most max_colours colours and an
+(N,) array with the index of the palette colour for each input colour.
+"""
+
+import numpy
+
+
+# Number of colours to assign to their nearest centroid at a time, to bound
+# the memory used by the (colours, centroids) distance matrix.
+ASSIGN_CHUNK_SIZE = 1 << 14
+
+
+def histogram_arrays(colour_counts):
+    """Return arrays of colours and weights for a colour histogram."""
+    colours = numpy.array(list(colour_counts), dtype=numpy.int64)
+    colours = colours.reshape(-1, 3)
+    weights = numpy.array([colour_counts[tuple(colour)]
+                           for colour in colours.tolist()], dtype=numpy.float64)
+    return colours, weights
+
+
+def _prepare(colours, weights):
+    colours = numpy.asarray(colours, dtype=numpy.float64).reshape(-1, 3)
+    if weights is None:
+        weights = numpy.ones(len(colours))
+    else:
+        weights = numpy.asarray(weights, dtype=numpy.float64)
+    return colours, weights
+
+
+def _weighted_means(colours, weights, labels, num_labels):
+    """Return the weighted mean colour of each label."""
+    totals = numpy.bincount(labels, weights, num_labels)
+    means = numpy.empty((num_labels, 3))
+    for i in xrange(3):
+        sums = numpy.bincount(labels, weights * colours[:, i], num_labels)
+        means[:, i] = sums / numpy.maximum(totals, 1e-12)
+    return means, totals
+
+
+def _to_palette(means):
+    return numpy.clip(numpy.rint(means), 0, 255).astype(numpy.uint8)
+
+
+def _compact(colours, weights, labels, num_labels):
+    """Drop unused labels and return the palette and the renumbered labels."""
+    used = numpy.unique(labels)
+    remap = numpy.zeros(num_labels, dtype=numpy.intp)
+    remap[used] = numpy.arange(len(used))
+    labels = remap[labels]
+    means, _ = _weighted_means(colours, weights, labels, len(used))
+    return _to_palette(means), labels
+
+
+def assign_nearest(colours, centroids):
+    """Return the index of the nearest centroid for each colour."""
+    colours = numpy.asarray(colours, dtype=numpy.float64).reshape(-1, 3)
+    centroids = numpy.asarray(centroids, dtype=numpy.float64)
+    centroid_norms = (centroids ** 2).sum(axis=1)
+    labels = numpy.empty(len(colours), dtype=numpy.intp)
+    for start in xrange(0, len(colours), ASSIGN_CHUNK_SIZE):
+        chunk = colours[start:start + ASSIGN_CHUNK_SIZE]
+        # |x - c|^2 without the |x|^2 term, which does not affect the argmin
+        distances = centroid_norms - 2 * chunk.dot(centroids.T)
+        labels[start:start + ASSIGN_CHUNK_SIZE] = distances.argmin(axis=1)
+    return labels
+
+
+def median_cut(colours, max_colours, weights=None):
+    """Quantize colours by repeatedly splitting the box with the widest range.
+
+    Boxes are split at the weighted median of their widest component.
+    """
+    colours, weights = _prepare(colours, weights)
+    labels = numpy.zeros(len(colours), dtype=numpy.intp)
+    if len(colours) == 0:
+        return numpy.zeros((0, 3), dtype=numpy.uint8), labels
+
+    def _range(box):
+        return colours[box].max(axis=0) - colours[box].min(axis=0)
+
+    boxes = [numpy.arange(len(colours))]
+    ranges = [_range(boxes[0])]
+    while len(boxes) < max_colours:
+        # find the box with the widest range of any component
+        widest = max(xrange(len(boxes)), key=lambda i: ranges[i].max())
+        if ranges[widest].max() == 0:
+            break  # every box holds a single colour
+        box = boxes[widest]
+        component = ranges[widest].argmax()
+
+        # split at the weighted median of that component
+        order = numpy.argsort(colours[box, component], kind='mergesort')
+        box = box[order]
+        values = colours[box, component]
+        cumulative = numpy.cumsum(weights[box])
+        split = numpy.searchsorted(cumulative, cumulative[-1] / 2.0) + 1
+        # do not split between equal values, or leave either half empty
+        split = min(split, len(box) - 1)
+        while split < len(box) and values[split] == values[split - 1]:
+            split += 1
+        if split == len(box):
+            split = numpy.searchsorted(values, values[-1])
+        halves = [box[:split], box[split:]]
+        boxes[widest:widest + 1] = halves
+        ranges[widest:widest + 1] = [_range(half) for half in halves]
+
+    for i, box in enumerate(boxes):
+        labels[box] = i
+    return _compact(colours, weights, labels, len(boxes))
+
+
+def kmeans(colours, max_colours, weights=None, batch_size=1024,
+           iterations=100, seed=0):
+    """Quantize colours using mini-batch k-means.
+
+    Centroids start at the median cut palette. Each iteration moves them
+    towards a batch of colours sampled in proportion to their weights, with
+    a per-centroid learning rate that decreases as it is updated.
+    """
+    colours, weights = _prepare(colours, weights)
+    if len(colours) <= max_colours:
+        return median_cut(colours, max_colours, weights)
+
+    centroids, _ = median_cut(colours, max_colours, weights)
+    centroids = centroids.astype(numpy.float64)
+    updates = numpy.zeros(len(centroids))
+    random = numpy.random.RandomState(seed)
+    probabilities = weights / weights.sum()
+
+    for _ in xrange(iterations):
+        batch = colours[random.choice(len(colours), batch_size,
+                                      p=probabilities)]
+        batch_labels = assign_nearest(batch, centroids)
+        counts = numpy.bincount(batch_labels, minlength=len(centroids))
+        updates += counts
+        for i in xrange(3):
+            sums = numpy.bincount(batch_labels, batch[:, i],
+                                  minlength=len(centroids))
+            # move each centroid towards the mean of its batch colours
+            moved = counts > 0
+            centroids[moved, i] += (
+                (sums[moved] - counts[moved] * centroids[moved, i]) /
+                updates[moved]
+            )
+
+    labels = assign_nearest(colours, centroids)
+    return _compact(colours, weights, labels, len(centroids))
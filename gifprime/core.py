@@ -1,16 +1,21 @@
 """Core GIF class and read/write methods."""
 
-from math import log, ceil
+from array import array
+from math import log
 import construct
 import itertools
 import logging
 import requests
 import struct
+import threading
 
 import gifprime.parser
-from gifprime.quantize import quantize
-from gifprime.util import LazyList
+from gifprime.quantize import (exact_palette, frames_histogram,
+                               gif_colour_table, has_alpha,
+                               progressive_sample, quantize_histogram)
+from gifprime.util import LazyList, StreamingList
 from gifprime import lzw
+import gifprime.stats
 
 logger = logging.getLogger(__name__)
 
@@ -63,6 +68,73 @@ class Image(object):
         # number of milliseconds to show this frame, or 0 if not set
         self.delay_ms = delay_ms
 
+    @classmethod
+    def from_rgba_bytes(cls, rgba_bytes, size, delay_ms):
+        """Create an image from a buffer of RGBA bytes, row by row.
+
+        rgba_bytes can be a string, such as the result of PIL's tobytes(), or
+        any object with the buffer interface, such as a contiguous NumPy
+        array of uint8. It is not unpacked unless rgba_data is used.
+        """
+        if not isinstance(rgba_bytes, str):
+            rgba_bytes = str(buffer(rgba_bytes))
+        if len(rgba_bytes) != size[0] * size[1] * 4:
+            raise ValueError('expected {} bytes for a {}x{} image, got {}'
+                             .format(size[0] * size[1] * 4, size[0], size[1],
+                                     len(rgba_bytes)))
+        image = cls(None, size, delay_ms)
+        image._rgba_bytes = rgba_bytes
+        return image
+
+    @property
+    def rgba_data(self):
+        """List of RGBA tuples, one for each pixel.
+
+        Built from rgba_bytes on first use if the image was created from
+        bytes.
+        """
+        if self._rgba_data is None and self._rgba_bytes is not None:
+            data = bytearray(self._rgba_bytes)
+            self._rgba_data = zip(data[0::4], data[1::4], data[2::4],
+                                  data[3::4])
+        return self._rgba_data
+
+    @rgba_data.setter
+    def rgba_data(self, rgba_data):
+        self._rgba_data = rgba_data
+        self._rgba_bytes = None
+
+    @property
+    def rgba_bytes(self):
+        """The pixels as one contiguous string of RGBA bytes.
+
+        Built from rgba_data on first use.
+        """
+        if self._rgba_bytes is None:
+            self._rgba_bytes = array('B', itertools.chain.from_iterable(
+                self._rgba_data)).tostring()
+        return self._rgba_bytes
+
+    def release_rgba_bytes(self):
+        """Forget rgba_bytes to free memory. It is rebuilt when next used.
+
+        Does nothing if the image only has its pixels as bytes.
+        """
+        if self._rgba_data is not None:
+            self._rgba_bytes = None
+
+    def release(self):
+        """Forget the pixels to free memory.
+
+        GIF.release_image also lets decoded frames be got back.
+        """
+        self._rgba_data = None
+        self._rgba_bytes = None
+
+    @property
+    def is_released(self):
+        return self._rgba_data is None and self._rgba_bytes is None
+
 
 class GIF(object):
     """A GIF image or animation."""
@@ -70,15 +142,27 @@ class GIF(object):
     @classmethod
     def from_file(cls, filename, **kwargs):
         """Load GIF from the given filename."""
+        if kwargs.get('progressive'):
+            # the file is closed once it has been read
+            return cls(open(filename, 'rb'), filename=filename, **kwargs)
         with open(filename, 'rb') as stream:
             return cls(stream, filename=filename, **kwargs)
 
     @classmethod
-    def from_url(cls, url, **kwargs):
-        """Load GIF from the given URL."""
-        res = requests.get(url, stream=True)
+    def from_url(cls, url, session=None, **kwargs):
+        """Load GIF from the given URL.
+
+        If session is given, the GIF is downloaded with that requests session.
+        """
+        res = (session or requests).get(url, stream=True)
+        return cls.from_response(res, **kwargs)
+
+    @classmethod
+    def from_response(cls, res, **kwargs):
+        """Load GIF from a requests response whose body has not been read."""
         if res.headers['content-type'] != 'image/gif':
-            raise ValueError('Content type is not image/gif: {}'.format(url))
+            raise ValueError('Content type is not image/gif: {}'.format(
+                res.url))
 
         # XXX: Apparently reading 0 bytes causes some operating systems to
         #      close the file descriptor. We are not sure why Construct ever
@@ -89,11 +173,43 @@ class GIF(object):
 
         return cls(res.raw, res.url.rsplit('/', 1)[-1], **kwargs)
 
-    def __init__(self, stream=None, filename=None, force_deinterlace=None):
+    @classmethod
+    def from_blocks(cls, header, blocks, filename=None, force_deinterlace=None,
+                    stats=None):
+        """Decode a GIF from its parsed header and an iterable of blocks.
+
+        images is an iterator that decodes each frame as it is needed, as if
+        streaming were passed to the constructor.
+        """
+        gif = cls(filename=filename, stats=stats)
+        gct, bg_colour = gif._read_header(header)
+        gif.is_loading = True
+        gif.images = gif._generate_images(blocks, gct, bg_colour,
+                                          force_deinterlace)
+        return gif
+
+    def __init__(self, stream=None, filename=None, force_deinterlace=None,
+                 progressive=False, streaming=False, stats=None):
         """Create a new GIF or decode one from a file-like object.
 
         filename is only used to optionally set the name of the file the GIF
         was loaded from.
+
+        If progressive is True, only the header is parsed before returning.
+        The rest of the stream is parsed and decoded in a background thread,
+        and then closed. images holds the frames decoded so far, and getting
+        a frame that has not been decoded yet waits for it.
+
+        If streaming is True, only the header is parsed before returning, and
+        images is an iterator that parses and decodes each frame from the
+        stream as it is needed. Frames are not kept, so memory use does not
+        grow with the number of frames.
+
+        Otherwise, the parsed blocks are kept, so that frames whose pixels
+        are released can be decoded again. See release_image.
+
+        If stats is True, or None and recording is enabled, the time spent in
+        each stage of decoding is recorded in self.stats. See gifprime.stats.
         """
         self.images = []
         self.comment = None
@@ -102,185 +218,345 @@ class GIF(object):
         # number of times to show the animation, or 0 to loop forever
         self.loop_count = 1
         self.is_loading = False
+        self.compressed_size = 0
+        self.uncompressed_size = 0
+        # number of frames decoded so far, not counting reloads
+        self.num_decoded = 0
+        # parsed blocks kept to decode released frames again, or None if
+        # they are not kept
+        self._blocks = None
+        self._decode_args = None
+        # frames being decoded again, and the index of the last one
+        self._reloads = None
+        self._reload_index = None
+        # held while releasing or reloading pixels
+        self._reload_lock = threading.Lock()
+        # a gifprime.stats.Stats, or None if stats are not being recorded
+        self.stats = gifprime.stats.create(stats)
 
         if stream is not None:
             logger.info('GIF<%s>: Started parsing input stream', self.filename)
-            parsed_data = gifprime.parser.gif.parse_stream(stream)
-            logger.info('GIF<%s>: Finished parsing input stream',
-                        self.filename)
+            stats = self.stats or gifprime.stats.NULL_STATS
+            t = stats.start()
+            position = self._tell(stream)
+            header = gifprime.parser.header.parse_stream(stream)
+            stats.record('parse', t, self._tell(stream) - position)
+            gct, bg_colour = self._read_header(header)
+            self._decode_args = (gct, bg_colour, force_deinterlace)
 
-            lsd = parsed_data.logical_screen_descriptor
-            self.size = (lsd.logical_width, lsd.logical_height)
-
-            if lsd.gct_flag:
-                gct = parsed_data.gct
-                # Modern GIF implementations disregard the spec and use
-                # transparency as the background colour. This is significant
-                # for the prev and bg disposal methods. The 'correct' code is
-                # commented out below:
-                # bg_colour = tuple(gct[lsd.bg_col_index]) + (255,)
-                bg_colour = (0, 0, 0, 0)
+            def generate_images(blocks):
+                return self._generate_images(blocks, *self._decode_args)
+
+            self.is_loading = True
+            if streaming:
+                self.images = generate_images(self._parse_blocks(stream))
+            elif progressive:
+                self.images = StreamingList()
+                self._blocks = []
+                blocks = self._parse_blocks(stream, keep=self._blocks)
+                thread = threading.Thread(
+                    target=self._load_progressively,
+                    args=(generate_images(blocks), stream),
+                )
+                thread.daemon = True
+                thread.start()
             else:
-                gct = None
-                # the spec does not define what this should be
-                bg_colour = (0, 0, 0, 255)
+                blocks = list(self._parse_blocks(stream))
+                logger.info('GIF<%s>: Finished parsing input stream',
+                            self.filename)
+                num_images = len([block for block in blocks
+                                  if getattr(block, 'block_type', None)
+                                  == 'image'])
+                self._blocks = blocks
+                self.images = LazyList(generate_images(blocks), num_images)
 
-            def generate_images():
-                # the most recent GCE block since the last image block.
-                active_gce = None
+    def _read_header(self, header):
+        """Set the size from a parsed header.
 
-                # initialize the previous state
-                prev_state = [bg_colour] * (self.size[0] * self.size[1])
+        Returns the global colour table and the background colour.
+        """
+        lsd = header.logical_screen_descriptor
+        self.size = (lsd.logical_width, lsd.logical_height)
+
+        if lsd.gct_flag:
+            gct = header.gct
+            # Modern GIF implementations disregard the spec and use
+            # transparency as the background colour. This is significant
+            # for the prev and bg disposal methods. The 'correct' code is
+            # commented out below:
+            # bg_colour = tuple(gct[lsd.bg_col_index]) + (255,)
+            bg_colour = (0, 0, 0, 0)
+        else:
+            gct = None
+            # the spec does not define what this should be
+            bg_colour = (0, 0, 0, 255)
+        return gct, bg_colour
 
-                num_images = 0
-                logger.info('GIF<%s>: Started decoding image frames',
-                            self.filename)
+    def _generate_images(self, blocks, gct, bg_colour, force_deinterlace,
+                         reload=False):
+        """Decode and composite images from the parsed blocks.
 
-                for block in parsed_data.body:
-                    if 'block_type' not in block:  # it's just the terminator
-                        pass
-                    elif block.block_type == 'image':
-
-                        lct = (block.lct if block.image_descriptor.lct_flag
-                               else None)
-
-                        # Select the active colour table.
-                        if lct is not None:
-                            active_colour_table = lct
-                        elif gct is not None:
-                            active_colour_table = gct
-                        else:
-                            # TODO: Spec says we can use a default colour table
-                            # in this case.
-                            raise NotImplementedError('No colour table')
-
-                        # set transparency index
-                        if active_gce is not None:
-                            if active_gce.transparent_colour_flag:
-                                trans_index = (
-                                    active_gce.transparent_colour_index
-                                )
-                            else:
-                                trans_index = None
-                            delay_ms = active_gce.delay_time * 10
-                            disposal_method = active_gce.disposal_method
-                        else:
-                            trans_index = None
-                            delay_ms = 0
-                            disposal_method = 0
-
-                        # If not specified, deinterlace the images only if
-                        # necessary.
-                        if force_deinterlace is None:
-                            deinterlace = block.image_descriptor.interlace_flag
-                        else:
-                            deinterlace = force_deinterlace
-
-                        # get the decompressed colour indices
-                        indices_bytes = ''.join(lzw.decompress(
-                            block.compressed_indices, block.lzw_min))
-                        indices = struct.unpack(
-                            '{}B'.format(len(indices_bytes)), indices_bytes
+        If reload is True, the images are being decoded again, so nothing
+        about the GIF is updated or recorded.
+        """
+        # the most recent GCE block since the last image block.
+        active_gce = None
+
+        # initialize the previous state
+        prev_state = [bg_colour] * (self.size[0] * self.size[1])
+
+        stats = ((not reload and self.stats) or
+                 gifprime.stats.NULL_STATS)
+
+        num_images = 0
+        logger.info('GIF<%s>: Started decoding image frames',
+                    self.filename)
+
+        for block in blocks:
+            if 'block_type' not in block:  # it's just the terminator
+                pass
+            elif block.block_type == 'image':
+                stats.start_frame()
+
+                lct = (block.lct if block.image_descriptor.lct_flag
+                       else None)
+
+                # Select the active colour table.
+                if lct is not None:
+                    active_colour_table = lct
+                elif gct is not None:
+                    active_colour_table = gct
+                else:
+                    # TODO: Spec says we can use a default colour table
+                    # in this case.
+                    raise NotImplementedError('No colour table')
+
+                # set transparency index
+                if active_gce is not None:
+                    if active_gce.transparent_colour_flag:
+                        trans_index = (
+                            active_gce.transparent_colour_index
                         )
+                    else:
+                        trans_index = None
+                    delay_ms = active_gce.delay_time * 10
+                    disposal_method = active_gce.disposal_method
+                else:
+                    trans_index = None
+                    delay_ms = 0
+                    disposal_method = 0
+
+                # If not specified, deinterlace the images only if
+                # necessary.
+                if force_deinterlace is None:
+                    deinterlace = block.image_descriptor.interlace_flag
+                else:
+                    deinterlace = force_deinterlace
+
+                # get the decompressed colour indices
+                t = stats.start()
+                indices_bytes = ''.join(lzw.decompress(
+                    block.compressed_indices, block.lzw_min))
+                indices = struct.unpack(
+                    '{}B'.format(len(indices_bytes)), indices_bytes
+                )
+                t = stats.record('lzw', t, len(block.compressed_indices),
+                                 len(indices))
+
+                # de-interlace the colour indices if necessary
+                if deinterlace:
+                    indices = tuple(self._de_interlace(
+                        indices,
+                        block.image_descriptor.height,
+                        block.image_descriptor.width,
+                    ))
+                    t = stats.record('deinterlace', t, len(indices),
+                                     len(indices))
+
+                # interpret colour indices
+                rgba_data = [
+                    tuple(active_colour_table[i]) +
+                    ((0,) if i == trans_index else (255,))
+                    for i in indices
+                ]
+                t = stats.record('palette', t, len(indices), len(indices))
+
+                image_size = (block.image_descriptor.width,
+                              block.image_descriptor.height)
+                image_pos = (block.image_descriptor.left,
+                             block.image_descriptor.top)
+
+                new_state = blit_rgba(rgba_data, image_size, image_pos,
+                                      prev_state, self.size)
+                # the frame is kept as bytes, which take a fraction of the
+                # memory of a list of tuples
+                image = Image.from_rgba_bytes(array('B', itertools.chain
+                                                    .from_iterable(new_state))
+                                              .tostring(),
+                                              self.size, delay_ms)
+                t = stats.record('compose', t, len(rgba_data) * 4,
+                                 len(new_state))
+
+                if disposal_method in [0, 1]:
+                    # disposal method is unspecified or none
+                    # do not restore the previous frame in any way
+                    prev_state = new_state
+                elif disposal_method == 2:
+                    # disposal method is background
+                    # restore the used area to the background colour
+                    fill_rgba = ([bg_colour] *
+                                 (image_size[0] * image_size[1]))
+                    prev_state = blit_rgba(
+                        fill_rgba, image_size, image_pos, new_state,
+                        self.size, transparency=False
+                    )
+                elif disposal_method == 3:
+                    # disposal method is previous
+                    # restore to previous frame after drawing on it
+                    pass # prev_state is unchanged
+                else:
+                    raise ValueError('Unknown disposal method: {}'
+                                     .format(disposal_method))
+                disposed_pixels = (len(rgba_data) if disposal_method == 2
+                                   else 0)
+                stats.record('disposal', t, disposed_pixels * 4,
+                             disposed_pixels)
+
+                if not reload:
+                    self.uncompressed_size += image_size[0] * image_size[1]
+                    self.num_decoded += 1
+
+                # don't hold on to the frame's working data while the caller
+                # has the image
+                del indices_bytes, indices, rgba_data
+                stats.end_frame('decode', len(new_state))
+
+                num_images += 1
+                logger.debug('GIF<%s>: Decoded frame %d',
+                             self.filename, num_images)
+
+                yield image
+
+                # the GCE goes out of scope after being used once
+                active_gce = None
 
-                        # de-interlace the colour indices if necessary
-                        if deinterlace:
-                            indices = self._de_interlace(
-                                indices,
-                                block.image_descriptor.height,
-                                block.image_descriptor.width,
-                            )
-
-                        # interpret colour indices
-                        rgba_data = [
-                            tuple(active_colour_table[i]) +
-                            ((0,) if i == trans_index else (255,))
-                            for i in indices
-                        ]
-
-                        image_size = (block.image_descriptor.width,
-                                      block.image_descriptor.height)
-                        image_pos = (block.image_descriptor.left,
-                                     block.image_descriptor.top)
-
-                        new_state = blit_rgba(rgba_data, image_size, image_pos,
-                                              prev_state, self.size)
-
-                        if disposal_method in [0, 1]:
-                            # disposal method is unspecified or none
-                            # do not restore the previous frame in any way
-                            prev_state = new_state
-                        elif disposal_method == 2:
-                            # disposal method is background
-                            # restore the used area to the background colour
-                            fill_rgba = ([bg_colour] *
-                                         (image_size[0] * image_size[1]))
-                            prev_state = blit_rgba(
-                                fill_rgba, image_size, image_pos, new_state,
-                                self.size, transparency=False
-                            )
-                        elif disposal_method == 3:
-                            # disposal method is previous
-                            # restore to previous frame after drawing on it
-                            pass # prev_state is unchanged
-                        else:
-                            raise ValueError('Unknown disposal method: {}'
-                                             .format(disposal_method))
-
-                        image = Image(new_state, image_size, delay_ms)
-                        self.uncompressed_size += image_size[0] * image_size[1]
-
-                        num_images += 1
-                        logger.debug('GIF<%s>: Decoded frame %d',
-                                     self.filename, num_images)
-
-                        yield image
-
-                        # the GCE goes out of scope after being used once
-                        active_gce = None
-
-                    elif block.block_type == 'gce':
-                        active_gce = block
-                    elif block.block_type == 'comment':
-                        # If there are multiple comment blocks, we ignore all
-                        # but the last (this is unspecified behaviour).
-                        self.comment = block.comment
-                    elif block.block_type == 'application':
-                        if (block.app_id == 'NETSCAPE' and
-                            block.app_auth_code == '2.0'):
-                            contents = construct.Struct(
-                                'loop',
-                                construct.ULInt8('id'),
-                                construct.ULInt16('count'),
-                            ).parse(block.app_data)
-                            if contents.id == 1:
-                                self.loop_count = (
-                                    contents.count + 1 if contents.count != 0
-                                    else 0
-                                )
-                            else:
-                                logger.debug(
-                                    'Found unknown NETSCAPE extension id: %s',
-                                    contents.id,
-                                )
-                        else:
-                            logger.debug('Found unknown app extension: %s',
-                                         (block.app_id, block.app_auth_code))
+            elif block.block_type == 'gce':
+                active_gce = block
+            elif block.block_type == 'comment':
+                # If there are multiple comment blocks, we ignore all
+                # but the last (this is unspecified behaviour).
+                self.comment = block.comment
+            elif block.block_type == 'application':
+                if (block.app_id == 'NETSCAPE' and
+                    block.app_auth_code == '2.0'):
+                    contents = construct.Struct(
+                        'loop',
+                        construct.ULInt8('id'),
+                        construct.ULInt16('count'),
+                    ).parse(block.app_data)
+                    if contents.id == 1:
+                        self.loop_count = (
+                            contents.count + 1 if contents.count != 0
+                            else 0
+                        )
                     else:
-                        logger.debug('Found unknown extension block: %s',
-                                     hex(block.ext_label))
+                        logger.debug(
+                            'Found unknown NETSCAPE extension id: %s',
+                            contents.id,
+                        )
+                else:
+                    logger.debug('Found unknown app extension: %s',
+                                 (block.app_id, block.app_auth_code))
+            else:
+                logger.debug('Found unknown extension block: %s',
+                             hex(block.ext_label))
 
-                self.is_loading = False
-                logger.info('GIF<%s>: Finished decoding image frames',
-                            self.filename)
+        if reload:
+            return
+        self.is_loading = False
+        logger.info('GIF<%s>: Finished decoding image frames',
+                    self.filename)
+        if self.stats is not None:
+            gifprime.stats.run_hooks(self, 'decode', self.stats)
 
-            self.is_loading = True
-            num_images = len([block for block in parsed_data.body
-                              if getattr(block, 'block_type', None) == 'image'])
-            self.images = LazyList(generate_images(), num_images)
 
-        self.compressed_size = stream.tell() if stream is not None else 0
-        self.uncompressed_size = 0
+    def _parse_blocks(self, stream, keep=None):
+        """Parse blocks from stream, up to and including the trailer.
+
+        If keep is a list, each block is also appended to it.
+        """
+        stats = self.stats or gifprime.stats.NULL_STATS
+        while True:
+            t = stats.start()
+            position = self._tell(stream)
+            block = gifprime.parser.block.parse_stream(stream)
+            stats.record('parse', t, self._tell(stream) - position)
+            if keep is not None:
+                keep.append(block)
+            if block.block_start == 0x3B:
+                self.compressed_size = stream.tell()
+                yield block
+                return
+            yield block
+
+    def release_image(self, i):
+        """Free the memory used by the pixels of images[i].
+
+        If the parsed blocks are kept, the pixels are released, and
+        rgba_bytes decodes them again when they are next needed. Otherwise
+        only the image's rgba_bytes are released.
+        """
+        with self._reload_lock:
+            if self._blocks is not None:
+                self.images[i].release()
+            else:
+                self.images[i].release_rgba_bytes()
+
+    def rgba_bytes(self, i):
+        """Return the RGBA bytes of images[i], decoding it again if its
+        pixels were released.
+
+        Each frame is drawn over the ones before it, so frames are decoded
+        again from the first one, unless the last frame decoded again was
+        before i. Decoding frames again in order costs no more than decoding
+        them once.
+        """
+        with self._reload_lock:
+            image = self.images[i]
+            if not image.is_released:
+                return image.rgba_bytes
+            if self._reloads is None or self._reload_index >= i:
+                # only the frames decoded so far have all their blocks
+                blocks = list(self._blocks)
+                self._reloads = enumerate(self._generate_images(
+                    blocks, *self._decode_args, reload=True))
+            for index, reloaded in self._reloads:
+                self._reload_index = index
+                if index == i:
+                    image._rgba_bytes = reloaded.rgba_bytes
+                    return image._rgba_bytes
+            self._reloads = None
+            raise IndexError('image {} has not been decoded'.format(i))
+
+    def _tell(self, stream):
+        """Return the position in stream if recording stats, otherwise 0."""
+        return stream.tell() if self.stats is not None else 0
+
+    def _load_progressively(self, images, stream):
+        """Add decoded images to self.images as they are parsed."""
+        try:
+            for image in images:
+                self.images.append(image)
+        except Exception as e:
+            logger.exception('GIF<%s>: Failed to decode', self.filename)
+            self.images.close(e)
+        else:
+            logger.info('GIF<%s>: Finished parsing input stream',
+                        self.filename)
+            self.images.close()
+        finally:
+            self.is_loading = False
+            stream.close()
 
     @staticmethod
     def _de_interlace(indices, height, width):
@@ -298,32 +574,90 @@ class GIF(object):
             for index in indices[row * width:(row + 1) * width]:
                 yield index
 
-    def save(self, stream):
-        """Encode GIF to a file-like object."""
-        # create one list of pixels and alpha mask for all images
-        alpha_mask = flatten([a != 255 for r, g, b, a in img.rgba_data]
-                             for img in self.images)
-        rgb = flatten([(r, g, b) for r, g, b, a in img.rgba_data]
-                      for img in self.images)
+    def save(self, stream, quantizer='octree', processes=1,
+             sample_tolerance=None, sample_time=None, cache=None, stats=None):
+        """Encode GIF to a file-like object.
 
-        # if there is any alpha, need to reverse space for a transparent colour
-        use_transparency = any(alpha_mask)
-        max_colours = 255 if use_transparency else 256
+        quantizer is the name of the quantizer to use if there are too many
+        colours for the colour table. See gifprime.quantize.QUANTIZERS.
 
-        # quantize to get colour table and map
-        colour_table, colour_map = quantize(rgb, max_colours)
+        processes is the number of processes used to count colours, or None
+        for one per CPU.
 
-        # add transparent colour to the table if necessary
-        if use_transparency:
-            transparent_col_index = len(colour_table)
-            colour_table.append((0, 0, 0))
+        If sample_tolerance or sample_time is set, the palette is built from a
+        progressively larger sample of pixels, which stops growing once the
+        palette changes by at most sample_tolerance or after sample_time
+        seconds. See gifprime.quantize.progressive_sample.
+
+        If cache is a gifprime.quantize.QuantizationCache, quantization is
+        skipped when it already has the result for the same colours and
+        settings.
+
+        If stats is None, encoding is recorded in self.stats, which is
+        created first if recording is enabled. Otherwise stats decides for
+        this call alone: True records into a new Stats, False records
+        nothing, and a Stats is recorded into. A Stats recorded into replaces
+        self.stats. See gifprime.stats.
+        """
+        if stats is None:
+            if self.stats is None:
+                self.stats = gifprime.stats.create()
+            recorder = self.stats
         else:
-            transparent_col_index = 0
+            recorder = gifprime.stats.create(stats)
+
+        # RGBA bytes of every image, decoding them first if necessary
+        frames = [image.rgba_bytes for image in self.images]
 
-        # pad colour table to nearest power of two length
-        # colour table length must also be at least 2
-        colour_table_len = max(2, int(pow(2, ceil(log(len(colour_table), 2)))))
-        colour_table += [(0, 0, 0)] * (colour_table_len - len(colour_table))
+        stats = recorder or gifprime.stats.NULL_STATS
+        t = stats.start()
+
+        # if there is any alpha, need to reserve space for a transparent colour
+        use_transparency = has_alpha(frames)
+        max_colours = 255 if use_transparency else 256
+
+        # count the colours in all images
+        colour_counts = frames_histogram(frames, processes)
+
+        # use the colours as they are if they fit in the colour table,
+        # otherwise quantize to get colour table and map
+        palette = exact_palette(colour_counts, max_colours)
+        if palette is None and cache is not None:
+            cache_key = cache.key(colour_counts, max_colours, quantizer,
+                                  sample_tolerance, sample_time)
+            palette = cache.get(cache_key)
+        if palette is None:
+            if sample_tolerance is not None or sample_time is not None:
+                palette = progressive_sample(
+                    frames, max_colours, quantizer, sample_tolerance or 0,
+                    sample_time, colour_counts)
+            else:
+                palette = quantize_histogram(colour_counts, max_colours,
+                                             quantizer)
+            if cache is not None:
+                cache.put(cache_key, palette)
+        colour_list, colour_map = palette
+        # a new table, as the colour list may be shared with the cache
+        colour_table, transparent_col_index = gif_colour_table(
+            colour_list, use_transparency)
+
+        num_bytes = sum(len(frame) for frame in frames)
+        t = stats.record('quantize', t, num_bytes, num_bytes // 4)
+
+        lzw_min = max(2, int(log(len(colour_table), 2)))
+        # not the colour map's own lookup table, which would be kept with the
+        # map if it is cached
+        lut = colour_map.lookup_table(num_bytes // 4)
+
+        # map each frame to colour table indices and compress them
+        compressed_frames = []
+        for frame in frames:
+            stats.start_frame()
+            indices = colour_map.map_pixels(frame, transparent_col_index, lut)
+            t = stats.record('map', t, len(frame), len(indices))
+            compressed_frames.append(lzw.compress(indices, lzw_min))
+            t = stats.record('compress', t, len(indices), len(indices))
+            stats.end_frame('encode', len(frame) // 4)
 
         if self.comment is not None:
             comment_containers = [
@@ -337,8 +671,6 @@ class GIF(object):
         else:
             comment_containers = []
 
-        lzw_min = max(2, int(log(len(colour_table), 2)))
-
         image_containers = flatten([
             [
                 construct.Container(
@@ -350,7 +682,7 @@ class GIF(object):
                     user_input_flag = False,
                     transparent_colour_flag = use_transparency,
                     delay_time = int(image.delay_ms / 10),
-                    transparent_colour_index = transparent_col_index,
+                    transparent_colour_index = transparent_col_index or 0,
                     terminator = 0,
                 ),
                 construct.Container(
@@ -368,13 +700,10 @@ class GIF(object):
                     ),
                     lct = None,
                     lzw_min = lzw_min,
-                    compressed_indices = lzw.compress(''.join(
-                        chr(colour_map[(r, g, b)]) if a == 255
-                        else chr(transparent_col_index)
-                        for r, g, b, a in image.rgba_data
-                    ), lzw_min),
+                    compressed_indices = compressed_indices,
                 ),
-            ] for image in self.images
+            ] for image, compressed_indices in zip(self.images,
+                                                   compressed_frames)
         ])
 
         app_ext_containers = []
@@ -404,7 +733,8 @@ class GIF(object):
         trailer = [construct.Container(block_start = 0x3B,
                                        terminator = 'terminator')]
 
-        gif = gifprime.parser.gif.build_stream(construct.Container(
+        position = stream.tell() if recorder is not None else 0
+        gifprime.parser.gif.build_stream(construct.Container(
             magic = 'GIF89a',
             logical_screen_descriptor = construct.Container(
                 logical_width = self.size[0],
@@ -420,3 +750,7 @@ class GIF(object):
             body = (comment_containers + image_containers + app_ext_containers
                     + trailer),
         ), stream)
+        if recorder is not None:
+            stats.record('write', t, stream.tell() - position)
+            self.stats = recorder
+            gifprime.stats.run_hooks(self, 'encode', recorder)
@@ -0,0 +1,289 @@
+"""Generate large synthetic GIFs for scaling tests and benchmarks.
+
+Each profile stresses one part of decoding: a 4K canvas, thousands of
+frames, LZW streams full of clear codes, a large interlaced image, or a local
+colour table on every frame. Files are built deterministically from a seed
+and a size, which scales a profile down from its full size, so they never
+need to be checked in.
+
+Every frame covers the whole canvas and is opaque, so the decoded frames are
+known without decoding. Each file comes with a checksum of those frames, which
+pixel_checksum of the decoded GIF must match.
+
+Usage information:
+
+    python -m gifprime.corpus -h
+"""
+
+from argparse import ArgumentParser
+from collections import namedtuple
+from math import log
+import hashlib
+import json
+import logging
+import os
+import random
+import sys
+
+from gifprime.core import GIF
+from gifprime import lzw
+from gifprime import transcode
+
+logger = logging.getLogger(__name__)
+
+Profile = namedtuple('Profile', [
+    'width', 'height', 'num_frames',
+    # name of the function in PATTERNS that draws each frame
+    'pattern',
+    'interlaced',
+    'local_colour_tables',
+    # the LZW code table is cleared before codes would be larger than this
+    'max_code_size',
+    'description',
+])
+
+PROFILES = {
+    'canvas-4k': Profile(3840, 2160, 3, 'bands', False, False, 12,
+                         'a few frames on a 4K canvas'),
+    'long': Profile(64, 64, 5000, 'square', False, False, 12,
+                    'a small animation with thousands of frames'),
+    'clear-codes': Profile(1024, 1024, 4, 'noise', False, False, 9,
+                           'noise, with the code table cleared every 256 '
+                           'codes'),
+    'interlaced': Profile(2048, 2048, 4, 'bands', True, False, 12,
+                          'a large interlaced animation'),
+    'local-tables': Profile(512, 512, 200, 'bands', False, True, 12,
+                            'a local colour table on every frame'),
+}
+
+# size -> (divisor of each dimension, divisor of the number of frames)
+SIZES = {
+    'full': (1, 1),
+    'medium': (2, 4),
+    'small': (4, 16),
+    'tiny': (16, 64),
+}
+
+# smallest scaled dimensions and number of frames
+MIN_DIMENSION = 8
+MIN_FRAMES = 2
+
+# number of colours in every colour table
+NUM_COLOURS = 256
+
+MANIFEST = 'manifest.json'
+
+
+def scaled(profile, size):
+    """Return the width, height and number of frames of a profile at a size.
+    """
+    dimension_divisor, frame_divisor = SIZES[size]
+    return (max(MIN_DIMENSION, profile.width // dimension_divisor),
+            max(MIN_DIMENSION, profile.height // dimension_divisor),
+            max(MIN_FRAMES, profile.num_frames // frame_divisor))
+
+
+def random_colour_table(rng):
+    """Return NUM_COLOURS random (r, g, b) colours."""
+    return [(rng.randrange(256), rng.randrange(256), rng.randrange(256))
+            for _ in xrange(NUM_COLOURS)]
+
+
+def draw_bands(rng, width, height, frame):
+    """Diagonal bands of colour that move with each frame."""
+    # every row is a slice of this, offset to make the bands diagonal
+    base = str(bytearray((x // 8) % NUM_COLOURS
+                         for x in xrange(width + NUM_COLOURS * 8)))
+    rows = []
+    for y in xrange(height):
+        start = ((y // 8 + frame * 4) % NUM_COLOURS) * 8
+        rows.append(base[start:start + width])
+    return ''.join(rows)
+
+
+def draw_square(rng, width, height, frame):
+    """A square that moves across a plain background and changes colour."""
+    side = max(1, min(width, height) // 4)
+    left = frame % (width - side + 1)
+    top = (frame // (width - side + 1)) % (height - side + 1)
+    background = '\x00' * width
+    row = ('\x00' * left + chr(frame % (NUM_COLOURS - 1) + 1) * side +
+           '\x00' * (width - left - side))
+    return (background * top + row * side +
+            background * (height - top - side))
+
+
+def draw_noise(rng, width, height, frame):
+    """Random colours, which compress badly and fill the LZW code table."""
+    num_pixels = width * height
+    return '{:0{}x}'.format(rng.getrandbits(num_pixels * 8),
+                            num_pixels * 2).decode('hex')
+
+
+PATTERNS = {
+    'bands': draw_bands,
+    'square': draw_square,
+    'noise': draw_noise,
+}
+
+
+def interlace(indices, width, height):
+    """Reorder the rows of indices into the order of an interlaced image."""
+    rows = [indices[y * width:(y + 1) * width] for y in xrange(height)]
+    return ''.join(rows[0::8] + rows[4::8] + rows[2::4] + rows[1::2])
+
+
+def generate_frames(profile, size='full', seed=0):
+    """Yield the colour table and colour indices of each frame.
+
+    Frames without local colour tables get the global colour table.
+    """
+    rng = random.Random(seed)
+    width, height, num_frames = scaled(profile, size)
+    global_colour_table = random_colour_table(rng)
+    draw = PATTERNS[profile.pattern]
+    for frame in xrange(num_frames):
+        if profile.local_colour_tables:
+            colour_table = random_colour_table(rng)
+        else:
+            colour_table = global_colour_table
+        yield colour_table, draw(rng, width, height, frame)
+
+
+def generate(stream, name, size='full', seed=0, delay_ms=40):
+    """Write the GIF of a profile to stream and return its manifest entry.
+
+    The entry describes the file and gives the checksum of its frames.
+    """
+    profile = PROFILES[name]
+    width, height, num_frames = scaled(profile, size)
+    lzw_min = max(2, int(log(NUM_COLOURS, 2)))
+    checksum = hashlib.sha1()
+    start = stream.tell()
+
+    frames = generate_frames(profile, size, seed)
+    global_colour_table = None
+    for i, (colour_table, indices) in enumerate(frames):
+        if i == 0:
+            if not profile.local_colour_tables:
+                global_colour_table = colour_table
+            transcode.write_header(stream, (width, height),
+                                   global_colour_table)
+            transcode.write_loop_count(stream, 0)
+
+        # the decoded frame is the colour of each index
+        rgba = [chr(r) + chr(g) + chr(b) + '\xff'
+                for r, g, b in colour_table]
+        checksum.update(''.join([rgba[index] for index in
+                                 bytearray(indices)]))
+
+        if profile.interlaced:
+            indices = interlace(indices, width, height)
+        transcode.write_frame(
+            stream, (width, height),
+            colour_table if profile.local_colour_tables else None, lzw_min,
+            lzw.compress(indices, lzw_min, profile.max_code_size), None,
+            delay_ms, interlaced=profile.interlaced)
+    transcode.write_trailer(stream)
+
+    return {
+        'profile': name,
+        'size': size,
+        'seed': seed,
+        'width': width,
+        'height': height,
+        'frames': num_frames,
+        'bytes': stream.tell() - start,
+        'checksum': checksum.hexdigest(),
+    }
+
+
+def filename(name, size='full', seed=0):
+    """Return the name of the file for a profile, size and seed."""
+    return '{}-{}-{}.gif'.format(name, size, seed)
+
+
+def pixel_checksum(gif):
+    """Return the checksum of the RGBA bytes of every frame of a GIF."""
+    checksum = hashlib.sha1()
+    for image in gif.images:
+        checksum.update(image.rgba_bytes)
+    return checksum.hexdigest()
+
+
+def generate_corpus(directory, names=None, size='full', seed=0):
+    """Write the GIF of each profile, or every profile, to directory.
+
+    The manifest entries, keyed by file name, are also written to
+    directory as JSON, and returned.
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    manifest = {}
+    for name in names or sorted(PROFILES):
+        output = filename(name, size, seed)
+        with open(os.path.join(directory, output), 'wb') as stream:
+            manifest[output] = generate(stream, name, size, seed)
+    with open(os.path.join(directory, MANIFEST), 'w') as file_:
+        json.dump(manifest, file_, indent=2, sort_keys=True)
+    return manifest
+
+
+def verify_corpus(directory):
+    """Decode every file in a corpus and compare it to the manifest.
+
+    Returns the names of the files whose frames do not match, including
+    those that fail to decode.
+    """
+    with open(os.path.join(directory, MANIFEST)) as file_:
+        manifest = json.load(file_)
+    mismatches = []
+    for output, entry in sorted(manifest.iteritems()):
+        with open(os.path.join(directory, output), 'rb') as stream:
+            try:
+                # decode one frame at a time, so memory does not grow with
+                # the number of frames
+                gif = GIF(stream, filename=output, streaming=True)
+                checksum = pixel_checksum(gif)
+            except Exception:
+                logger.exception('Failed to decode %s', output)
+                checksum = None
+        if checksum != entry['checksum']:
+            mismatches.append(output)
+    return mismatches
+
+
+def parse_args():
+    parser = ArgumentParser('gifprime.corpus')
+    parser.add_argument('directory', help='directory to write the GIFs to')
+    parser.add_argument('--profiles', '-p', nargs='+',
+                        choices=sorted(PROFILES),
+                        help='profiles to generate (default: all)')
+    parser.add_argument('--size', '-s', default='small', choices=SIZES,
+                        help='how far to scale the profiles down')
+    parser.add_argument('--seed', default=0, type=int,
+                        help='seed for the random colours and noise')
+    parser.add_argument('--verify', action='store_true',
+                        help='check an existing corpus against its manifest '
+                             'instead of generating one')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.verify:
+        mismatches = verify_corpus(args.directory)
+        for output in mismatches:
+            print 'MISMATCH {}'.format(output)
+        sys.exit(1 if mismatches else 0)
+
+    manifest = generate_corpus(args.directory, args.profiles, args.size,
+                               args.seed)
+    for output, entry in sorted(manifest.iteritems()):
+        print '{:<32} {}x{}, {} frames, {} bytes'.format(
+            output, entry['width'], entry['height'], entry['frames'],
+            entry['bytes'])
+
+
+if __name__ == '__main__':
+    main()
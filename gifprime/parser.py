@@ -1,7 +1,8 @@
 """Construct-based parser for the GIF file format.
 
 Only uses constructs that don't require seeking, so we can parse streams that
-don't support it without buffering.
+don't support it without buffering. The header and each block can also be
+parsed on their own, so a stream can be parsed incrementally.
 
 Based on specifications:
 http://www.w3.org/Graphics/GIF/spec-gif89a.txt
@@ -130,8 +131,8 @@ _gct = construct.Array(
 )
 
 
-gif = construct.Struct(
-    'GIF',
+header = construct.Struct(
+    'header',
     construct.Select(
         'magic',
         construct.Magic('GIF89a'),
@@ -139,41 +140,47 @@ gif = construct.Struct(
     ),
     _logical_screen_descriptor,
     construct.If(lambda ctx: ctx.logical_screen_descriptor.gct_flag, _gct),
-    construct.RepeatUntil(
-        lambda obj, ctx: obj.block_start == 0x3B,
-        construct.Struct(
-            'body',
-            construct.ULInt8('block_start'),
-            construct.Embedded(
-                construct.Switch('block', lambda ctx: ctx.block_start,
-                    {
-                        0x3B: construct.Struct(
-                            # workaround for Pass not working
-                            'terminator',
-                            construct.Value('terminator',
-                                            lambda ctx: 'terminator'),
-                        ),
-                        0x2C: _image_block,
-                        0x21: construct.Struct(
-                            'ext',
-                            construct.ULInt8('ext_label'),
-                            construct.Embedded(
-                                construct.Switch(
-                                    'extension',
-                                    lambda ctx: ctx.ext_label,
-                                    {
-                                        0xFF: _application_extension,
-                                        0xFE: _comment_extension,
-                                        0xF9: _gce_extension,
-                                    },
-                                    default = _unknown_extension,
-                                ),
-                            ),
+)
+
+
+block = construct.Struct(
+    'body',
+    construct.ULInt8('block_start'),
+    construct.Embedded(
+        construct.Switch('block', lambda ctx: ctx.block_start,
+            {
+                0x3B: construct.Struct(
+                    # workaround for Pass not working
+                    'terminator',
+                    construct.Value('terminator',
+                                    lambda ctx: 'terminator'),
+                ),
+                0x2C: _image_block,
+                0x21: construct.Struct(
+                    'ext',
+                    construct.ULInt8('ext_label'),
+                    construct.Embedded(
+                        construct.Switch(
+                            'extension',
+                            lambda ctx: ctx.ext_label,
+                            {
+                                0xFF: _application_extension,
+                                0xFE: _comment_extension,
+                                0xF9: _gce_extension,
+                            },
+                            default = _unknown_extension,
                         ),
-                    },
+                    ),
                 ),
-            ),
+            },
         ),
     ),
+)
+
+
+gif = construct.Struct(
+    'GIF',
+    construct.Embedded(header),
+    construct.RepeatUntil(lambda obj, ctx: obj.block_start == 0x3B, block),
     construct.Terminator,
 )
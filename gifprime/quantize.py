@@ -2,8 +2,31 @@
 
 Implemented as described by ImageMagick:
 http://www.imagemagick.org/script/quantize.php
+
+Median cut and k-means quantizers from gifprime.cluster are also available
+by name if NumPy is installed.
 """
 
+from array import array
+from math import ceil, log
+import cPickle
+import collections
+import hashlib
+import heapq
+import itertools
+import logging
+import multiprocessing
+import os
+import sys
+import time
+
+try:
+    from gifprime import cluster
+except ImportError:  # NumPy is not installed
+    cluster = None
+
+logger = logging.getLogger(__name__)
+
 
 # The maximum depth of the colour octree. Should be in range [3, 6]. Higher is
 # slower but with higher quality. Anything less than 8 will cause loss on
@@ -11,171 +34,630 @@ http://www.imagemagick.org/script/quantize.php
 MAX_DEPTH = 8
 
 
-# Minor optimization
-COMPONENTS = range(3)
+# Maximum number of pixels counted by each process when counting colours in
+# parallel.
+HISTOGRAM_CHUNK_SIZE = 1 << 20
 
 
-class ColourCube(object):
-    """A cube contained in a colour space."""
+# Approximate number of pixels in the first sample when building a palette
+# from a progressively larger sample of pixels.
+INITIAL_SAMPLE_SIZE = 1 << 16
 
-    def __init__(self, vertex_low, vertex_high, depth=0):
-        self.vertex_low = vertex_low
-        self.vertex_high = vertex_high
-        self.children = []
-        self.center = tuple([((self.vertex_low[i] + self.vertex_high[i]) / 2)
-                             for i in COMPONENTS])
-        self.depth = depth
-        self.num_pixels = 0
-        self.num_pixels_exclusive = 0
-        self.pixel_sums = (0, 0, 0)
-        self.error = 0
 
-    def generate_child_for(self, colour):
-        """Return this Cube's child containing colour.
+# Number of entries in a lookup table from colours to colour table indices,
+# one for every 24-bit colour.
+LUT_SIZE = 1 << 24
 
-        Returns None if no such child exists. This method allows lazily
-        generating the octree.
-        """
-        # if at max depth, there is no child
-        if self.depth == MAX_DEPTH:
-            return None
-        # find the child cube that the colour falls in
-        size = (self.vertex_high[0] - self.vertex_low[0]) / 2
-        midpoints = [self.vertex_low[i] + size + 1 for i in COMPONENTS]
-        child_low = tuple(self.vertex_low[i] if colour[i] < midpoints[i]
-                          else midpoints[i] for i in COMPONENTS)
-        # if that cube has already been generated, use it
-        for child in self.children:
-            if child.vertex_low == child_low:
-                return child
-        # otherwise, instantiate a new ColourCube and add it as a child
-        child_high = tuple(child_low[i] + size for i in COMPONENTS)
-        child = ColourCube(child_low, child_high, self.depth + 1)
-        self.children.append(child)
-        assert len(self.children) <= 8
-        return child
-
-    def contains(self, colour):
-        """Return True if this cube contains colour."""
-        return all((colour[i] >= self.vertex_low[i] and
-                    colour[i] <= self.vertex_high[i]) for i in COMPONENTS)
-
-    def center_squared_distance_to(self, colour):
-        """Return the squared distance from this cube's center to colour."""
-        return abs(sum(pow(colour[i] - self.center[i], 2) for i in COMPONENTS))
+
+# Frames with fewer pixels than this are cheaper to map to colour table
+# indices with a dict than by filling a lookup table.
+LUT_MIN_PIXELS = 1 << 15
+
+
+# Child slots of a node with no children
+EMPTY_SLOTS = array('i', [0] * 8)
+
+
+# Offset from the lowest vertex of a cube to its center, indexed by depth.
+# A cube at depth d spans 2 ** (8 - d) values of each component.
+CENTER_OFFSETS = [((1 << (8 - depth)) - 1) / 2 for depth in xrange(9)]
+
+
+class ColourOctree(object):
+    """An octree of cubes contained in a colour space.
+
+    Nodes are stored in flat arrays and referred to by their index, with the
+    root at index 0. Each node has 8 child slots, addressed by interleaving
+    the bits of the R, G and B components at the node's depth. A slot
+    holding 0 has no child, since the root is never a child.
+    """
+
+    def __init__(self):
+        self.children = array('i')
+        self.num_pixels = array('d')
+        self.num_pixels_exclusive = array('d')
+        self.sums_r = array('d')
+        self.sums_g = array('d')
+        self.sums_b = array('d')
+        self.error = array('d')
+        self._add_node()
+
+    def __len__(self):
+        return len(self.error)
+
+    def _add_node(self):
+        """Add a new node with no children or pixels and return its index."""
+        self.children.extend(EMPTY_SLOTS)
+        for stat in (self.num_pixels, self.num_pixels_exclusive, self.sums_r,
+                     self.sums_g, self.sums_b, self.error):
+            stat.append(0)
+        return len(self.error) - 1
+
+    def insert(self, colour, count=1):
+        """Add count pixels of colour, generating nodes as necessary."""
+        r, g, b = colour
+        children = self.children
+        num_pixels = self.num_pixels
+        error = self.error
+        node = 0
+        depth = 0
+        while True:
+            # update the node
+            shift = 8 - depth
+            offset = CENTER_OFFSETS[depth]
+            dr = r - ((r >> shift) << shift) - offset
+            dg = g - ((g >> shift) << shift) - offset
+            db = b - ((b >> shift) << shift) - offset
+            num_pixels[node] += count
+            error[node] += count * (dr * dr + dg * dg + db * db)
+            if depth == MAX_DEPTH:
+                break
+            # move to the child containing the colour
+            shift -= 1
+            slot = (node << 3) | (((r >> shift) & 1) << 2 |
+                                  ((g >> shift) & 1) << 1 |
+                                  ((b >> shift) & 1))
+            child = children[slot]
+            if not child:
+                child = children[slot] = self._add_node()
+            node = child
+            depth += 1
+
+        # the node at max depth holds the colour exclusively
+        self.num_pixels_exclusive[node] += count
+        self.sums_r[node] += count * r
+        self.sums_g[node] += count * g
+        self.sums_b[node] += count * b
 
     def get_deepest_containing(self, colour):
         """Return the deepest node containing colour.
 
         Does not generate new nodes.
         """
-        for child in self.children:
-            if child.contains(colour):
-                return child.get_deepest_containing(colour)
-        return self
-
-    def prune(self, child):
-        """Prune the given child of this node."""
-        assert child in self.children
-        # recursively prune the child's children
-        # iterate over copy of the list since it will be mutated
-        for child_child in list(child.children):
-            child.prune(child_child)
-        assert child.children == [], 'child has not been recursively pruned'
-        # prune the child
-        self.num_pixels_exclusive += child.num_pixels_exclusive
-        self.pixel_sums = tuple(self.pixel_sums[i] + child.pixel_sums[i]
-                                for i in COMPONENTS)
-        self.children.remove(child)
-
-    def __repr__(self):
-        return '<{} at {} to {}>'.format(self.__class__.__name__,
-                                         self.vertex_low, self.vertex_high)
-
-
-def all_nodes(node):
-    """Yield all nodes via breadth-first search."""
-    node_list = [node]
+        r, g, b = colour
+        children = self.children
+        node = 0
+        for shift in xrange(7, 7 - MAX_DEPTH, -1):
+            child = children[(node << 3) | (((r >> shift) & 1) << 2 |
+                                            ((g >> shift) & 1) << 1 |
+                                            ((b >> shift) & 1))]
+            if not child:
+                break
+            node = child
+        return node
+
+    def get_children(self, node):
+        """Return the list of (slot, child) pairs of the given node."""
+        first = node << 3
+        return [(slot, child) for slot, child
+                in enumerate(self.children[first:first + 8]) if child]
+
+    def prune(self, node, slot):
+        """Prune the child in the given slot of node.
+
+        The pixels of every node below the child are merged into node.
+        """
+        first = node << 3
+        subtree = [self.children[first + slot]]
+        self.children[first + slot] = 0
+        while subtree:
+            child = subtree.pop()
+            subtree.extend(child for _, child in self.get_children(child))
+            self.num_pixels_exclusive[node] += self.num_pixels_exclusive[child]
+            self.sums_r[node] += self.sums_r[child]
+            self.sums_g[node] += self.sums_g[child]
+            self.sums_b[node] += self.sums_b[child]
+
+    def mean_colour(self, node):
+        """Return the mean colour of the pixels held exclusively by node."""
+        num_pixels = self.num_pixels_exclusive[node]
+        return (int(self.sums_r[node] // num_pixels),
+                int(self.sums_g[node] // num_pixels),
+                int(self.sums_b[node] // num_pixels))
+
+
+class ColourMap(dict):
+    """A mapping from every unique (r, g, b) colour to a colour table index.
+
+    For mapping whole frames, a lookup table with an entry for every 24-bit
+    colour is built on first use. Colours that are not in the mapping are
+    looked up as index 0.
+
+    Quantizers set assign to a function that returns the colour table index
+    of each colour in a list, so that more colours can be mapped with extend.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(ColourMap, self).__init__(*args, **kwargs)
+        self._lut = None
+        self.assign = None
+
+    def __reduce__(self):
+        # do not pickle the lookup table, it can be rebuilt
+        return (ColourMap, (dict(self),))
+
+    @property
+    def lut(self):
+        """Return the lookup table, indexed by r | g << 8 | b << 16."""
+        if self._lut is None:
+            self._lut = self.fill_lut(bytearray(LUT_SIZE))
+        return self._lut
+
+    def fill_lut(self, lut):
+        """Write the index of every colour into lut and return it.
+
+        lut is indexed by r | g << 8 | b << 16, and can be a bytearray of
+        LUT_SIZE or a dict. Entries for other colours are left as they are,
+        so a lookup table can be reused by maps of every colour it is used
+        for.
+        """
+        for (r, g, b), index in self.iteritems():
+            lut[r | g << 8 | b << 16] = index
+        return lut
+
+    def lookup_table(self, num_pixels):
+        """Return a new lookup table for mapping num_pixels pixels.
+
+        It is a dict for fewer than LUT_MIN_PIXELS pixels, and otherwise a
+        bytearray of LUT_SIZE. Unlike lut, the map does not keep it.
+        """
+        if num_pixels < LUT_MIN_PIXELS:
+            return self.fill_lut({})
+        return self.fill_lut(bytearray(LUT_SIZE))
+
+    def extend(self, colours):
+        """Map the colours that are not mapped yet, using assign."""
+        missing = [colour for colour in colours if colour not in self]
+        if not missing:
+            return
+        if self.assign is None:
+            raise ValueError('ColourMap cannot map new colours')
+        self.update(zip(missing, self.assign(missing)))
+        self._lut = None
+
+    def map_pixels(self, rgba, transparent_index=None, lut=None):
+        """Return a string of colour table indices for a string of RGBA bytes.
+
+        If transparent_index is set, pixels that are not fully opaque are
+        mapped to it. If lut is set, it is used instead of the lookup table,
+        and must be filled with fill_lut.
+        """
+        pixels = array('I')
+        pixels.fromstring(rgba)
+        if sys.byteorder == 'big':
+            pixels.byteswap()
+        if lut is None:
+            lut = self.lut
+        if transparent_index is None:
+            indices = bytearray(lut[pixel & 0xFFFFFF] for pixel in pixels)
+        else:
+            indices = bytearray(lut[pixel & 0xFFFFFF] if pixel >= 0xFF000000
+                                else transparent_index for pixel in pixels)
+        return str(indices)
+
+
+class QuantizationCache(object):
+    """A cache of quantization results, keyed by the colour histogram.
+
+    The most recently used max_entries results are kept in memory, as copies
+    without the lookup tables of their ColourMaps or what their quantizers
+    use to map more colours. If directory is set, results are also stored
+    there so they can be reused by other processes.
+    """
+
+    def __init__(self, max_entries=8, directory=None):
+        self.max_entries = max_entries
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+
+    @staticmethod
+    def key(colour_counts, max_colours, quantizer, *settings):
+        """Return the cache key for quantizing a colour histogram."""
+        digest = hashlib.sha1(repr((max_colours, quantizer) + settings))
+        colours = sorted(colour_counts)
+        digest.update(array('I', [r << 16 | g << 8 | b
+                                  for r, g, b in colours]).tostring())
+        digest.update(repr([colour_counts[colour] for colour in colours]))
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, '{}.pickle'.format(key))
+
+    def get(self, key):
+        """Return the colour table and ColourMap for key, or None."""
+        if key in self._entries:
+            palette = self._entries.pop(key)
+        elif self.directory is not None and os.path.isfile(self._path(key)):
+            with open(self._path(key), 'rb') as file_:
+                palette = cPickle.load(file_)
+        else:
+            self.misses += 1
+            logger.debug('Quantization cache miss: %s', key)
+            return None
+        self.hits += 1
+        logger.debug('Quantization cache hit: %s', key)
+        self._entries[key] = palette
+        self._evict()
+        return palette
+
+    def put(self, key, palette):
+        """Store the colour table and ColourMap for key."""
+        colour_list, colour_map = palette
+        palette = (list(colour_list), ColourMap(colour_map))
+        self._entries.pop(key, None)
+        self._entries[key] = palette
+        self._evict()
+        if self.directory is not None:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            # write to a temporary file first so readers never see a partial
+            # file
+            tmp_path = '{}.{}.tmp'.format(self._path(key), os.getpid())
+            with open(tmp_path, 'wb') as file_:
+                cPickle.dump(palette, file_, cPickle.HIGHEST_PROTOCOL)
+            os.rename(tmp_path, self._path(key))
+
+    def _evict(self):
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    @property
+    def stats(self):
+        """Return a dict of cache statistics."""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self._entries),
+        }
+
+
+def all_nodes(tree):
+    """Yield all nodes via depth-first search."""
+    node_list = [0]
     while node_list:
         node = node_list.pop()
-        node_list.extend(node.children)
+        node_list.extend(child for _, child in tree.get_children(node))
         yield node
 
-def _classify(rgb_tuples):
-    """Construct octree from colours in image."""
-    tree = ColourCube((0, 0, 0), (255, 255, 255))
+
+def histogram(rgb_tuples):
+    """Return a mapping from every unique colour to its number of pixels."""
+    counts = {}
     for pixel in rgb_tuples:
-        node = tree
-        while node is not None:
-            # update the node
-            node.num_pixels += 1
-            child = node.generate_child_for(pixel)
-            node.error += node.center_squared_distance_to(pixel)
-            if child is None:
-                node.num_pixels_exclusive += 1
-                node.pixel_sums = tuple(node.pixel_sums[i] + pixel[i]
-                                        for i in COMPONENTS)
-            node = child
+        counts[pixel] = counts.get(pixel, 0) + 1
+    return counts
+
+
+def rgba_histogram(rgba):
+    """Return the histogram of colours in a string of RGBA bytes."""
+    data = bytearray(rgba)
+    return histogram(itertools.izip(data[0::4], data[1::4], data[2::4]))
+
+
+def merge_histograms(histograms):
+    """Return the sum of several colour histograms."""
+    merged = {}
+    for colour_counts in histograms:
+        for colour, count in colour_counts.iteritems():
+            merged[colour] = merged.get(colour, 0) + count
+    return merged
+
+
+def _split_frames(frames, chunk_size):
+    """Split strings of RGBA bytes into chunks of at most chunk_size pixels."""
+    for frame in frames:
+        for start in xrange(0, len(frame), chunk_size * 4):
+            yield frame[start:start + chunk_size * 4]
+
+
+def frames_histogram(frames, processes=1):
+    """Return the histogram of colours in strings of RGBA bytes.
+
+    If processes is not 1, the frames are split into chunks which are counted
+    in a pool of that many processes, or one per CPU if it is None.
+    """
+    if processes == 1:
+        return merge_histograms(rgba_histogram(frame) for frame in frames)
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        return merge_histograms(pool.imap(
+            rgba_histogram, _split_frames(frames, HISTOGRAM_CHUNK_SIZE)))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _classify(colour_counts):
+    """Construct octree from the histogram of colours in image.
+
+    Each unique colour is inserted once, weighted by its number of pixels.
+    Colours are inserted in sorted order so that the tree does not depend on
+    how the histogram was built.
+    """
+    tree = ColourOctree()
+    for pixel in sorted(colour_counts):
+        tree.insert(pixel, colour_counts[pixel])
     return tree
 
 
 def _reduce(tree, max_colours):
-    """Reduce octree until it contains fewer than max_colours colours."""
-    # do an initial count of the number of colours to find out if we need to
-    # reduce at all
-    num_colours = len(list(node for node in all_nodes(tree)
-                           if node.num_pixels_exclusive > 0))
-    min_e = 0
-    # continue reducing until the number of colours is low enough
+    """Reduce octree until it contains at most max_colours colours.
+
+    Leaves are kept in a heap keyed by their error, and the leaf with the
+    minimum error is merged into its parent until few enough colours remain.
+    Each merge removes at most one colour, so exactly max_colours remain if
+    there were more to begin with.
+    """
+    error = tree.error
+    num_pixels_exclusive = tree.num_pixels_exclusive
+    parents = array('i', [0]) * len(tree)
+    slots = array('i', [0]) * len(tree)
+    num_children = array('i', [0]) * len(tree)
+    leaves = []
+    num_colours = 0
+    for node in all_nodes(tree):
+        children = tree.get_children(node)
+        for slot, child in children:
+            parents[child] = node
+            slots[child] = slot
+        num_children[node] = len(children)
+        if not children and node != 0:
+            leaves.append((error[node], node))
+        if num_pixels_exclusive[node] > 0:
+            num_colours += 1
+    heapq.heapify(leaves)
+
+    # every leaf holds a colour, which is only removed from the count if its
+    # parent already holds one
     while num_colours > max_colours:
-        num_colours = 0
-        next_min_e = None
-        nodes = [tree]
-        while nodes:
-            node = nodes.pop()
-            next_min_e = (node.error
-                          if next_min_e is None or node.error < next_min_e
-                          else next_min_e)
-            assert node.error > 0
-            # iterate over COPY of the list
-            for child in list(node.children):
-                # prune the nodes with the MINIMUM error
-                if child.error <= min_e:
-                    node.prune(child)
-                else:
-                    nodes.append(child)
-            if node.num_pixels_exclusive > 0:
-                num_colours += 1
-        min_e = next_min_e
-
-
-def _assign(rgb_tuples, tree):
+        _, node = heapq.heappop(leaves)
+        parent = parents[node]
+        if num_pixels_exclusive[parent] > 0:
+            num_colours -= 1
+        tree.prune(parent, slots[node])
+        num_children[parent] -= 1
+        if num_children[parent] == 0 and parent != 0:
+            heapq.heappush(leaves, (error[parent], parent))
+
+
+def _assign(colour_counts, tree):
     """Use octree to assign the image's colour to quantized colours."""
     colour_list = []
     node_to_index = {}
     for node in all_nodes(tree):
-        if node.num_pixels_exclusive > 0:
-            mean_col = tuple(node.pixel_sums[i] / node.num_pixels_exclusive
-                             for i in COMPONENTS)
-            colour_list.append(mean_col)
+        if tree.num_pixels_exclusive[node] > 0:
+            colour_list.append(tree.mean_colour(node))
             node_to_index[node] = len(colour_list) - 1
 
-    # for each pixel, find deepest code containing its colour
-    colour_map = {}  # (r, g, b) -> index in colour table
+    def assign(colours):
+        # for each colour, find deepest node containing it
+        indices = []
+        for pixel in colours:
+            node = tree.get_deepest_containing(pixel)
+            if node in node_to_index:
+                indices.append(node_to_index[node])
+            else:
+                # only possible for colours that were not used to build the
+                # tree
+                indices.append(nearest_colour(pixel, colour_list))
+        return indices
+
+    colour_map = ColourMap()
+    colour_map.assign = assign
+    colour_map.extend(colour_counts)
+    return colour_list, colour_map
+
+
+def nearest_colour(colour, colour_list):
+    """Return the index of the colour in colour_list nearest to colour."""
+    r, g, b = colour
+    return min(xrange(len(colour_list)), key=lambda i: (
+        (r - colour_list[i][0]) ** 2 + (g - colour_list[i][1]) ** 2 +
+        (b - colour_list[i][2]) ** 2))
+
+
+def has_alpha(frames):
+    """Return True if any pixel in strings of RGBA bytes is not opaque.
+
+    Such pixels are drawn with a transparent colour, which needs a place in
+    the colour table.
+    """
+    return any(frame[3::4].strip('\xff') for frame in frames)
+
+
+def gif_colour_table(colour_list, transparent):
+    """Return a GIF colour table of colour_list and its transparent index.
+
+    If transparent is True, a transparent colour is added to the end of the
+    table, otherwise the index is None.
+    """
+    colour_table = list(colour_list)
+    if transparent:
+        transparent_index = len(colour_table)
+        colour_table.append((0, 0, 0))
+    else:
+        transparent_index = None
+
+    # pad colour table to nearest power of two length
+    # colour table length must also be at least 2
+    colour_table_len = max(2, int(pow(2, ceil(log(len(colour_table), 2)))))
+    colour_table += [(0, 0, 0)] * (colour_table_len - len(colour_table))
+    return colour_table, transparent_index
+
+
+def exact_palette(rgb_tuples, max_colours):
+    """Build a colour table directly if there are at most max_colours colours.
+
+    Returns a colour table and a ColourMap from every unique colour to a colour
+    table index, or None as soon as more than max_colours unique colours are
+    found.
+    """
+    colour_map = ColourMap()
     for pixel in rgb_tuples:
         if pixel not in colour_map:
-            node = tree.get_deepest_containing(pixel)
-            colour_map[pixel] = node_to_index[node]
+            if len(colour_map) == max_colours:
+                return None
+            colour_map[pixel] = len(colour_map)
 
+    colour_list = sorted(colour_map, key=colour_map.get)
     return colour_list, colour_map
 
 
-def quantize(rgb_tuples, max_colours):
-    """Quantize list of RGB tuples to at most max_colours.
+def octree(colour_counts, max_colours, sample_counts=None):
+    """Quantize a colour histogram to at most max_colours using an octree."""
+    tree = _classify(colour_counts if sample_counts is None
+                     else sample_counts)
+    _reduce(tree, max_colours)
+    return _assign(colour_counts, tree)
+
 
-    Returns a colour table and a mapping from every unique colour to a colour
+def _clustering_quantizer(name):
+    """Return a quantizer using the gifprime.cluster function called name."""
+    def quantizer(colour_counts, max_colours, sample_counts=None):
+        if cluster is None:
+            raise ImportError('NumPy is required for the {} quantizer'
+                              .format(name))
+        colours, weights = cluster.histogram_arrays(
+            colour_counts if sample_counts is None else sample_counts)
+        palette, labels = getattr(cluster, name)(colours, max_colours,
+                                                 weights)
+        colour_list = [tuple(colour) for colour in palette.tolist()]
+        if sample_counts is None:
+            colour_map = ColourMap(zip([tuple(colour) for colour
+                                        in colours.tolist()], labels.tolist()))
+        else:
+            colour_map = ColourMap()
+        colour_map.assign = lambda colours: cluster.assign_nearest(
+            colours, palette).tolist()
+        colour_map.extend(colour_counts)
+        return colour_list, colour_map
+    return quantizer
+
+
+# Quantizers by name. Each takes a colour histogram, max_colours and
+# optionally the histogram of a sample of the colours to build the palette
+# from, and returns a colour table and a ColourMap for every colour.
+QUANTIZERS = {
+    'octree': octree,
+    'median-cut': _clustering_quantizer('median_cut'),
+    'kmeans': _clustering_quantizer('kmeans'),
+}
+
+
+def quantize_histogram(colour_counts, max_colours, quantizer='octree',
+                       sample_counts=None):
+    """Quantize a colour histogram to at most max_colours.
+
+    quantizer is the name of one of the QUANTIZERS. If sample_counts is set,
+    the palette is built from that histogram instead, but every colour in
+    colour_counts is still mapped.
+
+    Returns a colour table and a ColourMap from every unique colour to a colour
     table index.
     """
-    tree = _classify(rgb_tuples)
-    _reduce(tree, max_colours)
-    return _assign(rgb_tuples, tree)
+    if quantizer not in QUANTIZERS:
+        raise ValueError('Unknown quantizer: {}'.format(quantizer))
+    return QUANTIZERS[quantizer](colour_counts, max_colours, sample_counts)
+
+
+def quantize(rgb_tuples, max_colours, quantizer='octree'):
+    """Quantize list of RGB tuples to at most max_colours.
+
+    See quantize_histogram.
+    """
+    return quantize_histogram(histogram(rgb_tuples), max_colours, quantizer)
+
+
+def sample_histogram(frames, stride):
+    """Return the histogram of every stride-th pixel in strings of RGBA bytes.
+
+    The first pixel sampled is staggered between frames so that the sample
+    does not always fall on the same pixel positions.
+    """
+    counts = {}
+    step = 4 * stride
+    for i, frame in enumerate(frames):
+        offset = 4 * (i % stride)
+        sample = itertools.izip(bytearray(frame[offset::step]),
+                                bytearray(frame[offset + 1::step]),
+                                bytearray(frame[offset + 2::step]))
+        for colour in sample:
+            counts[colour] = counts.get(colour, 0) + 1
+    return counts
+
+
+def palette_change(old_colour_list, new_colour_list):
+    """Return the mean distance from each new colour to the nearest old one."""
+    total = 0
+    for colour in new_colour_list:
+        nearest = old_colour_list[nearest_colour(colour, old_colour_list)]
+        total += sum((colour[i] - nearest[i]) ** 2 for i in xrange(3)) ** 0.5
+    return total / max(1, len(new_colour_list))
+
+
+def progressive_sample(frames, max_colours, quantizer='octree', tolerance=0,
+                       time_budget=None, colour_counts=None):
+    """Quantize strings of RGBA bytes using a sample of their pixels.
+
+    Starts with every stride-th pixel, so that about INITIAL_SAMPLE_SIZE
+    pixels are sampled, and halves the stride until the palette built from
+    the sample changes by at most tolerance (see palette_change), every pixel
+    is sampled, or more than time_budget seconds have passed.
+
+    colour_counts is the histogram of every pixel, which is counted if it is
+    not given. Returns a colour table built from the last sample, and a
+    ColourMap from every colour in colour_counts to a colour table index, as
+    quantize_histogram does given that sample.
+    """
+    num_pixels = sum(len(frame) for frame in frames) / 4
+    stride = 1
+    while num_pixels / (stride * 2) >= INITIAL_SAMPLE_SIZE:
+        stride *= 2
+
+    start = time.time()
+    colour_list = None
+    while True:
+        if stride == 1:
+            if colour_counts is None:
+                colour_counts = frames_histogram(frames)
+            sample_counts = colour_counts
+        else:
+            sample_counts = sample_histogram(frames, stride)
+        # the sample is mapped the same way as the colours outside it
+        palette = quantize_histogram(sample_counts, max_colours, quantizer,
+                                     sample_counts)
+        if (stride == 1 or
+                (colour_list is not None and
+                 palette_change(colour_list, palette[0]) <= tolerance) or
+                (time_budget is not None and
+                 time.time() - start >= time_budget)):
+            logger.debug('Sampled 1 in %d pixels for palette', stride)
+            if colour_counts is None:
+                colour_counts = frames_histogram(frames)
+            palette[1].extend(colour_counts)
+            return palette
+        colour_list = palette[0]
+        stride /= 2
@@ -0,0 +1,126 @@
+"""Export composited GIF frames to a raw frame stack file.
+
+The file starts with a header, followed by every frame as
+frames x height x width x 4 bytes of RGBA, so it can be opened with
+numpy.memmap without copying:
+
+    header = read_header(filename)
+    frames = numpy.memmap(filename, numpy.uint8, 'r', header.data_offset,
+                          (header.num_frames, header.height, header.width, 4))
+
+All header fields are little-endian unsigned 32-bit integers, after the
+8-byte magic string:
+
+    magic, version, data_offset, width, height, num_frames, loop_count,
+    then the delay of each frame in ms.
+
+The header is padded with zeros to a multiple of DATA_ALIGNMENT bytes.
+"""
+
+from collections import namedtuple
+import mmap
+import struct
+
+from gifprime.core import GIF
+import gifprime.parser
+
+MAGIC = 'GIFPRAW\x00'
+VERSION = 1
+HEADER_FORMAT = '<8s6I'
+# frame data starts at a multiple of this many bytes
+DATA_ALIGNMENT = 64
+
+RawHeader = namedtuple('RawHeader', ['data_offset', 'width', 'height',
+                                     'num_frames', 'loop_count', 'delays'])
+
+
+def scan_delays(stream):
+    """Return the delay of each frame in a GIF stream, without decoding.
+
+    Reads the whole stream, one block at a time.
+    """
+    gifprime.parser.header.parse_stream(stream)
+    delays = []
+    delay_ms = 0
+    while True:
+        block = gifprime.parser.block.parse_stream(stream)
+        if block.block_start == 0x3B:
+            return delays
+        if block.block_type == 'gce':
+            delay_ms = block.delay_time * 10
+        elif block.block_type == 'image':
+            delays.append(delay_ms)
+            # the GCE goes out of scope after being used once
+            delay_ms = 0
+
+
+def data_offset(num_frames):
+    """Return the size of the header for num_frames frames."""
+    size = struct.calcsize(HEADER_FORMAT) + 4 * num_frames
+    return (size + DATA_ALIGNMENT - 1) // DATA_ALIGNMENT * DATA_ALIGNMENT
+
+
+def pack_header(header):
+    """Return the header as a string, padded to its data offset."""
+    packed = struct.pack(HEADER_FORMAT, MAGIC, VERSION, header.data_offset,
+                         header.width, header.height, header.num_frames,
+                         header.loop_count)
+    packed += struct.pack('<{}I'.format(header.num_frames), *header.delays)
+    return packed.ljust(header.data_offset, '\x00')
+
+
+def read_header(filename):
+    """Read the header of a raw frame stack file."""
+    with open(filename, 'rb') as file_:
+        fields = file_.read(struct.calcsize(HEADER_FORMAT))
+        if len(fields) < struct.calcsize(HEADER_FORMAT):
+            raise ValueError('{} is too short'.format(filename))
+        (magic, version, offset, width, height, num_frames,
+         loop_count) = struct.unpack(HEADER_FORMAT, fields)
+        if magic != MAGIC:
+            raise ValueError('{} is not a raw frame stack'.format(filename))
+        if version != VERSION:
+            raise ValueError('Unsupported raw frame stack version: {}'
+                             .format(version))
+        delays = struct.unpack('<{}I'.format(num_frames),
+                               file_.read(4 * num_frames))
+    return RawHeader(offset, width, height, num_frames, loop_count,
+                     list(delays))
+
+
+def decode_to_raw(filename, raw_filename, force_deinterlace=None):
+    """Decode a GIF into a raw frame stack file and return its header.
+
+    The GIF is read twice: once to count its frames so the output file can
+    be allocated, and again to decode each frame straight into the mapped
+    file. Only one decoded frame is held in memory at a time.
+    """
+    with open(filename, 'rb') as stream:
+        delays = scan_delays(stream)
+        stream.seek(0)
+        gif = GIF(stream, filename=filename,
+                  force_deinterlace=force_deinterlace, streaming=True)
+        offset = data_offset(len(delays))
+        frame_bytes = gif.size[0] * gif.size[1] * 4
+
+        with open(raw_filename, 'w+b') as raw_file:
+            raw_file.truncate(offset + frame_bytes * len(delays))
+            raw_map = mmap.mmap(raw_file.fileno(), 0)
+            try:
+                num_frames = 0
+                for image in gif.images:
+                    if num_frames == len(delays):
+                        raise ValueError('More frames than were counted')
+                    start = offset + num_frames * frame_bytes
+                    raw_map[start:start + frame_bytes] = image.rgba_bytes
+                    num_frames += 1
+                if num_frames != len(delays):
+                    raise ValueError('Fewer frames than were counted')
+
+                header = RawHeader(offset, gif.size[0], gif.size[1],
+                                   num_frames, gif.loop_count, delays)
+                raw_map[:offset] = pack_header(header)
+                raw_map.flush()
+            finally:
+                raw_map.close()
+    return header
@@ -0,0 +1,75 @@
+"""Find GIFs posted to reddit."""
+
+import multiprocessing.pool
+import requests
+import threading
+
+REDDIT_URL = 'https://www.reddit.com'
+
+# seconds to wait to connect to a server, or between bytes from it
+TIMEOUT = 10
+
+
+def make_session(pool_size=8):
+    """Return a session that keeps up to pool_size connections per host."""
+    session = requests.Session()
+    session.headers['User-Agent'] = 'gifprime'
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size,
+                                            pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def search_gifs(session, subreddit, limit, reddit_url=REDDIT_URL,
+                timeout=TIMEOUT):
+    """Return up to limit posts in subreddit that link to a .gif.
+
+    Each post is a dict with at least 'title' and 'url'.
+    """
+    response = session.get(
+        '{}/r/{}/search.json'.format(reddit_url, subreddit),
+        params={'q': 'url:.gif$', 'restrict_sr': 'on', 'limit': limit},
+        timeout=timeout)
+    response.raise_for_status()
+    return [child['data'] for child in response.json()['data']['children']]
+
+
+def find_gif(session, posts, processes=8, timeout=TIMEOUT):
+    """Return the first post whose URL serves a GIF, and the HEAD response.
+
+    The URLs are checked concurrently in a pool of threads, and connections
+    are kept open in the session so the GIF can then be downloaded without
+    connecting again. Checks that have not started are skipped once a GIF
+    is found, and those still running are left to finish in the background.
+    Returns (None, None) if no post serves a GIF.
+    """
+    found = threading.Event()
+    found_lock = threading.Lock()
+
+    def _probe(post):
+        if found.is_set():
+            return None
+        try:
+            response = session.head(post['url'], timeout=timeout)
+        except requests.RequestException:
+            return None
+
+        if (response.status_code == 200 and
+                response.headers.get('content-type') == 'image/gif'):
+            with found_lock:
+                if not found.is_set():
+                    found.set()
+                    return post, response
+        return None
+
+    pool = multiprocessing.pool.ThreadPool(processes)
+    try:
+        for result in pool.imap_unordered(_probe, posts):
+            if result is not None:
+                return result
+        return None, None
+    finally:
+        found.set()
+        # don't wait for probes that are still running
+        pool.close()
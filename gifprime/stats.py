@@ -0,0 +1,365 @@
+"""Timings and counters for each stage of decoding and encoding a GIF.
+
+Recording is off by default. Turn it on for one GIF by passing stats=True to
+GIF or GIF.save, or for every GIF with enable(). The results are kept in
+gif.stats, and passed to every hook added with add_hook when decoding or
+encoding finishes.
+
+Memory can also be measured for each stage and frame, by passing
+stats=Stats(memory=True) or calling enable(memory=True). This uses
+tracemalloc if it is available, and otherwise the resident set size of the
+process, which is coarser. See RSSMemory.
+"""
+
+import abc
+import logging
+import os
+import resource
+import sys
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2 only has it if patched for the pytracemalloc backport
+    tracemalloc = None
+
+logger = logging.getLogger(__name__)
+
+# stages of each operation, in the order they run
+DECODE_STAGES = ('parse', 'lzw', 'deinterlace', 'palette', 'compose',
+                 'disposal')
+ENCODE_STAGES = ('quantize', 'map', 'compress', 'write')
+
+# whether GIFs record stats when not told otherwise
+enabled = False
+# whether those stats include memory
+memory_enabled = False
+
+_hooks = []
+
+
+def enable(on=True, memory=False):
+    """Turn recording on or off for GIFs that are not told otherwise.
+
+    If memory is True, memory is measured too.
+    """
+    global enabled, memory_enabled
+    enabled = on
+    memory_enabled = memory
+
+
+def add_hook(hook):
+    """Call hook(gif, operation, stats) whenever a GIF with stats finishes
+    an operation, which is 'decode' or 'encode'.
+    """
+    _hooks.append(hook)
+
+
+def remove_hook(hook):
+    """Stop calling a hook added with add_hook."""
+    _hooks.remove(hook)
+
+
+def run_hooks(gif, operation, stats):
+    """Call every hook. A failing hook is logged and does not stop the rest.
+    """
+    for hook in list(_hooks):
+        try:
+            hook(gif, operation, stats)
+        except Exception:
+            logger.exception('Stats hook %r failed', hook)
+
+
+def create(on=None):
+    """Return a new Stats if on is True, or if on is None and recording is
+    enabled. Otherwise return None.
+
+    on can also be a Stats to record into.
+    """
+    if isinstance(on, Stats):
+        return on
+    if enabled if on is None else on:
+        return Stats(memory=memory_enabled)
+    return None
+
+
+class Memory(object):
+    """Measures the memory in use, and the peak since reset_peak was called.
+
+    Subclasses give the memory in use and the peak for the whole process.
+    The peak since a reset is the process peak if it has risen since then,
+    and otherwise the larger of the memory in use then and now.
+    """
+
+    __metaclass__ = abc.ABCMeta
+
+    def __init__(self):
+        self._at_reset = (0, 0)
+
+    @abc.abstractmethod
+    def current(self):
+        """Return the memory in use, in bytes."""
+
+    @abc.abstractmethod
+    def process_peak(self):
+        """Return the most memory the process has used, in bytes."""
+
+    def reset_peak(self):
+        self._at_reset = (self.current(), self.process_peak())
+
+    def peak(self):
+        current_at_reset, process_peak_at_reset = self._at_reset
+        process_peak = self.process_peak()
+        if process_peak > process_peak_at_reset:
+            return process_peak
+        return max(current_at_reset, self.current())
+
+
+class TracemallocMemory(Memory):
+    """Memory allocated by Python, traced by tracemalloc.
+
+    Starts tracing if it has not been started. Tracing slows down every
+    allocation.
+    """
+
+    source = 'tracemalloc'
+
+    def __init__(self):
+        Memory.__init__(self)
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def current(self):
+        return tracemalloc.get_traced_memory()[0]
+
+    def process_peak(self):
+        return tracemalloc.get_traced_memory()[1]
+
+    def reset_peak(self):
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        Memory.reset_peak(self)
+
+
+class RSSMemory(Memory):
+    """The resident set size of the process.
+
+    This includes memory that Python has freed but not returned to the
+    operating system, so memory that is freed is often not seen as freed.
+    The peak cannot be reset, so a stage whose peak is below an earlier one
+    is only seen through the memory in use at its start and end. The memory
+    in use is read from /proc, and where that is missing it is the peak.
+    """
+
+    source = 'rss'
+
+    # ru_maxrss is in bytes on OS X and kilobytes elsewhere
+    MAXRSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+
+    def __init__(self):
+        Memory.__init__(self)
+        self._page_size = resource.getpagesize()
+        self._has_proc = os.path.exists('/proc/self/statm')
+
+    def current(self):
+        if not self._has_proc:
+            return self.process_peak()
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * self._page_size
+
+    def process_peak(self):
+        return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss *
+                self.MAXRSS_UNIT)
+
+
+def measure_memory():
+    """Return a Memory that uses tracemalloc if it can."""
+    if tracemalloc is not None:
+        return TracemallocMemory()
+    return RSSMemory()
+
+
+class StageStats(object):
+    """Totals for one stage."""
+
+    __slots__ = ('calls', 'wall_s', 'cpu_s', 'num_bytes', 'num_pixels',
+                 'peak_bytes', 'retained_bytes')
+
+    def __init__(self):
+        self.calls = 0
+        self.wall_s = 0.0
+        self.cpu_s = 0.0
+        # size of the input to the stage
+        self.num_bytes = 0
+        self.num_pixels = 0
+        # the most memory in use above the start of the stage in any call,
+        # and the total left in use after each call, if memory is measured
+        self.peak_bytes = None
+        self.retained_bytes = None
+
+    def as_dict(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__
+                    if getattr(self, name) is not None)
+
+
+class Stats(object):
+    """Wall time, CPU time and byte and pixel counts for each stage.
+
+    Stages are timed back to back, so recording is cheap enough to leave on:
+
+        t = stats.start()
+        ...
+        t = stats.record('lzw', t, num_bytes, num_pixels)
+        ...
+        t = stats.record('palette', t, num_bytes, num_pixels)
+
+    CPU time is for the whole process, so it includes other threads.
+
+    If memory is True, the memory used by each stage is measured too, along
+    with the memory kept by each frame between calls to start_frame and
+    end_frame. This is slower, and measurements are only meaningful if one
+    thing at a time is being recorded.
+    """
+
+    def __init__(self, memory=False):
+        self.stages = {}
+        # dicts describing the memory of each frame, if memory is measured
+        self.frames = []
+        self.memory = measure_memory() if memory else None
+        # memory in use at the start of the frame and its highest peak
+        self._frame = None
+
+    def start(self):
+        """Return the current time, to be passed to record."""
+        if self.memory is not None:
+            self.memory.reset_peak()
+            return time.time(), time.clock(), self.memory.current()
+        return time.time(), time.clock()
+
+    def record(self, stage, start, num_bytes=0, num_pixels=0):
+        """Add the time since start to a stage, and return the current time.
+        """
+        now = time.time(), time.clock()
+        stage_stats = self.stages.get(stage)
+        if stage_stats is None:
+            stage_stats = self.stages[stage] = StageStats()
+        stage_stats.calls += 1
+        stage_stats.wall_s += now[0] - start[0]
+        stage_stats.cpu_s += now[1] - start[1]
+        stage_stats.num_bytes += num_bytes
+        stage_stats.num_pixels += num_pixels
+
+        if self.memory is not None:
+            current = self.memory.current()
+            peak = self.memory.peak()
+            stage_stats.peak_bytes = max(stage_stats.peak_bytes or 0,
+                                         peak - start[2])
+            stage_stats.retained_bytes = ((stage_stats.retained_bytes or 0) +
+                                          current - start[2])
+            if self._frame is not None:
+                self._frame[1] = max(self._frame[1], peak)
+            self.memory.reset_peak()
+            now += (current,)
+        return now
+
+    def start_frame(self):
+        """Start measuring the memory kept by a frame."""
+        if self.memory is not None:
+            current = self.memory.current()
+            self._frame = [current, current]
+
+    def end_frame(self, operation, num_pixels):
+        """Record the memory kept by a frame of an operation since
+        start_frame.
+        """
+        if self.memory is not None and self._frame is not None:
+            start, peak = self._frame
+            retained = self.memory.current() - start
+            self.frames.append({
+                'operation': operation,
+                'num_pixels': num_pixels,
+                'peak_bytes': max(peak, self.memory.peak()) - start,
+                'retained_bytes': retained,
+                'bytes_per_pixel': float(retained) / max(1, num_pixels),
+            })
+            self._frame = None
+
+    def frame_summary(self):
+        """Return the totals of the frames of each operation.
+
+        bytes_per_pixel is the memory kept per pixel of the frames, which for
+        decoding is the cost of storing them.
+        """
+        summary = {}
+        for frame in self.frames:
+            totals = summary.setdefault(frame['operation'], {
+                'frames': 0,
+                'num_pixels': 0,
+                'peak_bytes': 0,
+                'retained_bytes': 0,
+            })
+            totals['frames'] += 1
+            totals['num_pixels'] += frame['num_pixels']
+            totals['peak_bytes'] = max(totals['peak_bytes'],
+                                       frame['peak_bytes'])
+            totals['retained_bytes'] += frame['retained_bytes']
+        for totals in summary.itervalues():
+            totals['bytes_per_pixel'] = (float(totals['retained_bytes']) /
+                                         max(1, totals['num_pixels']))
+        return summary
+
+    def as_dict(self):
+        """Return the totals as a dict of dicts, keyed by stage."""
+        return dict((stage, stage_stats.as_dict())
+                    for stage, stage_stats in self.stages.iteritems())
+
+    def format(self):
+        """Return the totals as a table, with stages in the order they run."""
+        order = DECODE_STAGES + ENCODE_STAGES
+        stages = sorted(self.stages, key=lambda stage: (
+            order.index(stage) if stage in order else len(order), stage))
+        line_format = '{:<12} {:>7} {:>10} {:>10} {:>12} {:>12}'
+        headings = ['stage', 'calls', 'wall s', 'cpu s', 'bytes', 'pixels']
+        if self.memory is not None:
+            line_format += ' {:>12} {:>12}'
+            headings += ['peak bytes', 'kept bytes']
+        lines = [line_format.format(*headings)]
+        for stage in stages:
+            stage_stats = self.stages[stage]
+            values = [stage, stage_stats.calls,
+                      '{:.4f}'.format(stage_stats.wall_s),
+                      '{:.4f}'.format(stage_stats.cpu_s),
+                      stage_stats.num_bytes, stage_stats.num_pixels]
+            if self.memory is not None:
+                values += [stage_stats.peak_bytes, stage_stats.retained_bytes]
+            lines.append(line_format.format(*values))
+
+        if self.memory is not None:
+            lines.append('memory measured with {}'.format(self.memory.source))
+            for operation, totals in sorted(self.frame_summary().iteritems()):
+                lines.append(
+                    '{} frames: {}, peak {} bytes, kept {} bytes, {:.1f} '
+                    'bytes per pixel'.format(
+                        operation, totals['frames'], totals['peak_bytes'],
+                        totals['retained_bytes'], totals['bytes_per_pixel']))
+        return '\n'.join(lines)
+
+
+class NullStats(object):
+    """Stands in for Stats when nothing is being recorded."""
+
+    def start(self):
+        return None
+
+    def record(self, stage, start, num_bytes=0, num_pixels=0):
+        return None
+
+    def start_frame(self):
+        pass
+
+    def end_frame(self, operation, num_pixels):
+        pass
+
+
+NULL_STATS = NullStats()
@@ -0,0 +1,90 @@
+"""Tests for batch processing."""
+
+from StringIO import StringIO
+import os
+
+from gifprime import batch, lzw, transcode
+
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+
+
+def test_find_files():
+    filenames = batch.find_files([
+        DATA_DIR,
+        os.path.join(DATA_DIR, 'whitepixel.gif'),
+        os.path.join(DATA_DIR, 'whitepixel*.gif'),
+    ])
+    num_gifs = len([name for name in os.listdir(DATA_DIR)
+                    if name.endswith('.gif')])
+    assert len(filenames) == num_gifs + 3
+    assert all(filename.endswith('.gif') for filename in filenames)
+
+
+def test_process_file_encode(tmpdir):
+    filename = os.path.join(DATA_DIR, '8x8gradientanim.gif')
+    result = batch.process_file(filename, 'encode', output_dir=str(tmpdir))
+    assert result['error'] is None
+    assert result['frames'] == 3
+    assert result['size'] == [8, 8]
+    assert set(result['timings']) == {'parse', 'decode', 'encode', 'write'}
+    assert os.path.getsize(result['output']) == result['output_bytes']
+
+
+def test_process_file_invalid(tmpdir):
+    filename = tmpdir.join('truncated.gif')
+    filename.write('GIF89a\x01')
+    result = batch.process_file(str(filename), 'validate')
+    assert result['error'] is not None
+    assert result['failed_stage'] == 'parse'
+    assert not result['valid']
+
+
+def test_process_files_parallel():
+    filenames = [os.path.join(DATA_DIR, name)
+                 for name in ['interlaced.gif', 'whitepixel.gif']]
+    results = list(batch.process_files(filenames, 'validate', processes=2))
+    assert sorted(r['filename'] for r in results) == filenames
+    assert all(r['valid'] for r in results)
+
+
+def write_gif(filename, screen_size, frame_size, indices, trailer=True):
+    """Write a one-frame GIF with a 2-colour global colour table."""
+    with open(filename, 'wb') as stream:
+        transcode.write_header(stream, screen_size,
+                               [(0, 0, 0), (255, 255, 255)])
+        transcode.write_frame(stream, frame_size, None, 2,
+                              lzw.compress(indices, 2), None, 0)
+        if trailer:
+            transcode.write_trailer(stream)
+
+
+def test_validate(tmpdir):
+    filename = tmpdir.join('valid.gif').strpath
+    write_gif(filename, (2, 2), (2, 2), '\x00\x01\x01\x00')
+    assert batch.validate(filename) == []
+    assert batch.validate(os.path.join(DATA_DIR, 'interlaced.gif')) == []
+
+
+def test_validate_problems(tmpdir):
+    filename = tmpdir.join('invalid.gif').strpath
+    write_gif(filename, (2, 2), (2, 2), '\x00\x01\x03\x00\x01\x00')
+    assert batch.validate(filename) == [
+        'frame 0 has 6 colour indices, expected 4',
+        'frame 0 uses colour index 3, but its colour table has 2 colours',
+    ]
+
+    write_gif(filename, (2, 2), (3, 2), '\x00' * 6, trailer=False)
+    assert batch.validate(filename) == [
+        'frame 0 at (0, 0) of 3x2 is outside the 2x2 screen',
+        'no trailer',
+    ]
+
+
+def test_write_results_counts_invalid(tmpdir):
+    filename = tmpdir.join('invalid.gif').strpath
+    write_gif(filename, (2, 2), (2, 2), '\x00\x01\x00\x00\x01\x00')
+    results = batch.process_files(
+        [filename, os.path.join(DATA_DIR, 'whitepixel.gif')], 'validate')
+    counts = batch.write_results(results, StringIO())
+    assert counts == {'files': 2, 'errors': 0, 'invalid': 1, 'failed': 1}
@@ -0,0 +1,59 @@
+"""Tests for the benchmarks."""
+
+import os
+
+from gifprime import benchmark
+
+
+def test_benchmark_viewer():
+    filename = os.path.join(benchmark.DATA_DIR,
+                            '8x8gradientanim_loop_twice.gif')
+    result = benchmark.benchmark_viewer(filename, num_frames=10, scaled=True,
+                                        show_info=True)
+    # playback stops after two loops of three frames
+    assert result['frames'] == 5
+    assert result['deadline_misses'] <= result['frames']
+    assert result['mean_draw_ms'] > 0
+    assert result['peak_memory_bytes'] > 0
+
+
+def test_run_suite():
+    case = benchmark.BenchmarkInput.from_file(
+        os.path.join(benchmark.DATA_DIR, '8x8gradientanim.gif'))
+    results = benchmark.run_suite([case, benchmark.synthetic_input(16)],
+                                  repeat=1)
+    assert sorted(results) == sorted(
+        '{}:{}'.format(name, input_name)
+        for name in benchmark.BENCHMARKS
+        for input_name in ['8x8gradientanim.gif', 'synthetic-16x16'])
+    for result in results.itervalues():
+        assert result['seconds'] >= 0
+        assert result['mb_per_s'] > 0
+
+
+def test_find_regressions():
+    baseline = {
+        'parse:a.gif': {'seconds': 1, 'mb_per_s': 10, 'mp_per_s': 1},
+        'save:a.gif': {'seconds': 1, 'mb_per_s': 10, 'mp_per_s': 1},
+        'removed:a.gif': {'seconds': 1, 'mb_per_s': 10, 'mp_per_s': 1},
+    }
+    results = {
+        'parse:a.gif': {'seconds': 1, 'mb_per_s': 8.5, 'mp_per_s': 1},
+        'save:a.gif': {'seconds': 2, 'mb_per_s': 5, 'mp_per_s': 0.5},
+        'new:a.gif': {'seconds': 1, 'mb_per_s': 1, 'mp_per_s': 1},
+    }
+    assert benchmark.find_regressions(results, baseline, 0.2) == [
+        ('save:a.gif', 10, 5)]
+    assert benchmark.find_regressions(results, baseline, 0.1) == [
+        ('parse:a.gif', 10, 8.5), ('save:a.gif', 10, 5)]
+
+
+def test_run_suite_memory():
+    case = benchmark.BenchmarkInput.from_file(
+        os.path.join(benchmark.DATA_DIR, 'whitepixel.gif'))
+    results = benchmark.run_suite([case], ['decode'], repeat=1, memory=True)
+    result = results['decode:whitepixel.gif']
+    assert result['peak_bytes'] >= 0
+    assert 'retained_bytes' in result
+    stats = benchmark.profile_memory(case)
+    assert stats.frame_summary()['decode']['frames'] == 1
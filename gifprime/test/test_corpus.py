@@ -0,0 +1,58 @@
+"""Tests for the synthetic GIF corpus."""
+
+from StringIO import StringIO
+import pytest
+
+from gifprime import corpus
+from gifprime.core import GIF
+
+
+@pytest.mark.parametrize('name', sorted(corpus.PROFILES))
+def test_generate(name):
+    stream = StringIO()
+    entry = corpus.generate(stream, name, 'tiny')
+    assert entry['bytes'] == len(stream.getvalue())
+
+    stream.seek(0)
+    gif = GIF(stream)
+    assert gif.size == (entry['width'], entry['height'])
+    assert len(gif.images) == entry['frames']
+    assert corpus.pixel_checksum(gif) == entry['checksum']
+
+
+def test_generate_deterministic():
+    first, second, other_seed = StringIO(), StringIO(), StringIO()
+    corpus.generate(first, 'local-tables', 'tiny', seed=1)
+    corpus.generate(second, 'local-tables', 'tiny', seed=1)
+    corpus.generate(other_seed, 'local-tables', 'tiny', seed=2)
+    assert first.getvalue() == second.getvalue()
+    assert first.getvalue() != other_seed.getvalue()
+
+
+def test_scaled():
+    profile = corpus.PROFILES['canvas-4k']
+    assert corpus.scaled(profile, 'full') == (3840, 2160, 3)
+    assert corpus.scaled(profile, 'small') == (960, 540, 2)
+    assert corpus.scaled(corpus.PROFILES['long'], 'tiny') == (8, 8, 78)
+
+
+def test_interlace():
+    rows = ''.join(chr(y) * 2 for y in xrange(10))
+    assert corpus.interlace(rows, 2, 10) == ''.join(
+        chr(y) * 2 for y in [0, 8, 4, 2, 6, 1, 3, 5, 7, 9])
+
+
+def test_verify_corpus(tmpdir):
+    directory = str(tmpdir)
+    manifest = corpus.generate_corpus(directory, ['long', 'interlaced'],
+                                      'tiny')
+    assert sorted(manifest) == ['interlaced-tiny-0.gif', 'long-tiny-0.gif']
+    assert corpus.verify_corpus(directory) == []
+
+    # change a pixel of the last frame
+    with open(tmpdir.join('long-tiny-0.gif').strpath, 'r+b') as file_:
+        file_.seek(-4, 2)
+        last = file_.read(1)
+        file_.seek(-4, 2)
+        file_.write(chr(ord(last) ^ 1))
+    assert corpus.verify_corpus(directory) == ['long-tiny-0.gif']
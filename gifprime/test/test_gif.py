@@ -165,3 +165,78 @@ def test_gif_quantization(name):
         # load resulting gif and compare to reference
         reencoded_ref = load_reference_gif(encoded_file.name)
         assert ref == reencoded_ref
+
+
+def test_image_rgba_bytes():
+    """RGBA bytes follow the image's RGBA tuples."""
+    image = Image([(1, 2, 3, 255), (4, 5, 6, 0)], (2, 1), 0)
+    assert image.rgba_bytes == '\x01\x02\x03\xff\x04\x05\x06\x00'
+    image.rgba_data = [(7, 8, 9, 255)]
+    assert image.rgba_bytes == '\x07\x08\x09\xff'
+
+
+def test_image_from_rgba_bytes():
+    """Images can be created from RGBA bytes without unpacking them."""
+    image = Image.from_rgba_bytes('\x01\x02\x03\xff\x04\x05\x06\x00',
+                                  (2, 1), 0)
+    # the bytes are the only copy of the pixels, so are kept
+    image.release_rgba_bytes()
+    assert image.rgba_bytes == '\x01\x02\x03\xff\x04\x05\x06\x00'
+    assert image.rgba_data == [(1, 2, 3, 255), (4, 5, 6, 0)]
+    with pytest.raises(ValueError):
+        Image.from_rgba_bytes('\x01\x02\x03', (2, 1), 0)
+
+
+def test_image_from_numpy_array():
+    numpy = pytest.importorskip('numpy')
+    pixels = numpy.arange(24, dtype=numpy.uint8).reshape(2, 3, 4)
+    image = Image.from_rgba_bytes(pixels, (3, 2), 0)
+    assert image.rgba_bytes == pixels.tostring()
+
+
+@pytest.mark.parametrize('name', [
+    'whitepixel.gif',
+    '8x8gradientanim_loop_twice.gif',
+    'disposal_prev.gif',
+    'interlaced.gif',
+])
+def test_gif_decode_progressive(name):
+    """Progressive decoding gives the same result as normal decoding."""
+    gif = GIF.from_file(get_test_gif_path(name))
+    progressive_gif = GIF.from_file(get_test_gif_path(name), progressive=True)
+    assert progressive_gif.size == gif.size
+    assert ([(i.rgba_data, i.delay_ms) for i in progressive_gif.images] ==
+            [(i.rgba_data, i.delay_ms) for i in gif.images])
+    assert progressive_gif.images.is_closed
+    assert progressive_gif.loop_count == gif.loop_count
+
+
+@pytest.mark.parametrize('progressive', [False, True])
+def test_gif_release_image(progressive):
+    """Released frames are decoded again when their bytes are needed."""
+    path = get_test_gif_path('disposal_prev.gif')
+    expected = [image.rgba_bytes for image in GIF.from_file(path).images]
+    gif = GIF.from_file(path, progressive=progressive)
+    list(gif.images)
+    uncompressed_size = gif.uncompressed_size
+
+    for i in xrange(len(expected)):
+        gif.release_image(i)
+        assert gif.images[i].is_released
+    # out of order, so some frames are decoded from the first frame again
+    for i in [2, 3, 0, 3, 1]:
+        assert gif.rgba_bytes(i) == expected[i]
+    assert [image.rgba_bytes for image in gif.images] == expected
+    assert gif.uncompressed_size == uncompressed_size
+    assert gif.num_decoded == len(expected)
+
+
+def test_gif_release_image_not_decoded():
+    """Frames that were not decoded keep their pixels when released."""
+    gif = GIF()
+    gif.images = [Image([(1, 2, 3, 255)], (1, 1), 0)]
+    gif.images[0].rgba_bytes
+    gif.release_image(0)
+    assert gif.rgba_bytes(0) == '\x01\x02\x03\xff'
+    gif.images[0].release()
+    assert gif.images[0].is_released
@@ -0,0 +1,197 @@
+"""Tests for the colour quantizer."""
+
+from StringIO import StringIO
+import pytest
+
+from gifprime import quantize
+from gifprime.core import GIF, Image
+
+
+requires_numpy = pytest.mark.skipif(quantize.cluster is None,
+                                    reason='NumPy is not installed')
+
+
+def test_exact_palette_few_colours():
+    pixels = [(0, 0, 0), (255, 0, 0), (0, 0, 0), (1, 2, 3)]
+    colour_list, colour_map = quantize.exact_palette(pixels, 3)
+    assert len(colour_list) == 3
+    for pixel in pixels:
+        assert colour_list[colour_map[pixel]] == pixel
+
+
+def test_exact_palette_too_many_colours():
+    pixels = [(i, i, i) for i in xrange(10)]
+    assert quantize.exact_palette(pixels, 9) is None
+
+
+def test_histogram():
+    pixels = [(0, 0, 0), (255, 0, 0), (0, 0, 0)]
+    assert quantize.histogram(pixels) == {(0, 0, 0): 2, (255, 0, 0): 1}
+
+
+def test_quantize_reduces_colours():
+    pixels = [(r, g, 0) for r in xrange(0, 256, 8) for g in xrange(0, 256, 8)]
+    colour_list, colour_map = quantize.quantize(pixels * 2, 16)
+    assert 0 < len(colour_list) <= 16
+    assert set(colour_map) == set(pixels)
+    assert all(0 <= i < len(colour_list) for i in colour_map.values())
+
+
+def test_octree_get_deepest_containing():
+    tree = quantize.ColourOctree()
+    tree.insert((255, 0, 0), 3)
+    leaf = tree.get_deepest_containing((255, 0, 0))
+    assert tree.num_pixels_exclusive[leaf] == 3
+    assert tree.mean_colour(leaf) == (255, 0, 0)
+    assert tree.num_pixels[0] == 3
+    # a colour in an empty part of the tree stops at the root
+    assert tree.get_deepest_containing((0, 0, 255)) == 0
+
+
+def test_quantize_hits_colour_budget_exactly():
+    pixels = [(r, g, b) for r in xrange(0, 256, 32) for g in xrange(0, 256, 32)
+              for b in xrange(0, 256, 64)]
+    for max_colours in [1, 2, 7, 100, 255]:
+        colour_list, _ = quantize.quantize(pixels, max_colours)
+        assert len(colour_list) == max_colours
+
+
+def test_colour_map_map_pixels():
+    colour_map = quantize.ColourMap({(1, 2, 3): 1, (255, 255, 255): 2})
+    rgba = '\x01\x02\x03\xff\xff\xff\xff\xff\x01\x02\x03\x00'
+    assert colour_map.map_pixels(rgba) == '\x01\x02\x01'
+    assert colour_map.map_pixels(rgba, 5) == '\x01\x02\x05'
+    lut = colour_map.fill_lut({})
+    assert colour_map.map_pixels(rgba, 5, lut) == '\x01\x02\x05'
+
+
+def test_colour_map_reused_lut():
+    lut = bytearray(quantize.LUT_SIZE)
+    quantize.ColourMap({(1, 2, 3): 1, (4, 5, 6): 2}).fill_lut(lut)
+    colour_map = quantize.ColourMap({(1, 2, 3): 3})
+    assert colour_map.map_pixels('\x01\x02\x03\xff', None,
+                                 colour_map.fill_lut(lut)) == '\x03'
+    # the entry left by the first map is not used by the second
+    assert lut[4 | 5 << 8 | 6 << 16] == 2
+
+
+@requires_numpy
+@pytest.mark.parametrize('quantizer', ['median-cut', 'kmeans'])
+def test_clustering_quantizers(quantizer):
+    pixels = [(r, g, 0) for r in xrange(0, 256, 8) for g in xrange(0, 256, 8)]
+    colour_list, colour_map = quantize.quantize(pixels, 16, quantizer)
+    assert 0 < len(colour_list) <= 16
+    assert set(colour_map) == set(pixels)
+    assert all(0 <= i < len(colour_list) for i in colour_map.values())
+
+
+@requires_numpy
+@pytest.mark.parametrize('quantizer', ['median-cut', 'kmeans'])
+def test_clustering_quantizers_few_colours(quantizer):
+    pixels = [(0, 0, 0), (10, 20, 30), (255, 255, 255), (0, 0, 0)]
+    colour_list, colour_map = quantize.quantize(pixels, 16, quantizer)
+    for pixel in pixels:
+        assert colour_list[colour_map[pixel]] == pixel
+
+
+def test_unknown_quantizer():
+    with pytest.raises(ValueError):
+        quantize.quantize([(0, 0, 0)], 16, 'unknown')
+
+
+def test_frames_histogram_parallel(monkeypatch):
+    monkeypatch.setattr(quantize, 'HISTOGRAM_CHUNK_SIZE', 7)
+    frames = [''.join(chr((i * j) % 256) for i in xrange(400))
+              for j in xrange(1, 4)]
+    colour_counts = quantize.frames_histogram(frames)
+    assert sum(colour_counts.values()) == 300
+    parallel_counts = quantize.frames_histogram(frames, processes=2)
+    assert parallel_counts == colour_counts
+    assert (quantize.quantize_histogram(parallel_counts, 8) ==
+            quantize.quantize_histogram(colour_counts, 8))
+
+
+def test_sample_histogram():
+    frames = ['\x00\x00\x00\xff\x01\x01\x01\xff' * 4] * 2
+    # the second frame starts sampling at the second pixel
+    assert quantize.sample_histogram(frames, 2) == {(0, 0, 0): 4,
+                                                    (1, 1, 1): 4}
+
+
+@pytest.mark.parametrize('quantizer', [
+    'octree',
+    pytest.param('median-cut', marks=requires_numpy),
+    pytest.param('kmeans', marks=requires_numpy),
+])
+def test_quantize_from_sample(monkeypatch, quantizer):
+    monkeypatch.setattr(quantize, 'INITIAL_SAMPLE_SIZE', 64)
+    pixels = [(r, g, 128) for r in xrange(0, 256, 4) for g in xrange(0, 256, 4)]
+    frames = [''.join(chr(c) for pixel in pixels for c in pixel + (255,))]
+    colour_counts = quantize.frames_histogram(frames)
+    samples = []
+    sample_histogram = quantize.sample_histogram
+    monkeypatch.setattr(quantize, 'sample_histogram', lambda *args: (
+        samples.append(sample_histogram(*args)) or samples[-1]))
+    colour_list, colour_map = quantize.progressive_sample(
+        frames, 16, quantizer, tolerance=1000, colour_counts=colour_counts)
+    assert sum(samples[-1].values()) < len(pixels)
+    assert 0 < len(colour_list) <= 16
+    # every colour is mapped, including those not in the sample
+    assert set(colour_map) == set(pixels)
+    assert (colour_list, colour_map) == quantize.quantize_histogram(
+        colour_counts, 16, quantizer, samples[-1])
+
+
+def test_quantize_from_every_pixel(monkeypatch):
+    pixels = [(r, g, 128) for r in xrange(0, 256, 4) for g in xrange(0, 256, 4)]
+    frames = [''.join(chr(c) for pixel in pixels for c in pixel + (255,))]
+    colour_counts = quantize.frames_histogram(frames)
+    # too few pixels to sample, so the histogram given is used
+    monkeypatch.setattr(quantize, 'sample_histogram', None)
+    assert (quantize.progressive_sample(frames, 16,
+                                        colour_counts=colour_counts) ==
+            quantize.quantize_histogram(colour_counts, 16))
+
+
+def test_quantization_cache(tmpdir):
+    colour_counts = quantize.histogram(
+        [(r, g, 0) for r in xrange(0, 256, 8) for g in xrange(0, 256, 8)])
+    palette = quantize.quantize_histogram(colour_counts, 16)
+    cache = quantize.QuantizationCache(max_entries=1,
+                                       directory=str(tmpdir))
+    key = cache.key(colour_counts, 16, 'octree')
+    assert key != cache.key(colour_counts, 15, 'octree')
+    assert cache.get(key) is None
+    cache.put(key, palette)
+    assert cache.get(key) == palette
+    # evict the entry from memory, it is still on disk
+    cache.put('other', palette)
+    assert cache.get(key) == palette
+    assert cache.stats == {'hits': 2, 'misses': 1, 'entries': 1}
+    # another cache can use the stored results
+    other_cache = quantize.QuantizationCache(directory=str(tmpdir))
+    assert other_cache.get(key) == palette
+
+
+def test_quantization_cache_memory():
+    pixels = [(r, g, 0) for r in xrange(0, 256, 8) for g in xrange(0, 256, 8)]
+    gif = GIF()
+    gif.size = (32, 32)
+    gif.images = [Image(pixels, gif.size, 0)]
+    cache = quantize.QuantizationCache()
+    gif.save(StringIO(), cache=cache)
+    (palette,) = cache._entries.values()
+    # neither a lookup table nor the octree is kept
+    assert palette[1]._lut is None
+    assert palette[1].assign is None
+
+
+def test_gif_colour_table():
+    assert quantize.gif_colour_table([(1, 2, 3)], False) == (
+        [(1, 2, 3), (0, 0, 0)], None)
+    colour_table, transparent_index = quantize.gif_colour_table(
+        [(1, 2, 3)] * 4, True)
+    assert len(colour_table) == 8
+    assert transparent_index == 4
+    assert quantize.has_alpha(['\x00\x00\x00\xff', '\x00\x00\x00\x80'])
+    assert not quantize.has_alpha(['\x00\x00\x00\xff'])
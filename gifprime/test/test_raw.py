@@ -0,0 +1,52 @@
+"""Tests for raw frame stack export."""
+
+import os
+import pytest
+
+from gifprime import raw
+from gifprime.core import GIF
+
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+
+
+@pytest.mark.parametrize('name', [
+    '8x8gradientanim_delay_1s_2s_3s.gif',
+    'disposal_prev.gif',
+    'interlaced.gif',
+])
+def test_decode_to_raw(name, tmpdir):
+    filename = os.path.join(DATA_DIR, name)
+    raw_filename = str(tmpdir.join('frames.raw'))
+    header = raw.decode_to_raw(filename, raw_filename)
+    assert raw.read_header(raw_filename) == header
+    assert header.data_offset % raw.DATA_ALIGNMENT == 0
+
+    gif = GIF.from_file(filename)
+    assert (header.width, header.height) == gif.size
+    assert header.delays == [image.delay_ms for image in gif.images]
+    assert header.loop_count == gif.loop_count
+
+    with open(raw_filename, 'rb') as file_:
+        file_.seek(header.data_offset)
+        for image in gif.images:
+            assert file_.read(len(image.rgba_bytes)) == image.rgba_bytes
+        assert file_.read() == ''
+
+
+def test_decode_to_raw_memmap(tmpdir):
+    numpy = pytest.importorskip('numpy')
+    filename = os.path.join(DATA_DIR, '8x8gradientanim.gif')
+    raw_filename = str(tmpdir.join('frames.raw'))
+    raw.decode_to_raw(filename, raw_filename)
+
+    header = raw.read_header(raw_filename)
+    frames = numpy.memmap(raw_filename, numpy.uint8, 'r', header.data_offset,
+                          (header.num_frames, header.height, header.width, 4))
+    gif = GIF.from_file(filename)
+    assert frames[2, 0, 1].tolist() == list(gif.images[2].rgba_data[1])
+
+
+def test_read_header_not_raw():
+    with pytest.raises(ValueError):
+        raw.read_header(os.path.join(DATA_DIR, 'whitepixel.gif'))
@@ -0,0 +1,121 @@
+"""Tests for finding GIFs on reddit, against a local stub server."""
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+import json
+import os
+import pytest
+import threading
+import time
+
+from gifprime import reddit
+from gifprime.core import GIF
+
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    """Serves a reddit search listing and files with configurable latency.
+
+    routes maps paths to (seconds to wait, status, content type, body).
+    """
+
+    daemon_threads = True
+
+    def __init__(self, routes):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), StubHandler)
+        self.routes = routes
+        self.num_connections = 0
+
+    def process_request(self, request, client_address):
+        self.num_connections += 1
+        ThreadingMixIn.process_request(self, request, client_address)
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}'.format(self.server_address[1])
+
+
+class StubHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_HEAD(self):
+        self.do_GET(send_body=False)
+
+    def do_GET(self, send_body=True):
+        path = self.path.split('?', 1)[0]
+        latency, status, content_type, body = self.server.routes.get(
+            path, (0, 404, 'text/plain', 'not found'))
+        time.sleep(latency)
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(request):
+    with open(os.path.join(DATA_DIR, '8x8gradientanim.gif'), 'rb') as file_:
+        gif = file_.read()
+    server = StubServer({
+        '/slow.gif': (1, 200, 'image/gif', gif),
+        '/fast.gif': (0.05, 200, 'image/gif', gif),
+        '/page.gif': (0, 200, 'text/html', '<html></html>'),
+    })
+    posts = [{'title': name, 'url': server.url + '/' + name}
+             for name in ['slow.gif', 'page.gif', 'fast.gif', 'missing.gif']]
+    server.routes['/r/gifs/search.json'] = (0, 200, 'application/json',
+                                            json.dumps({'data': {'children': [
+                                                {'data': post}
+                                                for post in posts]}}))
+
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    request.addfinalizer(server.shutdown)
+    return server
+
+
+def test_search_gifs(server):
+    session = reddit.make_session()
+    posts = reddit.search_gifs(session, 'gifs', 4, server.url)
+    assert [post['title'] for post in posts] == [
+        'slow.gif', 'page.gif', 'fast.gif', 'missing.gif']
+
+
+def test_find_gif_fastest_wins(server):
+    session = reddit.make_session()
+    posts = reddit.search_gifs(session, 'gifs', 4, server.url)
+    start = time.time()
+    post, response = reddit.find_gif(session, posts, processes=4)
+    assert time.time() - start < 1
+    assert post['title'] == 'fast.gif'
+    assert response.headers['content-type'] == 'image/gif'
+
+    # the download reuses a connection from the session
+    num_connections = server.num_connections
+    gif = GIF.from_url(post['url'], session=session)
+    assert server.num_connections == num_connections
+    expected = GIF.from_file(os.path.join(DATA_DIR, '8x8gradientanim.gif'))
+    assert ([image.rgba_data for image in gif.images] ==
+            [image.rgba_data for image in expected.images])
+
+
+def test_find_gif_none_found(server):
+    session = reddit.make_session()
+    posts = [{'title': name, 'url': server.url + '/' + name}
+             for name in ['page.gif', 'missing.gif']]
+    assert reddit.find_gif(session, posts) == (None, None)
+
+
+def test_find_gif_timeout(server):
+    session = reddit.make_session()
+    posts = [{'title': 'slow.gif', 'url': server.url + '/slow.gif'}]
+    assert reddit.find_gif(session, posts, timeout=0.1) == (None, None)
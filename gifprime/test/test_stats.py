@@ -0,0 +1,212 @@
+"""Tests for recording stage stats."""
+
+from StringIO import StringIO
+import os
+import pytest
+
+from gifprime.core import GIF
+import gifprime.stats
+
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+
+
+@pytest.fixture
+def hook_calls(request):
+    calls = []
+    hook = lambda gif, operation, stats: calls.append((gif, operation, stats))
+    gifprime.stats.add_hook(hook)
+    request.addfinalizer(lambda: gifprime.stats.remove_hook(hook))
+    return calls
+
+
+def test_stats_off_by_default():
+    gif = GIF.from_file(os.path.join(DATA_DIR, 'whitepixel.gif'))
+    list(gif.images)
+    gif.save(StringIO())
+    assert gif.stats is None
+
+
+def test_decode_stats(hook_calls):
+    filename = os.path.join(DATA_DIR, 'interlaced.gif')
+    gif = GIF.from_file(filename, stats=True)
+    assert hook_calls == []
+    images = list(gif.images)
+
+    stages = gif.stats.as_dict()
+    assert sorted(stages) == sorted(gifprime.stats.DECODE_STAGES)
+    assert stages['parse']['num_bytes'] == os.path.getsize(filename)
+    num_pixels = gif.size[0] * gif.size[1] * len(images)
+    for stage in ['lzw', 'deinterlace', 'palette', 'compose']:
+        assert stages[stage]['calls'] == len(images)
+        assert stages[stage]['num_pixels'] == num_pixels
+        assert stages[stage]['wall_s'] >= 0
+    assert hook_calls == [(gif, 'decode', gif.stats)]
+
+
+def test_encode_stats(hook_calls):
+    gif = GIF.from_file(os.path.join(DATA_DIR, '8x8gradientanim.gif'))
+    list(gif.images)
+    stream = StringIO()
+    gif.save(stream, stats=True)
+
+    stages = gif.stats.as_dict()
+    assert sorted(stages) == sorted(gifprime.stats.ENCODE_STAGES)
+    assert stages['quantize']['num_pixels'] == 8 * 8 * len(gif.images)
+    assert stages['map']['calls'] == len(gif.images)
+    assert stages['write']['num_bytes'] == len(stream.getvalue())
+    assert hook_calls == [(gif, 'encode', gif.stats)]
+
+
+def test_enable(request):
+    gifprime.stats.enable()
+    request.addfinalizer(lambda: gifprime.stats.enable(False))
+    assert GIF().stats is not None
+    assert GIF(stats=False).stats is None
+
+
+def test_failing_hook(hook_calls):
+    def hook(gif, operation, stats):
+        raise ValueError('broken hook')
+    gifprime.stats.add_hook(hook)
+    try:
+        gif = GIF.from_file(os.path.join(DATA_DIR, 'whitepixel.gif'),
+                            stats=True)
+        list(gif.images)
+    finally:
+        gifprime.stats.remove_hook(hook)
+    # later hooks still run
+    assert [operation for _, operation, _ in hook_calls] == ['decode']
+
+
+class FakeMemory(gifprime.stats.Memory):
+    """Memory whose usage is set by the test."""
+
+    source = 'fake'
+
+    def __init__(self):
+        gifprime.stats.Memory.__init__(self)
+        self.in_use = 0
+        self.highest = 0
+
+    def use(self, num_bytes):
+        self.in_use = num_bytes
+        self.highest = max(self.highest, num_bytes)
+
+    def current(self):
+        return self.in_use
+
+    def process_peak(self):
+        return self.highest
+
+
+def test_memory_abstract():
+    class NoPeakMemory(gifprime.stats.Memory):
+        def current(self):
+            return 0
+
+    with pytest.raises(TypeError):
+        NoPeakMemory()
+
+
+def test_memory_peak():
+    memory = FakeMemory()
+    memory.use(100)
+    memory.use(10)
+    memory.reset_peak()
+    memory.use(50)
+    memory.use(20)
+    # below the process peak, so only the memory in use is seen
+    assert memory.peak() == 20
+    memory.use(150)
+    memory.use(30)
+    assert memory.peak() == 150
+
+
+def test_stage_and_frame_memory():
+    stats = gifprime.stats.Stats()
+    stats.memory = FakeMemory()
+
+    stats.start_frame()
+    t = stats.start()
+    stats.memory.use(1000)
+    stats.memory.use(400)
+    t = stats.record('palette', t, 4, 4)
+    stats.memory.use(300)
+    stats.record('compose', t, 16, 4)
+    stats.end_frame('decode', 4)
+
+    stages = stats.as_dict()
+    assert stages['palette']['peak_bytes'] == 1000
+    assert stages['palette']['retained_bytes'] == 400
+    assert stages['compose']['peak_bytes'] == 0
+    assert stages['compose']['retained_bytes'] == -100
+    assert stats.frames == [{
+        'operation': 'decode',
+        'num_pixels': 4,
+        'peak_bytes': 1000,
+        'retained_bytes': 300,
+        'bytes_per_pixel': 75.0,
+    }]
+    assert stats.frame_summary()['decode']['bytes_per_pixel'] == 75.0
+    assert 'memory measured with fake' in stats.format()
+
+
+def test_memory_stats():
+    stats = gifprime.stats.Stats(memory=True)
+    gif = GIF.from_file(os.path.join(DATA_DIR, '8x8gradientanim.gif'),
+                        stats=stats)
+    assert gif.stats is stats
+    images = list(gif.images)
+    gif.save(StringIO())
+
+    for stage in ['lzw', 'palette', 'compose', 'map', 'compress', 'write']:
+        assert stats.stages[stage].peak_bytes >= 0
+        assert stats.stages[stage].retained_bytes is not None
+    summary = stats.frame_summary()
+    assert summary['decode']['frames'] == len(images)
+    assert summary['encode']['frames'] == len(images)
+    assert summary['decode']['num_pixels'] == 8 * 8 * len(images)
+
+
+def test_memory_off():
+    stats = gifprime.stats.Stats()
+    gif = GIF.from_file(os.path.join(DATA_DIR, 'whitepixel.gif'),
+                        stats=stats)
+    list(gif.images)
+    assert 'peak_bytes' not in stats.as_dict()['lzw']
+    assert stats.frames == []
+
+
+def test_save_stats_per_call(hook_calls):
+    gif = GIF.from_file(os.path.join(DATA_DIR, '8x8gradientanim.gif'),
+                        stats=True)
+    list(gif.images)
+    decode_stats = gif.stats
+    decode_stages = sorted(decode_stats.stages)
+    del hook_calls[:]
+
+    gif.save(StringIO(), stats=False)
+    assert gif.stats is decode_stats
+    assert sorted(decode_stats.stages) == decode_stages
+    assert hook_calls == []
+
+    encode_stats = gifprime.stats.Stats(memory=True)
+    gif.save(StringIO(), stats=encode_stats)
+    assert sorted(encode_stats.stages) == sorted(
+        gifprime.stats.ENCODE_STAGES)
+    assert encode_stats.stages['map'].peak_bytes is not None
+    assert sorted(decode_stats.stages) == decode_stages
+    assert gif.stats is encode_stats
+    assert hook_calls == [(gif, 'encode', encode_stats)]
+
+
+def test_save_stats_enabled(request):
+    gif = GIF.from_file(os.path.join(DATA_DIR, 'whitepixel.gif'))
+    list(gif.images)
+    gifprime.stats.enable()
+    request.addfinalizer(lambda: gifprime.stats.enable(False))
+    gif.save(StringIO())
+    assert sorted(gif.stats.stages) == sorted(gifprime.stats.ENCODE_STAGES)
+    gif.save(StringIO(), stats=False)
+    assert gif.stats.stages['write'].calls == 1
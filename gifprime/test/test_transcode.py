@@ -0,0 +1,74 @@
+"""Tests for the streaming transcoder."""
+
+import os
+import pytest
+
+from gifprime import transcode
+from gifprime.core import GIF
+
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+
+
+def get_frames(filename):
+    gif = GIF.from_file(filename)
+    return [(image.rgba_data, image.delay_ms) for image in gif.images]
+
+
+@pytest.mark.parametrize('name', [
+    '8x8gradientanim_delay_1s_2s_3s.gif',
+    'disposal_bg.gif',
+    'transparent_blit.gif',
+])
+@pytest.mark.parametrize('parallel', [False, True])
+def test_transcode_unchanged(name, parallel, tmpdir):
+    """Frames with few colours are transcoded exactly."""
+    filename = os.path.join(DATA_DIR, name)
+    output = str(tmpdir.join('output.gif'))
+    num_frames = transcode.transcode(filename, output, parallel=parallel)
+    frames = get_frames(filename)
+    assert num_frames == len(frames)
+    assert get_frames(output) == frames
+    assert (GIF.from_file(output).loop_count ==
+            GIF.from_file(filename).loop_count)
+
+
+def test_transcode_options(tmpdir):
+    filename = os.path.join(DATA_DIR, '8x8gradientanim_delay_1s_2s_3s.gif')
+    output = str(tmpdir.join('output.gif'))
+    transcode.transcode(filename, output, delay_scale=0.5, frame_step=2,
+                        crop=(2, 1, 4, 5))
+    frames = get_frames(filename)
+    gif = GIF.from_file(output)
+    assert gif.size == (4, 5)
+    # the second frame is dropped, and the first is shown in its place
+    assert [image.delay_ms for image in gif.images] == [1500, 1500]
+    for image, (rgba_data, _) in zip(gif.images, frames[::2]):
+        assert image.rgba_data == [rgba_data[y * 8 + x]
+                                   for y in xrange(1, 6) for x in xrange(2, 6)]
+
+
+@pytest.mark.parametrize('lut_min_pixels', [1, 1 << 30])
+def test_transcode_lookup(monkeypatch, lut_min_pixels, tmpdir):
+    """Frames are mapped the same with a shared lookup table or dicts."""
+    monkeypatch.setattr(transcode, 'LUT_MIN_PIXELS', lut_min_pixels)
+    filename = os.path.join(DATA_DIR, 'disposal_bg.gif')
+    output = str(tmpdir.join('output.gif'))
+    transcode.transcode(filename, output)
+    assert get_frames(output) == get_frames(filename)
+
+
+def test_transcode_colours(tmpdir):
+    filename = os.path.join(DATA_DIR, 'quantize_manycolours.gif')
+    output = str(tmpdir.join('output.gif'))
+    transcode.transcode(filename, output, max_colours=16)
+    image = GIF.from_file(output).images[0]
+    assert len(set(image.rgba_data)) <= 16
+
+
+def test_transcode_error(tmpdir):
+    filename = os.path.join(DATA_DIR, 'whitepixel.gif')
+    output = str(tmpdir.join('output.gif'))
+    with pytest.raises(transcode.TranscodeError) as excinfo:
+        transcode.transcode(filename, output, crop=(0, 0, 2, 2))
+    assert 'outside' in str(excinfo.value)
@@ -0,0 +1,48 @@
+"""Tests for utility functions and classes."""
+
+import pytest
+import threading
+import time
+
+from gifprime.util import LazyList, StreamingList
+
+
+def test_lazy_list_threads():
+    def slow_iterator():
+        for i in xrange(20):
+            time.sleep(0.001)
+            yield i
+
+    lazy_list = LazyList(slow_iterator(), 20)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(list(lazy_list)))
+               for _ in xrange(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [range(20)] * 4
+
+
+def test_streaming_list():
+    streaming_list = StreamingList()
+    results = []
+    reader = threading.Thread(
+        target=lambda: results.append(list(streaming_list)))
+    reader.start()
+    for i in xrange(5):
+        streaming_list.append(i)
+        assert len(streaming_list) == i + 1
+    streaming_list.close()
+    reader.join()
+    assert results == [range(5)]
+    assert streaming_list[-1] == 4
+
+
+def test_streaming_list_error():
+    streaming_list = StreamingList()
+    streaming_list.append(0)
+    streaming_list.close(ValueError('bad data'))
+    assert streaming_list[0] == 0
+    with pytest.raises(ValueError):
+        streaming_list[1]
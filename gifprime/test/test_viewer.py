@@ -0,0 +1,212 @@
+"""Tests for the viewer's frame cache, prefetching and playback timing."""
+
+import os
+import threading
+import pygame
+import pytest
+
+from gifprime.core import GIF
+from gifprime.viewer import (PREFETCH_POOL, GIFViewer, LazyFrames,
+                             SurfaceCache)
+
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+
+
+def load(name):
+    gif = GIF.from_file(os.path.join(DATA_DIR, name))
+    list(gif.images)
+    return gif
+
+
+def test_scaled_surfaces_share_budget():
+    gif = load('8x8gradientanim.gif')
+    # room for one frame and its scaled copy, but not two
+    frames = LazyFrames(gif, prefetch_count=0, cache_bytes=8 * 8 * 4 + 1024)
+    frames.get_scaled_surface(0, (16, 16))
+    assert frames.surfaces.keys() == [0, (0, (16, 16))]
+    assert frames.num_scaled == 1
+
+    frames.next()
+    surface = frames.get_scaled_surface(1, (16, 16))
+    assert surface.get_size() == (16, 16)
+    assert frames.surfaces.keys() == [1, (1, (16, 16))]
+    assert frames.surfaces.num_bytes <= frames.surfaces.max_bytes
+
+
+def test_scaled_surfaces_dropped_on_resize():
+    gif = load('8x8gradientanim.gif')
+    frames = LazyFrames(gif)
+    frames.get_scaled_surface(0, (16, 16))
+    frames.get_scaled_surface(1, (16, 16))
+    frames.get_scaled_surface(1, (24, 24))
+    assert frames.num_scaled == 1
+    assert (1, (24, 24)) in frames.surfaces.keys()
+    # every decoded frame counts against the budget
+    assert frames.surfaces.num_bytes == (len(gif.images) * 8 * 8 * 4 +
+                                         24 * 24 * 4)
+
+
+def test_surface_cache_budget():
+    cache = SurfaceCache(100)
+    assert cache.put('a', 'A', 60) == []
+    assert cache.put('b', 'B', 60) == ['a']
+    assert cache.num_bytes == 60
+    assert cache.get('a') is None
+    assert cache.get('b') == 'B'
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_surface_cache_lru_order():
+    cache = SurfaceCache(30)
+    for key in 'abc':
+        cache.put(key, key.upper(), 10)
+    # getting 'a' makes 'b' the least recently used
+    cache.get('a')
+    assert cache.put('d', 'D', 10) == ['b']
+    assert cache.keys() == ['c', 'a', 'd']
+    assert cache.put('e', 'E', 20) == ['c', 'a']
+
+
+def test_surface_cache_keep():
+    cache = SurfaceCache(30)
+    for key in 'abc':
+        cache.put(key, key.upper(), 10)
+    assert cache.put('d', 'D', 30, keep=['a', 'b']) == ['c']
+    # over budget, rather than evicting the kept surfaces
+    assert cache.keys() == ['a', 'b', 'd']
+    assert cache.num_bytes == 50
+
+
+def test_surface_cache_without_surface():
+    cache = SurfaceCache(30)
+    cache.put('a', None, 10)
+    assert 'a' in cache
+    assert cache.get('a') is None
+    assert cache.misses == 1
+
+
+def test_evicted_frames_released():
+    gif = GIF.from_file(os.path.join(DATA_DIR, 'disposal_prev.gif'))
+    expected = [image.rgba_bytes for image in gif.images]
+    frame_bytes = gif.size[0] * gif.size[1] * 4
+    frames = LazyFrames(gif, prefetch_count=1, cache_bytes=3 * frame_bytes)
+    assert frames.surfaces.num_bytes <= 3 * frame_bytes
+
+    for _ in xrange(2 * len(gif.images)):
+        surface = frames.current_frame[0]
+        assert (pygame.image.tostring(surface, 'RGBA') ==
+                expected[frames.current])
+        assert frames.surfaces.num_bytes <= 3 * frame_bytes
+        assert len([image for image in gif.images
+                    if not image.is_released]) <= 3
+        frames.next()
+
+
+@pytest.fixture
+def viewer(monkeypatch):
+    # the viewer opens a display, which must not need a window
+    monkeypatch.setenv('SDL_VIDEODRIVER', 'dummy')
+    gif = load('8x8gradientanim_delay_1s_2s_3s.gif')
+    viewer = GIFViewer(lambda: gif)
+    viewer.async_result.wait()
+    viewer.check_loading()
+    viewer.update(0)
+    return viewer
+
+
+def test_time_until_next_frame(viewer):
+    assert viewer.frame_delay == 1000
+    assert viewer.time_until_next_frame() == 1000
+    viewer.update(400)
+    assert viewer.time_until_next_frame() == 600
+    viewer.is_playing = False
+    # nothing changes until the next input event
+    assert viewer.time_until_next_frame() is None
+
+
+def test_update_keeps_frame_deadlines(viewer):
+    viewer.update(1030)
+    assert viewer.frames.current == 1
+    # the next frame is due 2000 ms after the last one was due
+    assert viewer.time_until_next_frame() == 1970
+
+    # more than a frame behind, so the deadlines start again from now
+    viewer.update(5500)
+    assert viewer.frames.current == 2
+    assert viewer.time_until_next_frame() == 3000
+
+
+def test_draw_only_changes(viewer, monkeypatch):
+    updates = []
+    monkeypatch.setattr(pygame.display, 'update', updates.append)
+    viewer.draw()
+    assert updates == [[viewer.screen.get_rect()]]
+
+    # nothing has changed
+    viewer.draw()
+    assert len(updates) == 1
+
+    viewer.update(1000)
+    viewer.draw()
+    frame_pos = ((viewer.size[0] - 8) / 2, (viewer.size[1] - 8) / 2)
+    assert updates[1] == [pygame.Rect(frame_pos, (8, 8))]
+
+
+def record_prefetch(frames, wait_at=None):
+    """Record the frames that prefetches decode, in order.
+
+    If wait_at is set, decoding that frame waits for the returned resume
+    event, after setting the returned started event.
+    """
+    decoded = []
+    started = threading.Event()
+    resume = threading.Event()
+
+    def get_surface(i):
+        decoded.append(i)
+        if i == wait_at:
+            started.set()
+            resume.wait(5)
+    frames.get_surface = get_surface
+    return decoded, started, resume
+
+
+def wait_for_prefetch():
+    # the pool has one thread, so this runs after the queued prefetches
+    PREFETCH_POOL.apply(lambda: None)
+
+
+def test_prefetch_backwards():
+    frames = LazyFrames(load('disposal_prev.gif'), prefetch_count=2)
+    decoded, _, _ = record_prefetch(frames)
+    frames.prefetch(backwards=True)
+    wait_for_prefetch()
+    assert decoded == [3, 2]
+
+
+def test_prefetch_cancelled():
+    frames = LazyFrames(load('disposal_prev.gif'), prefetch_count=3)
+    decoded = []
+
+    def get_surface(i):
+        decoded.append(i)
+        # a newer prefetch has started
+        frames._prefetch_generation += 1
+    frames.get_surface = get_surface
+    frames._prefetch(frames._prefetch_generation, [1, 2, 3])
+    assert decoded == [1]
+
+
+def test_prefetch_restarts_after_seek():
+    frames = LazyFrames(load('disposal_prev.gif'), prefetch_count=2)
+    decoded, started, resume = record_prefetch(frames, wait_at=1)
+    frames.prefetch()
+    assert started.wait(5)
+    # skip forward while frame 1 is being decoded
+    frames.next()
+    frames.next()
+    frames.prefetch()
+    resume.set()
+    wait_for_prefetch()
+    assert decoded == [1, 3, 0]
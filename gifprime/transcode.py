@@ -0,0 +1,391 @@
+"""Transcode a GIF into a new GIF one frame at a time.
+
+Frames flow through four stages: parse, decode, quantize and compress. Each
+stage can run in its own process, connected to the next by a bounded queue,
+so only a few frames are in memory at once however long the GIF is. Every
+frame gets its own local colour table, so no stage needs to see the whole
+animation.
+
+Items passed between stages are tuples whose first element is their kind:
+('header', ...) and ('block', ...) from the parser, ('info', size,
+loop_count), ('frame', ...), ('loop', loop_count), ('comment', text), and
+('error', traceback) if a stage fails.
+"""
+
+from math import log
+import construct
+import multiprocessing
+import traceback
+
+from gifprime.core import GIF
+from gifprime.quantize import (LUT_MIN_PIXELS, LUT_SIZE, exact_palette,
+                               gif_colour_table, has_alpha,
+                               quantize_histogram, rgba_histogram)
+from gifprime import lzw
+import gifprime.parser
+
+# number of items buffered between each pair of stages
+QUEUE_SIZE = 4
+
+
+class TranscodeError(Exception):
+    """A pipeline stage failed. The message is the stage's traceback."""
+
+
+def _plain(obj):
+    """Convert parsed Containers to dicts and lists, which can be pickled."""
+    if isinstance(obj, construct.Container):
+        return dict((key, _plain(value)) for key, value in obj.items())
+    elif isinstance(obj, list):
+        return [_plain(value) for value in obj]
+    return obj
+
+
+def _container(obj):
+    """Convert the result of _plain back to Containers."""
+    if isinstance(obj, dict):
+        return construct.Container(**dict((key, _container(value))
+                                          for key, value in obj.items()))
+    elif isinstance(obj, list):
+        return [_container(value) for value in obj]
+    return obj
+
+
+def parse_blocks(filename):
+    """Yield the parsed header of a GIF file and then each of its blocks."""
+    with open(filename, 'rb') as stream:
+        yield ('header', _plain(gifprime.parser.header.parse_stream(stream)))
+        while True:
+            block = gifprime.parser.block.parse_stream(stream)
+            yield ('block', _plain(block))
+            if block.block_start == 0x3B:
+                return
+
+
+def _crop_rgba(rgba, size, crop):
+    """Return the (left, top, width, height) rectangle of RGBA bytes."""
+    left, top, width, height = crop
+    return ''.join(rgba[((y * size[0]) + left) * 4:
+                        ((y * size[0]) + left + width) * 4]
+                   for y in xrange(top, top + height))
+
+
+def decode_frames(items, frame_step=1, delay_scale=1.0, crop=None,
+                  force_deinterlace=None):
+    """Decode parsed blocks and yield info, frames and the comment.
+
+    The loop count is given again at the end if it was only found after the
+    first frame.
+
+    Frames are ('frame', rgba_bytes, delay_ms). Only every frame_step-th
+    frame is kept, shown for as long as the frames dropped after it, and
+    delays are multiplied by delay_scale. If crop is given, frames are cut
+    to its (left, top, width, height) rectangle.
+    """
+    items = iter(items)
+    header = _container(next(items)[1])
+    gif = GIF.from_blocks(header, (_container(block) for _, block in items),
+                          force_deinterlace=force_deinterlace)
+
+    if crop is not None:
+        left, top, width, height = crop
+        if (left < 0 or top < 0 or width <= 0 or height <= 0 or
+                left + width > gif.size[0] or top + height > gif.size[1]):
+            raise ValueError('Crop {} is outside the {}x{} image'.format(
+                crop, gif.size[0], gif.size[1]))
+        size = (width, height)
+    else:
+        size = gif.size
+
+    # the last kept frame is held until the delays of the frames dropped
+    # after it are known
+    kept = None
+    loop_count = None
+    for i, image in enumerate(gif.images):
+        if i == 0:
+            # the loop count usually comes before the first image
+            loop_count = gif.loop_count
+            yield ('info', size, loop_count)
+        if i % frame_step == 0:
+            if kept is not None:
+                yield ('frame', kept[0], int(round(kept[1] * delay_scale)))
+            rgba = image.rgba_bytes
+            if crop is not None:
+                rgba = _crop_rgba(rgba, gif.size, crop)
+            kept = [rgba, image.delay_ms]
+        else:
+            kept[1] += image.delay_ms
+    if kept is not None:
+        yield ('frame', kept[0], int(round(kept[1] * delay_scale)))
+
+    if gif.loop_count != loop_count:
+        yield ('loop', gif.loop_count)
+    if gif.comment is not None:
+        yield ('comment', gif.comment)
+
+
+def quantize_frames(items, max_colours=256, quantizer='octree'):
+    """Give each frame its own colour table and map it to indices.
+
+    Frames become ('frame', colour_table, indices, transparent_index,
+    delay_ms), where transparent_index is None if the frame is opaque.
+    """
+    # lookup table shared by the frames large enough to need one. Every
+    # colour of a frame is in its map, so entries left by earlier frames are
+    # never used.
+    lut = None
+    for item in items:
+        if item[0] != 'frame':
+            yield item
+            continue
+        _, rgba, delay_ms = item
+
+        # if there is any alpha, need to reserve space for a transparent colour
+        use_transparency = has_alpha([rgba])
+        num_colours = max_colours - 1 if use_transparency else max_colours
+
+        colour_counts = rgba_histogram(rgba)
+        palette = exact_palette(colour_counts, num_colours)
+        if palette is None:
+            palette = quantize_histogram(colour_counts, num_colours,
+                                         quantizer)
+        colour_list, colour_map = palette
+        colour_table, transparent_index = gif_colour_table(colour_list,
+                                                           use_transparency)
+
+        if len(rgba) / 4 < LUT_MIN_PIXELS:
+            frame_lut = colour_map.fill_lut({})
+        else:
+            if lut is None:
+                lut = bytearray(LUT_SIZE)
+            frame_lut = colour_map.fill_lut(lut)
+        indices = colour_map.map_pixels(rgba, transparent_index, frame_lut)
+        yield ('frame', colour_table, indices, transparent_index, delay_ms)
+
+
+def compress_frames(items):
+    """Compress the colour indices of each frame with LZW.
+
+    Frames become ('frame', colour_table, lzw_min, compressed_indices,
+    transparent_index, delay_ms).
+    """
+    for item in items:
+        if item[0] != 'frame':
+            yield item
+            continue
+        _, colour_table, indices, transparent_index, delay_ms = item
+        lzw_min = max(2, int(log(len(colour_table), 2)))
+        yield ('frame', colour_table, lzw_min, lzw.compress(indices, lzw_min),
+               transparent_index, delay_ms)
+
+
+def write_gif(items, stream):
+    """Write compressed frames to stream as a GIF and return the frame count.
+    """
+    num_frames = 0
+    size = None
+    comment = None
+    for item in items:
+        if item[0] == 'info':
+            _, size, loop_count = item
+            write_header(stream, size)
+            write_loop_count(stream, loop_count)
+        elif item[0] == 'loop':
+            write_loop_count(stream, item[1])
+        elif item[0] == 'comment':
+            comment = item[1]
+        elif item[0] == 'frame':
+            (_, colour_table, lzw_min, compressed_indices, transparent_index,
+             delay_ms) = item
+            write_frame(stream, size, colour_table, lzw_min,
+                        compressed_indices, transparent_index, delay_ms)
+            num_frames += 1
+
+    if size is None:
+        raise ValueError('The GIF has no frames')
+    write_trailer(stream, comment)
+    return num_frames
+
+
+def write_header(stream, size, gct=None):
+    """Write the GIF header, with gct as the global colour table.
+
+    If gct is None, frames must have local colour tables.
+    """
+    gifprime.parser.header.build_stream(construct.Container(
+        magic = 'GIF89a',
+        logical_screen_descriptor = construct.Container(
+            logical_width = size[0],
+            logical_height = size[1],
+            # even if every frame has a local colour table, a small global
+            # one makes decoders use transparency as the background colour
+            gct_flag = True,
+            colour_res = 7,
+            sort_flag = False,
+            gct_size = int(log(len(gct), 2)) - 1 if gct is not None else 0,
+            bg_col_index = 0,
+            pixel_aspect = 0,
+        ),
+        gct = gct if gct is not None else [(0, 0, 0), (0, 0, 0)],
+    ), stream)
+
+
+def write_loop_count(stream, loop_count):
+    """Write the extension giving the number of times to show the animation.
+    """
+    # if this gif loops, add the application extension for looping
+    if loop_count != 1:
+        data = construct.Struct(
+            'loop',
+            construct.ULInt8('id'),
+            construct.ULInt16('count'),
+        ).build(construct.Container(id=1, count=max(0, loop_count - 1)))
+        gifprime.parser.block.build_stream(construct.Container(
+            block_type = 'application_extension',
+            block_start = 0x21,
+            ext_label = 0xFF,
+            block_size = 11,
+            app_id = 'NETSCAPE',
+            app_auth_code = '2.0',
+            app_data = data,
+        ), stream)
+
+
+def write_frame(stream, size, colour_table, lzw_min, compressed_indices,
+                transparent_index, delay_ms, interlaced=False):
+    """Write a frame that covers the whole image.
+
+    If colour_table is None, the frame uses the global colour table. If
+    interlaced is True, compressed_indices must have the rows in interlaced
+    order.
+    """
+    gifprime.parser.block.build_stream(construct.Container(
+        block_type = 'gce',
+        block_start = 0x21,
+        ext_label = 0xF9,
+        block_size = 4,
+        # every frame covers the whole image, so clear it to the background
+        # after showing it, so that transparent pixels in the next frame
+        # stay transparent
+        disposal_method = 2,
+        user_input_flag = False,
+        transparent_colour_flag = transparent_index is not None,
+        delay_time = int(round(delay_ms / 10.0)),
+        transparent_colour_index = transparent_index or 0,
+        terminator = 0,
+    ), stream)
+    gifprime.parser.block.build_stream(construct.Container(
+        block_type = 'image',
+        block_start = 0x2C,
+        image_descriptor = construct.Container(
+            left = 0,
+            top = 0,
+            width = size[0],
+            height = size[1],
+            lct_flag = colour_table is not None,
+            interlace_flag = interlaced,
+            sort_flag = False,
+            lct_size = (int(log(len(colour_table), 2)) - 1
+                        if colour_table is not None else 0),
+        ),
+        lct = colour_table,
+        lzw_min = lzw_min,
+        compressed_indices = compressed_indices,
+    ), stream)
+
+
+def write_trailer(stream, comment=None):
+    """Write the comment, if there is one, and the end of the GIF."""
+    if comment is not None:
+        gifprime.parser.block.build_stream(construct.Container(
+            block_type = 'comment',
+            block_start = 0x21,
+            ext_label = 0xFE,
+            comment = comment,
+        ), stream)
+    gifprime.parser.block.build_stream(construct.Container(
+        block_start = 0x3B,
+        terminator = 'terminator',
+    ), stream)
+
+
+def _iter_queue(queue):
+    """Yield items from queue until the end of the stream of items."""
+    while True:
+        item = queue.get()
+        if item is None:
+            return
+        if item[0] == 'error':
+            raise TranscodeError(item[1])
+        yield item
+
+
+def _run_stage(stage, in_queue, out_queue, args):
+    """Run a stage on the items from in_queue, putting its items on out_queue.
+
+    The first stage has no in_queue.
+    """
+    try:
+        if in_queue is None:
+            items = stage(*args)
+        else:
+            items = stage(_iter_queue(in_queue), *args)
+        for item in items:
+            out_queue.put(item)
+    except TranscodeError as e:
+        # pass on the failure of an earlier stage
+        out_queue.put(('error', e.args[0]))
+    except Exception:
+        out_queue.put(('error', traceback.format_exc()))
+    else:
+        out_queue.put(None)
+
+
+def transcode(source, dest, max_colours=256, quantizer='octree',
+              delay_scale=1.0, frame_step=1, crop=None, force_deinterlace=None,
+              parallel=True, queue_size=QUEUE_SIZE):
+    """Transcode the GIF file source into the GIF file dest.
+
+    Each frame is quantized to at most max_colours colours with quantizer.
+    See decode_frames for delay_scale, frame_step and crop.
+
+    If parallel is True, the parse, decode, quantize and compress stages
+    each run in a separate process, with at most queue_size items waiting
+    between stages. Otherwise everything runs in this process. Returns the
+    number of frames written.
+    """
+    stages = [
+        (parse_blocks, (source,)),
+        (decode_frames, (frame_step, delay_scale, crop, force_deinterlace)),
+        (quantize_frames, (max_colours, quantizer)),
+        (compress_frames, ()),
+    ]
+
+    if not parallel:
+        items = None
+        for stage, args in stages:
+            items = stage(*args) if items is None else stage(items, *args)
+        with open(dest, 'wb') as stream:
+            return write_gif(items, stream)
+
+    processes = []
+    in_queue = None
+    for stage, args in stages:
+        out_queue = multiprocessing.Queue(queue_size)
+        process = multiprocessing.Process(
+            target=_run_stage, args=(stage, in_queue, out_queue, args))
+        process.daemon = True
+        process.start()
+        processes.append(process)
+        in_queue = out_queue
+
+    try:
+        with open(dest, 'wb') as stream:
+            num_frames = write_gif(_iter_queue(in_queue), stream)
+    except:
+        for process in processes:
+            process.terminate()
+        raise
+    for process in processes:
+        process.join()
+    return num_frames
@@ -2,6 +2,7 @@
 
 
 import os
+import threading
 
 
 def readable_size(num_bytes):
@@ -22,13 +23,17 @@ def static_path(filename):
 
 
 class LazyList(object):
-    """A lazily-loaded list that is built from an iterator."""
+    """A lazily-loaded list that is built from an iterator.
+
+    Safe to use from multiple threads.
+    """
 
     def __init__(self, iterator, size):
         self._values = []
         self._iterator = iterator
         self._max_size = size
         self._consumed = False
+        self._lock = threading.RLock()
 
     def __len__(self):
         if self._consumed:
@@ -39,23 +44,25 @@ class LazyList(object):
     def __getitem__(self, index):
         if self._consumed:
             return self._values[index]
-        else:
+
+        with self._lock:
             if index >= self._max_size:
                 raise IndexError('{} is out of range'.format(index))
 
             while len(self._values) <= index:
                 self._values.append(next(self._iterator))
 
-            if len(self._values) == self._max_size:
+            if len(self._values) == self._max_size and not self._consumed:
                 self._consume_remaining()
 
             return self._values[index]
 
     def __delitem__(self, index):
-        if not self._consumed:
-            self._consume_remaining()
+        with self._lock:
+            if not self._consumed:
+                self._consume_remaining()
 
-        del self._values[index]
+            del self._values[index]
 
     def __iter__(self):
         for i in xrange(len(self)):
@@ -70,7 +77,71 @@ class LazyList(object):
             pass
 
     def append(self, item):
-        if not self._consumed:
-            self._consume_remaining()
+        with self._lock:
+            if not self._consumed:
+                self._consume_remaining()
 
-        self._values.append(item)
+            self._values.append(item)
+
+
+class StreamingList(object):
+    """A list that is appended to by one thread while others read it.
+
+    The length is the number of items available so far. Getting an item that
+    is not available yet blocks until it is, or raises IndexError if the list
+    is closed without it.
+    """
+
+    def __init__(self):
+        self._values = []
+        self._closed = False
+        self._error = None
+        self._condition = threading.Condition()
+
+    def __len__(self):
+        return len(self._values)
+
+    def __getitem__(self, index):
+        with self._condition:
+            if index < 0:
+                # the end of the list is not known until it is closed
+                self._wait_closed()
+            while index >= len(self._values) and not self._closed:
+                self._condition.wait()
+            if index >= len(self._values) and self._error is not None:
+                raise self._error
+            return self._values[index]
+
+    def __iter__(self):
+        i = 0
+        while True:
+            try:
+                yield self[i]
+            except IndexError:
+                return
+            i += 1
+
+    def _wait_closed(self):
+        while not self._closed:
+            self._condition.wait()
+
+    @property
+    def is_closed(self):
+        """True if no more items will be added."""
+        return self._closed
+
+    def append(self, item):
+        with self._condition:
+            self._values.append(item)
+            self._condition.notify_all()
+
+    def close(self, error=None):
+        """Mark the list as complete.
+
+        If error is set, it is raised when getting items that were never
+        added.
+        """
+        with self._condition:
+            self._closed = True
+            self._error = error
+            self._condition.notify_all()
@@ -1,41 +1,203 @@
 """Graphical user interface for viewing GIF animations."""
 
 import pygame
+import collections
 import multiprocessing
 import multiprocessing.pool
+import threading
 from math import cos, sin, pi
 
 from gifprime.util import readable_size, static_path
 
 
-pygame.init()
-pygame.font.init()
 POOL = multiprocessing.pool.ThreadPool(processes=1)
+PREFETCH_POOL = multiprocessing.pool.ThreadPool(processes=1)
+# posted by a timer to wake the viewer at the next frame deadline
+WAKE_EVENT = pygame.USEREVENT
+
+
+class SurfaceCache(object):
+    """A least recently used cache of surfaces with a budget in bytes.
+
+    A key can be cached with None for its surface, to count memory that has
+    no surface yet against the budget. Getting it is a miss.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.num_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._surfaces = collections.OrderedDict()  # key -> (surface, bytes)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._surfaces)
+
+    def __contains__(self, key):
+        return key in self._surfaces
+
+    def keys(self):
+        """Return the keys of the cached surfaces, least recently used first.
+        """
+        with self._lock:
+            return list(self._surfaces)
+
+    def discard(self, predicate):
+        """Remove the surfaces whose keys match predicate."""
+        with self._lock:
+            for key in list(self._surfaces):
+                if predicate(key):
+                    self.num_bytes -= self._surfaces.pop(key)[1]
+
+    def get(self, key):
+        """Return the surface for key, or None if it is not cached."""
+        with self._lock:
+            entry = self._surfaces.get(key)
+            if entry is None or entry[0] is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._surfaces[key] = self._surfaces.pop(key)
+            return entry[0]
+
+    def put(self, key, surface, num_bytes, keep=()):
+        """Cache surface, which uses num_bytes of memory.
+
+        Evicts least recently used surfaces until the cache is within budget,
+        except for those whose keys are in keep. Returns the evicted keys.
+        """
+        with self._lock:
+            old_entry = self._surfaces.pop(key, None)
+            if old_entry is not None:
+                self.num_bytes -= old_entry[1]
+            self._surfaces[key] = (surface, num_bytes)
+            self.num_bytes += num_bytes
+
+            evicted = []
+            for old_key in list(self._surfaces):
+                if self.num_bytes <= self.max_bytes:
+                    break
+                if old_key == key or old_key in keep:
+                    continue
+                self.num_bytes -= self._surfaces.pop(old_key)[1]
+                evicted.append(old_key)
+            return evicted
 
 
 class LazyFrames(object):
-    """Lazy GIF image 'generator'."""
+    """Lazy GIF image 'generator'.
 
-    def __init__(self, gif):
+    Decoded frames and their surfaces are kept within a budget. The pixels of
+    frames that are evicted are released, if the GIF can decode them again.
+    """
+
+    def __init__(self, gif, prefetch_count=8, cache_bytes=256 * 1024 * 1024):
         self.gif = gif
-        self.surfaces = {}
+        # frames keyed by index, and frames scaled to fit the window keyed by
+        # (index, size), sharing one budget
+        self.surfaces = SurfaceCache(cache_bytes)
+        # size of the scaled frames in the cache
+        self.scaled_size = None
+        # number of decoded frames counted against the budget
+        self._num_tracked = 0
+        self._track_lock = threading.Lock()
         self.current = 0
         self.shown_count = 0
+        # number of frames to decode ahead of the current frame
+        self.prefetch_count = prefetch_count
+        self.backwards = False
+        # incremented to cancel the running prefetch
+        self._prefetch_generation = 0
 
     def get_surface(self, i):
         """Gets the PyGame Surface corresponding to image[i] and its delay."""
-        if i not in self.surfaces:
-            image = self.gif.images[i]
-            data = ''.join(''.join(chr(c) for c in pixel)
-                           for pixel in image.rgba_data)
-            self.surfaces[i] = pygame.image.fromstring(data, self.gif.size,
-                                                       'RGBA')
+        self._track_decoded()
+        surface = self.surfaces.get(i)
+        if surface is None:
+            # the surface shares its pixels with the image's buffer
+            rgba_bytes = self.gif.rgba_bytes(i)
+            surface = pygame.image.frombuffer(rgba_bytes, self.gif.size,
+                                              'RGBA')
+            self._cache(i, surface, len(rgba_bytes))
+
+        return surface, self.gif.images[i].delay_ms
+
+    def get_scaled_surface(self, i, size):
+        """Gets the Surface for image[i] scaled to size.
 
-        return self.surfaces[i], self.gif.images[i].delay_ms
+        Only frames scaled to the latest size are kept.
+        """
+        if size != self.scaled_size:
+            # frames scaled for an old window size won't be shown again
+            self.surfaces.discard(lambda key: isinstance(key, tuple))
+            self.scaled_size = size
+        surface = self.surfaces.get((i, size))
+        if surface is None:
+            surface = pygame.transform.scale(self.get_surface(i)[0], size)
+            self._cache((i, size), surface, size[0] * size[1] * 4)
+        return surface
+
+    def _cache(self, key, surface, num_bytes):
+        """Cache a surface, releasing the pixels of frames that are evicted.
+        """
+        # never evict the frames about to be shown
+        keep = self.upcoming()
+        keep += [(i, self.scaled_size) for i in keep]
+        for old_key in self.surfaces.put(key, surface, num_bytes, keep=keep):
+            if not isinstance(old_key, tuple):
+                self.gif.release_image(old_key)
+
+    def _track_decoded(self):
+        """Count the frames decoded since the last call against the budget.
+
+        Frames decoded ahead, such as by a progressive load, are then
+        released when the budget is exceeded, like any other frame.
+        """
+        num_bytes = self.gif.size[0] * self.gif.size[1] * 4
+        with self._track_lock:
+            num_decoded = self.gif.num_decoded
+            for i in xrange(self._num_tracked, num_decoded):
+                if i not in self.surfaces:
+                    self._cache(i, None, num_bytes)
+            self._num_tracked = max(self._num_tracked, num_decoded)
+
+    @property
+    def num_scaled(self):
+        """The number of scaled frames in the cache."""
+        return len([key for key in self.surfaces.keys()
+                    if isinstance(key, tuple)])
+
+    def upcoming(self):
+        """Return the current and next few frame indices in playback order."""
+        step = -1 if self.backwards else 1
+        return [(self.current + step * n) % len(self.gif.images)
+                for n in xrange(self.prefetch_count + 1)]
+
+    def prefetch(self, backwards=False):
+        """Start decoding the frames after the current one in the background.
+
+        Frames are decoded in the playback direction. Any prefetch that is
+        still running is cancelled.
+        """
+        self._prefetch_generation += 1
+        self.backwards = backwards
+        PREFETCH_POOL.apply_async(self._prefetch, (self._prefetch_generation,
+                                                   self.upcoming()[1:]))
+
+    def _prefetch(self, generation, indices):
+        for i in indices:
+            if generation != self._prefetch_generation:
+                return  # cancelled by a newer prefetch
+            self.get_surface(i)
 
     def has_next(self):
         """Returns True iff. there is a next frame."""
-        if self.gif.loop_count == 0:
+        if (self.gif.is_loading and
+                self.current == len(self.gif.images) - 1):
+            # wait for the next frame to be decoded
+            return False
+        elif self.gif.loop_count == 0:
             return True
         else:
             is_last_loop = self.loop_count == self.gif.loop_count - 1
@@ -71,9 +233,13 @@ class GIFViewer(object):
     # minimum size that the window will open at
     MIN_SIZE = (400, 250)
 
-    def __init__(self, load_gif_f, fps=60):
+    def __init__(self, load_gif_f, fps=60, cache_bytes=256 * 1024 * 1024):
+        pygame.init()
+        pygame.font.init()
+
         self.gif = None
         self.fps = fps
+        self.cache_bytes = cache_bytes
 
         self.is_loading = True
         self.is_playing = True
@@ -89,6 +255,16 @@ class GIFViewer(object):
         self.frame_delay = 0
         self.ms_since_last_frame = 0
         self.info_lines = None
+        # rendered info lines, kept until the text changes
+        self.info_surfaces = []
+        self.rendered_info_lines = None
+        # window background with the checkerboard and border for the current
+        # frame layout, kept until the layout changes
+        self.bg_layer = None
+        self.bg_layout = None
+        # state of the last drawn screen, to skip drawing when unchanged
+        self.drawn_state = None
+        self.drawn_info_rects = []
         self.loading_elapsed = 0
 
         # Setup pygame stuff
@@ -101,15 +277,19 @@ class GIFViewer(object):
         self.async_result = POOL.apply_async(load_gif_f)
 
     def check_loading(self):
-        """Check if the gif has finished loading."""
-        try:
-            # TODO: error handling
-            gif = self.async_result.get(False)
-        except multiprocessing.TimeoutError:
+        """Check if the gif has loaded enough to show the first frame."""
+        if self.gif is None:
+            try:
+                # TODO: error handling
+                self.gif = self.async_result.get(False)
+            except multiprocessing.TimeoutError:
+                return
+        # frames may still be loading in the background
+        if self.gif.is_loading and len(self.gif.images) == 0:
             return
         self.is_loading = False
-        self.gif = gif
-        self.frames = LazyFrames(gif)
+        gif = self.gif
+        self.frames = LazyFrames(gif, cache_bytes=self.cache_bytes)
         self.set_title()
         self.size = (max(self.MIN_SIZE[0], self.gif.size[0]),
                      max(self.MIN_SIZE[1], self.gif.size[1]))
@@ -132,9 +312,12 @@ class GIFViewer(object):
         self.screen = pygame.display.set_mode(self.size, pygame.RESIZABLE)
 
     def show_next_frame(self, backwards=False):
-        """Switch to the next frame, or do nothing if there isn't one."""
+        """Switch to the next frame, or do nothing if there isn't one.
+
+        Returns True if the frame was switched.
+        """
         if self.is_loading:
-            return
+            return False
         if self.current_frame is None:
             self.current_frame, self.frame_delay = self.frames.current_frame
         elif not backwards and self.frames.has_next():
@@ -145,37 +328,79 @@ class GIFViewer(object):
             self.frames.prev()
             self.current_frame, self.frame_delay = self.frames.current_frame
             self.ms_since_last_frame = 0
+        else:
+            return False
+        # decode the next frames while this one is shown
+        self.frames.prefetch(backwards=self.is_reversed)
+        return True
 
     def handle_events(self):
         """Poll and handle pygame events."""
         for event in pygame.event.get():
-            if event.type == pygame.QUIT:
+            self.handle_event(event)
+
+    def handle_event(self, event):
+        """Handle a single pygame event."""
+        if event.type == pygame.QUIT:
+            self.is_exiting = True
+        elif event.type == pygame.VIDEORESIZE:
+            self.size = event.size
+            # Reset the video mode so we can draw to a larger window
+            self.set_screen()
+        elif event.type == pygame.VIDEOEXPOSE:
+            # the window contents need to be redrawn
+            self.drawn_state = None
+        elif event.type == pygame.KEYUP:
+            if event.key in [pygame.K_ESCAPE, pygame.K_q]:
                 self.is_exiting = True
-            elif event.type == pygame.VIDEORESIZE:
-                self.size = event.size
-                # Reset the video mode so we can draw to a larger window
-                self.set_screen()
-            elif event.type == pygame.KEYUP:
-                if event.key in [pygame.K_ESCAPE, pygame.K_q]:
-                    self.is_exiting = True
-                elif event.key == pygame.K_LEFT:
-                    # skip back one frame
-                    self.show_next_frame(backwards=True)
-                elif event.key == pygame.K_RIGHT:
-                    # skip forward one frame
-                    self.show_next_frame()
-                elif event.key == pygame.K_SPACE:
-                    # toggle playback
-                    self.is_playing = not self.is_playing
-                elif event.key == pygame.K_r:
-                    # reverse playback direction
-                    self.is_reversed = not self.is_reversed
-                elif event.key == pygame.K_s:
-                    # toggle scale to fit
-                    self.is_scaled = not self.is_scaled
-                elif event.key == pygame.K_i:
-                    # toggle showing info
-                    self.is_showing_info = not self.is_showing_info
+            elif event.key == pygame.K_LEFT:
+                # skip back one frame
+                self.show_next_frame(backwards=True)
+            elif event.key == pygame.K_RIGHT:
+                # skip forward one frame
+                self.show_next_frame()
+            elif event.key == pygame.K_SPACE:
+                # toggle playback
+                self.is_playing = not self.is_playing
+            elif event.key == pygame.K_r:
+                # reverse playback direction
+                self.is_reversed = not self.is_reversed
+                if not self.is_loading:
+                    self.frames.prefetch(backwards=self.is_reversed)
+            elif event.key == pygame.K_s:
+                # toggle scale to fit
+                self.is_scaled = not self.is_scaled
+            elif event.key == pygame.K_i:
+                # toggle showing info
+                self.is_showing_info = not self.is_showing_info
+
+    def time_until_next_frame(self):
+        """Return the ms until the display may next change.
+
+        Returns None if nothing will change until the next input event.
+        """
+        timeout = None
+        if self.is_playing and (self.frames.has_next() or
+                                self.gif.is_loading):
+            timeout = max(0, self.frame_delay - self.ms_since_last_frame)
+        if self.gif.is_loading:
+            # check for newly decoded frames
+            poll_ms = 1000 / self.fps
+            timeout = poll_ms if timeout is None else min(timeout, poll_ms)
+        return timeout
+
+    def wait(self, timeout):
+        """Sleep until an input event arrives or timeout ms have passed.
+
+        Waits for an input event if timeout is None.
+        """
+        if timeout is not None:
+            if timeout <= 0:
+                return
+            pygame.time.set_timer(WAKE_EVENT, timeout)
+        event = pygame.event.wait()
+        pygame.time.set_timer(WAKE_EVENT, 0)
+        self.handle_event(event)
 
     def update_loading(self, elapsed):
         """Update the loading screen."""
@@ -186,7 +411,13 @@ class GIFViewer(object):
         if self.is_playing:
             self.ms_since_last_frame += elapsed
             if self.ms_since_last_frame >= self.frame_delay:
-                self.show_next_frame(backwards=self.is_reversed)
+                late = self.ms_since_last_frame - self.frame_delay
+                if self.show_next_frame(backwards=self.is_reversed):
+                    # count the next delay from this frame's deadline rather
+                    # than from now, so lateness does not accumulate, unless
+                    # playback has fallen more than a frame behind
+                    if late < self.frame_delay:
+                        self.ms_since_last_frame = late
 
         self.info_lines = [
             '{} {} {} {}'.format('Playing' if self.is_playing else 'Paused',
@@ -204,6 +435,15 @@ class GIFViewer(object):
                 readable_size(self.gif.compressed_size),
                 readable_size(self.gif.uncompressed_size),
             ),
+            'frame cache: {} hits, {} misses, {} frames, {} scaled ({} / {})'
+            .format(
+                self.frames.surfaces.hits,
+                self.frames.surfaces.misses,
+                len(self.frames.surfaces) - self.frames.num_scaled,
+                self.frames.num_scaled,
+                readable_size(self.frames.surfaces.num_bytes),
+                readable_size(self.frames.surfaces.max_bytes),
+            ),
         ]
 
         # Display comments if they exist
@@ -234,8 +474,58 @@ class GIFViewer(object):
 
         pygame.display.flip()
 
+    def get_background(self, frame_pos, frame_size):
+        """Return the window background for a frame at the given position.
+
+        The checkerboard behind the frame and its border are composed once
+        for each layout.
+        """
+        layout = (self.size, frame_pos, frame_size)
+        if layout == self.bg_layout:
+            return self.bg_layer
+
+        bg_layer = pygame.Surface(self.size).convert(self.screen)
+        # draw the background over the entire window
+        # this also clears the previous frame, so transparency works correctly
+        bg_layer.fill((220, 220, 220))
+        frame_right = frame_pos[0] + frame_size[0]
+        frame_bottom = frame_pos[1] + frame_size[1]
+        for x in range(frame_pos[0], frame_right, self.bg_surface.get_width()):
+            for y in range(frame_pos[1], frame_bottom,
+                           self.bg_surface.get_height()):
+                bg_layer.blit(self.bg_surface, (x, y),
+                              (0, 0, frame_right - x, frame_bottom - y))
+        # draw border around the frame
+        pygame.draw.rect(bg_layer, (255, 255, 255), (
+            frame_pos[0] - 1, frame_pos[1] - 1,
+            frame_size[0] + 2, frame_size[1] + 2
+        ), 1)
+        pygame.draw.rect(bg_layer, (150, 150, 150), (
+            frame_pos[0] - 2, frame_pos[1] - 2,
+            frame_size[0] + 4, frame_size[1] + 4
+        ), 1)
+
+        self.bg_layer = bg_layer
+        self.bg_layout = layout
+        return bg_layer
+
+    def get_info_surfaces(self):
+        """Return the rendered info lines, rendering them if they changed."""
+        if self.info_lines != self.rendered_info_lines:
+            self.info_surfaces = []
+            for line in self.info_lines:
+                font_surface = self.font.render(line.rstrip(), True, (0, 0, 0),
+                                                (255, 255, 255))
+                font_surface.set_alpha(200)
+                self.info_surfaces.append(font_surface)
+            self.rendered_info_lines = self.info_lines
+        return self.info_surfaces
+
     def draw(self):
-        """Draw the current animation state."""
+        """Draw the current animation state.
+
+        Does nothing if the screen already shows the current state.
+        """
         if self.is_scaled:
             # scale the gif to fill the window
             scale_factor = min(
@@ -246,49 +536,48 @@ class GIFViewer(object):
                 int(self.gif.size[0] * scale_factor),
                 int(self.gif.size[1] * scale_factor)
             )
-            scaled_frame = pygame.transform.scale(self.current_frame,
-                                                  scaled_size)
+            scaled_frame = self.frames.get_scaled_surface(self.frames.current,
+                                                          scaled_size)
         else:
             # no scaling
             scaled_size = self.gif.size
             scaled_frame = self.current_frame
 
+        info_surfaces = self.get_info_surfaces() if self.is_showing_info else []
         # position to draw frame so it is centered
         frame_pos = (self.size[0] / 2 - scaled_size[0] / 2,
                      self.size[1] / 2 - scaled_size[1] / 2)
-        # draw the background over the entire window
-        # this also clears the previous frame, so transparency works correctly
-        self.screen.fill((220, 220, 220))
-        frame_right = frame_pos[0] + scaled_size[0]
-        frame_bottom = frame_pos[1] + scaled_size[1]
-        for x in range(frame_pos[0], frame_right, self.bg_surface.get_width()):
-            for y in range(frame_pos[1], frame_bottom,
-                           self.bg_surface.get_height()):
-                self.screen.blit(self.bg_surface, (x, y),
-                                 (0, 0, frame_right - x, frame_bottom - y))
-        # draw border around the frame
-        pygame.draw.rect(self.screen, (255, 255, 255), (
-            frame_pos[0] - 1, frame_pos[1] - 1,
-            scaled_size[0] + 2, scaled_size[1] + 2
-        ), 1)
-        pygame.draw.rect(self.screen, (150, 150, 150), (
-            frame_pos[0] - 2, frame_pos[1] - 2,
-            scaled_size[0] + 4, scaled_size[1] + 4
-        ), 1)
+        layout = (self.size, frame_pos, scaled_size)
+        state = (layout, scaled_frame, tuple(info_surfaces))
+        if state == self.drawn_state:
+            return
+
+        # find the areas of the window that have changed
+        if self.drawn_state is None or self.drawn_state[0] != layout:
+            dirty_rects = [self.screen.get_rect()]
+        else:
+            # the translucent info is drawn over everything else, so always
+            # redraw what was under it
+            dirty_rects = list(self.drawn_info_rects)
+            if scaled_frame is not self.drawn_state[1]:
+                dirty_rects.append(pygame.Rect(frame_pos, scaled_size))
+        self.drawn_state = state
+
+        background = self.get_background(frame_pos, scaled_size)
+        for rect in dirty_rects:
+            self.screen.blit(background, rect, rect)
         # draw the frame
         self.screen.blit(scaled_frame, frame_pos)
         # draw info
-        if self.is_showing_info:
-            left = 5
-            current_y = 5
-            for line in self.info_lines:
-                font_surface = self.font.render(line.rstrip(), True, (0, 0, 0),
-                                                (255, 255, 255))
-                font_surface.set_alpha(200)
-                self.screen.blit(font_surface, (left, current_y))
-                current_y += font_surface.get_height() + 2
+        left = 5
+        current_y = 5
+        self.drawn_info_rects = []
+        for font_surface in info_surfaces:
+            self.drawn_info_rects.append(
+                self.screen.blit(font_surface, (left, current_y)))
+            current_y += font_surface.get_height() + 2
 
-        pygame.display.flip()
+        pygame.display.update(dirty_rects + self.drawn_info_rects)
 
     def show(self):
         """Show the GUI and enter the main event loop."""
@@ -304,4 +593,7 @@ class GIFViewer(object):
                 self.draw_loading()
                 self.check_loading()
             self.handle_events()
+            # limit the frame rate, then sleep until the next frame is due
             self.clock.tick(self.fps)
+            if not self.is_loading and not self.is_exiting:
+                self.wait(self.time_until_next_frame())